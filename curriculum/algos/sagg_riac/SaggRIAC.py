@@ -1,6 +1,3 @@
-import collections
-import random
-import operator
 import numpy as np
 
 from matplotlib import pyplot as plt
@@ -12,14 +9,34 @@ from curriculum.logging.visualization import save_image
 from rllab.misc import logger
 
 
+def _slice_bounds(index, size):
+    """ Where a (possibly negative) slice index lands in a sequence of the given size, as python slicing does. """
+    index = np.where(index < 0, index + size, index)
+    return np.clip(index, 0, size)
+
+
+def _window_measures(num_states, max_history):
+    """
+    Bounds of the old and new halves of the competence window used by the interest, with the python slice semantics
+    of compute_local_measure. Works elementwise on arrays of sizes.
+    """
+    num_states = np.asarray(num_states)
+    half = int(max_history / 2)
+    old_start = _slice_bounds(num_states - max_history, num_states)
+    old_end = np.maximum(_slice_bounds(num_states - half, num_states), old_start)
+    new_start = _slice_bounds(num_states - half, num_states)
+    new_end = np.maximum(num_states, new_start)
+    return old_start, old_end, new_start, new_end
+
+
 class Region(object):
 
     def __init__(self, min_border, max_border, max_history=500, max_goals=500, num_random_splits=50, mode3_noise=0.1):
-        # self.states = collections.deque(maxlen=max_history)
-        # self.competences = collections.deque(maxlen=max_history)
-
-        self.states = []
-        self.competences = []
+        # The states and competences are kept in arrays, along with the running sums of the competences so that the
+        # interest is O(1) to compute. They grow by whole batches of states, see SaggRIAC.add_states
+        self.states = np.empty((0, len(min_border)))
+        self.competences = np.empty(0)
+        self._competence_sums = np.zeros(1)
 
         self.min_border = min_border
         self.max_border = max_border
@@ -28,76 +45,92 @@ class Region(object):
         self.max_history = max_history
         self.num_random_splits = num_random_splits
         self.mode3_noise = mode3_noise
+        # Set once the region has been split
+        self.split_dim = None
+        self.split_val = None
 
     # Add this state and competence to the region.
     def add_state(self, state, competence):
-        self.states.append(state)
-        self.competences.append(competence)
-        self.num_goals += 1
+        self.add_states([state], [competence])
+
+    def add_states(self, states, competences):
+        states = np.asarray(states, dtype=float)
+        competences = np.asarray(competences, dtype=float).reshape(-1)
+        if len(states) == 0:
+            return
+        self.states = np.concatenate([self.states, states.reshape(len(states), -1)])
+        self.competences = np.concatenate([self.competences, competences])
+        self._competence_sums = np.concatenate([self._competence_sums,
+                                                self._competence_sums[-1] + np.cumsum(competences)])
+        self.num_goals += len(states)
 
     def is_too_big(self):
         # Split this region if it has too many goals, and if some of the goals have a positive competence!
         # Otherwise, if the competences are all 0, then there is no point in splitting.
-        #print("Min competence: " + str(min(self.competences)) + " max competence: " + str(max(self.competences)))
         do_split = (self.num_goals > self.max_goals) # and sum(self.competences) > 0)
-        #if do_split:
-            #print("Splitting!")
-            #import pdb; pdb.set_trace()
         return do_split
 
-
         # Split this region into subregions.
     def split(self):
         #region1, region2 = self.hacky_split()
         region1, region2, success = self.optimal_split()
 
-        # if success:
-        #     self.assign_states_to_regions(region1, region2)
-
         return [region1, region2, success]
 
     def assign_states_to_regions(self, region1, region2):
         # Reassign all goals to one of these regions.
-        for state, competence in zip(self.states, self.competences):
-            if region1.contains(state):
-                region1.add_state(state, competence)
-            elif region2.contains(state):
-                region2.add_state(state, competence)
-            else:
-                logger.log("Region 1: " + str(region1.min_border) + " " + str(region1.max_border))
-                logger.log("Region 2: " + str(region2.min_border) + " " + str(region2.max_border))
-                raise Exception("Split region; now cannot find region for state: " + str(state))
+        states = self.states
+        in_region1 = region1.contains_states(states)
+        in_region2 = ~in_region1 & region2.contains_states(states)
+        if not np.all(in_region1 | in_region2):
+            state = states[~(in_region1 | in_region2)][0]
+            logger.log("Region 1: " + str(region1.min_border) + " " + str(region1.max_border))
+            logger.log("Region 2: " + str(region2.min_border) + " " + str(region2.max_border))
+            raise Exception("Split region; now cannot find region for state: " + str(state))
+        region1.add_states(states[in_region1], self.competences[in_region1])
+        region2.add_states(states[in_region2], self.competences[in_region2])
+
+    def split_scores(self, split_dims, split_vals):
+        """
+        Score of every candidate split at once: the sizes of the two sides times the difference of their interests.
+        The interest windows depend on the order in which the states were added, so the competences of each side are
+        summed over the ranks of its states in that order.
+        """
+        states = self.states
+        competences = self.competences
+        in_region1 = states[:, split_dims].T <= split_vals[:, None]
+        interests = []
+        sizes = []
+        for side in (in_region1, ~in_region1):
+            ranks = np.cumsum(side, axis=1) - 1
+            size = side.sum(axis=1)
+            old_start, old_end, new_start, new_end = _window_measures(size, self.max_history)
+            in_old = side & (ranks >= old_start[:, None]) & (ranks < old_end[:, None])
+            in_new = side & (ranks >= new_start[:, None]) & (ranks < new_end[:, None])
+            measure_diff = np.abs(np.dot(in_old, competences) - np.dot(in_new, competences))
+            interests.append(np.where(size > 0, measure_diff / np.maximum(size, 1), 0.))
+            sizes.append(size)
+        return sizes[0] * sizes[1] * np.abs(interests[0] - interests[1])
 
     def optimal_split(self):
-        # All split scores must be >= 0
-        max_split_score = -1
-        max_region1 = None
-        max_region2 = None
-
-        num_dim = len(self.min_border)
-        for i in range(self.num_random_splits):
-            split_dim = random.randrange(num_dim)
-            split_val = random.uniform(self.min_border[split_dim], self.max_border[split_dim])
-            region1, region2 = self.make_regions(split_dim, split_val)
-            self.assign_states_to_regions(region1, region2)
-            split_score = len(region1.states) * len(region2.states) * abs(region1.compute_interest() - region2.compute_interest())
-
-            if split_score > max_split_score:
-                max_region1 = region1
-                max_region2 = region2
-                max_split_score = split_score
-
-        if max_split_score == -1 or max_region1 is None:
+        if self.num_random_splits <= 0:
             #TODO - what to do here?
             print("Problem - unable to find a good split!")
-            success = False
-        else:
-            success = True
+            return [None, None, False]
+
+        num_dim = len(self.min_border)
+        split_dims = np.random.randint(num_dim, size=self.num_random_splits)
+        split_vals = np.random.uniform(np.asarray(self.min_border)[split_dims],
+                                       np.asarray(self.max_border)[split_dims])
+        best = np.argmax(self.split_scores(split_dims, split_vals))
 
-        return [max_region1, max_region2, success]
+        region1, region2 = self.make_regions(split_dims[best], split_vals[best])
+        self.assign_states_to_regions(region1, region2)
+        return [region1, region2, True]
 
     def make_regions(self, split_dim, split_val):
         # For now, just perform a single split.
+        self.split_dim, self.split_val = split_dim, split_val
         region1_min = np.copy(self.min_border)
         region1_max = np.copy(self.max_border)
         region1_max[split_dim] = split_val
@@ -112,6 +145,7 @@ class Region(object):
 
     def hacky_split(self):
         # For now, just perform a single split.
+        self.split_dim, self.split_val = 0, (self.min_border[0] + self.max_border[0])/2
         region1_min = np.copy(self.min_border)
         region1_max = np.copy(self.max_border)
         region1_max[0] = (self.min_border[0] + self.max_border[0])/2 # Cut the first dimension in half.
@@ -126,43 +160,47 @@ class Region(object):
 
     # Compute the sum of the competences in a given range.
     def compute_local_measure(self, start_index, end_index):
-        return np.sum(np.array(self.competences)[start_index:end_index])
+        start_index = int(_slice_bounds(start_index, self.num_goals))
+        end_index = max(int(_slice_bounds(end_index, self.num_goals)), start_index)
+        sums = self._competence_sums
+        return sums[end_index] - sums[start_index]
 
     # Compute the derivative of competences.
     def compute_interest(self):
-        num_states = len(self.states)
+        num_states = self.num_goals
 
         if num_states == 0:
             return 0
 
-        old_measure = self.compute_local_measure(num_states - self.max_history, num_states - int(self.max_history/2))
-        new_measure = self.compute_local_measure(num_states - int(self.max_history/2), num_states)
+        old_start, old_end, new_start, new_end = _window_measures(num_states, self.max_history)
+        sums = self._competence_sums
+        old_measure = sums[old_end] - sums[old_start]
+        new_measure = sums[new_end] - sums[new_start]
 
-        # old_measure = self.compute_local_measure(0, int(num_states/2))
-        # new_measure = self.compute_local_measure(int(num_states/2), num_states)
         interest = abs(old_measure - new_measure) / num_states
         return interest
 
     # Check whether this state is inside this region.
     def contains(self, state):
-        #return (self.min_border.tolist() <= list(state) < self.max_border.tolist())
         # Check whether this state is between the borders.
         return (np.less_equal(self.min_border, state).all() and np.less_equal(state, self.max_border).all())
 
+    def contains_states(self, states):
+        return np.all(np.less_equal(self.min_border, states) & np.less_equal(states, self.max_border), axis=1)
+
     def sample_uniform(self):
-        state = []
-        for min_val, max_val in zip(self.min_border, self.max_border):
-            state.append(random.uniform(min_val, max_val))
-        return state
+        return self.sample_uniform_states(1)[0].tolist()
+
+    def sample_uniform_states(self, num_samples):
+        return np.random.uniform(self.min_border, self.max_border, size=(num_samples, len(self.min_border)))
 
     def sample_mode3(self):
-        # Find the lowest competence goal in this region.
-        min_index, min_value = min(enumerate(self.competences), key=operator.itemgetter(1))
-        bad_goal = np.copy(self.states[min_index])
+        return self.sample_mode3_states(1)[0].tolist()
 
-        # Add noise to this goal.
-        bad_goal += np.random.normal(0, self.mode3_noise, len(bad_goal))
-        return bad_goal.tolist()
+    def sample_mode3_states(self, num_samples):
+        # Find the lowest competence goal in this region, and add noise to it.
+        bad_goal = self.states[np.argmin(self.competences)]
+        return bad_goal + np.random.normal(0, self.mode3_noise, (num_samples, len(bad_goal)))
 
 
 class SaggRIAC(object):
@@ -194,19 +232,61 @@ class SaggRIAC(object):
         self.whole_region = Region(self.min_border, self.max_border, max_history=max_history, max_goals=self.max_goals)
         self.regions.append(self.whole_region)
 
+        # The regions are the leaves of a k-d tree stored in arrays: internal nodes have a split dimension and value
+        # (states on the split value go left) and leaves point to their index in self.regions
+        self._split_dims = np.array([-1])
+        self._split_vals = np.array([0.])
+        self._children = np.array([[-1, -1]])
+        self._region_nodes = [0]
+        self._node_regions = np.array([0])
+
     # Limit this sample to the boundaries of the region.
     def limit_sample(self, sample):
         sample = list(np.clip(sample, self.min_border, self.max_border))
-        #sample = min(sample, self.max_border.tolist())
-        #sample = max(sample, self.min_border.tolist())
         return sample
 
+    def _descend(self, states):
+        """ Leaf node of every state, going down the tree for all of them at once. """
+        nodes = np.zeros(len(states), dtype=int)
+        active = np.flatnonzero(self._split_dims[nodes] >= 0)
+        while active.size:
+            current = nodes[active]
+            go_right = states[active, self._split_dims[current]] > self._split_vals[current]
+            nodes[active] = self._children[current, go_right.astype(int)]
+            active = active[self._split_dims[nodes[active]] >= 0]
+        return nodes
+
+    def _split_leaf(self, region_index):
+        region = self.regions[region_index]
+        [region1, region2, success] = region.split()
+        if not success:
+            return False
+        node = self._region_nodes[region_index]
+        num_nodes = len(self._split_dims)
+        self._split_dims[node] = region.split_dim
+        self._split_vals[node] = region.split_val
+        self._children[node] = [num_nodes, num_nodes + 1]
+        self._split_dims = np.append(self._split_dims, [-1, -1])
+        self._split_vals = np.append(self._split_vals, [0., 0.])
+        self._children = np.vstack([self._children, [[-1, -1], [-1, -1]]])
+
+        # Add the subregions and delete the original region.
+        self.regions.append(region1)
+        self.regions.append(region2)
+        self._region_nodes += [num_nodes, num_nodes + 1]
+        del self.regions[region_index]
+        del self._region_nodes[region_index]
+        self._node_regions = np.full(len(self._split_dims), -1, dtype=int)
+        self._node_regions[self._region_nodes] = np.arange(len(self.regions))
+        return True
+
     # Find the region that contains a given state.
     def find_region(self, state):
-        for index, region in enumerate(self.regions):
-            if region.contains(state):
-                return [index, region]
-        raise Exception("Cannot find state: " + str(state) + " in any region!")
+        state = np.asarray(state, dtype=float).reshape(1, -1)
+        if not self.whole_region.contains_states(state)[0]:
+            raise Exception("Cannot find state: " + str(state[0]) + " in any region!")
+        index = self._node_regions[self._descend(state)[0]]
+        return [index, self.regions[index]]
 
     def add_accidental_states(self, states, extend_dist_rew):
         # Treat these accidental states as if we reached them with the highest competence.
@@ -218,20 +298,39 @@ class SaggRIAC(object):
 
     # Add these states and competences to our list.
     def add_states(self, states, competences):
-        for state, competence in zip(states, competences):
-            # Find the appropriate region for this state.
-            index, region = self.find_region(state)
-            # Add this state to the region.
-            region.add_state(state, competence)
-
-            # If the region contains too many goals, split it into subregions.
-            if region.is_too_big():
-                [region1, region2, success] = region.split()
-                if success:
-                    # Add the subregions and delete the original region.
-                    self.regions.append(region1)
-                    self.regions.append(region2)
-                    del self.regions[index]
+        """
+        Same as adding the states one by one, splitting a region as soon as it holds too many goals: the states are
+        routed down the tree together, and only those that reach a region after it had to be split are routed again.
+        """
+        states = np.asarray(states, dtype=float).reshape(len(states), -1)
+        competences = np.asarray(competences, dtype=float).reshape(-1)
+        outside = ~self.whole_region.contains_states(states)
+        if np.any(outside):
+            raise Exception("Cannot find state: " + str(states[outside][0]) + " in any region!")
+
+        pending = np.arange(len(states))
+        while pending.size:
+            leaves = self._node_regions[self._descend(states[pending])]
+            order = np.argsort(leaves, kind='mergesort')
+            leaves, pending = leaves[order], pending[order]
+            region_indices, starts = np.unique(leaves, return_index=True)
+            ends = np.append(starts[1:], len(leaves))
+
+            # Splitting reorders the regions, so work on the region objects
+            groups = [(self.regions[region_index], pending[start:end])
+                      for region_index, start, end in zip(region_indices, starts, ends)]
+            rerouted = []
+            for region, indices in groups:
+                room = max(region.max_goals + 1 - region.num_goals, 1)
+                region.add_states(states[indices[:room]], competences[indices[:room]])
+                if not region.is_too_big():
+                    continue
+                # If the region contains too many goals, split it into subregions.
+                if self._split_leaf(self.regions.index(region)):
+                    rerouted.append(indices[room:])
+                else:
+                    region.add_states(states[indices[room:]], competences[indices[room:]])
+            pending = np.sort(np.concatenate(rerouted)) if rerouted else np.array([], dtype=int)
 
     # Sample states from the regions.
     def sample_states(self, num_samples):
@@ -255,22 +354,26 @@ class SaggRIAC(object):
 
     # Sample uniformly at random from the whole space.
     def sample_uniform(self, num_samples):
-        samples = []
-
-        for i in range(num_samples):
-            state = self.whole_region.sample_uniform()
-            samples.append(state)
-        return samples
+        return self.whole_region.sample_uniform_states(num_samples).tolist()
 
     # Temporary hack - just randomly pick a region to sample from.
     def sample_random_region(self, num_samples):
+        num_per_regions = np.bincount(np.random.randint(len(self.regions), size=num_samples),
+                                      minlength=len(self.regions))
+        return self._sample_regions(num_per_regions)
+
+    def _sample_regions(self, num_per_regions, mode3=False):
         samples = []
-        for i in range(num_samples):
-            region_index = random.randrange(len(self.regions))
-            region = self.regions[region_index]
-            state = region.sample_uniform()
-            samples.append(state)
-        return samples
+        for region, num_per_region in zip(self.regions, num_per_regions):
+            if num_per_region > 0:
+                if mode3:
+                    samples.append(np.clip(region.sample_mode3_states(num_per_region),
+                                           self.min_border, self.max_border))
+                else:
+                    samples.append(region.sample_uniform_states(num_per_region))
+        if not samples:
+            return []
+        return np.concatenate(samples).tolist()
 
     def sample_mode_3(self, num_samples):
         return self.sample_mode_1(num_samples, mode3=True)
@@ -286,25 +389,10 @@ class SaggRIAC(object):
             return self.sample_uniform(num_samples)
 
         num_per_regions = np.random.multinomial(num_samples, probs)
-
-        samples = []
-        for region_index, num_per_region in enumerate(num_per_regions):
-            if num_per_region > 0:
-                region = self.regions[region_index]
-                for i in range(num_per_region):
-                    if mode3:
-                        sample = region.sample_mode3()
-                        sample = self.limit_sample(sample)
-                    else:
-                        sample = region.sample_uniform()
-                    samples.append(sample)
-
-        return samples
+        return self._sample_regions(num_per_regions, mode3=mode3)
 
     def compute_all_interests(self):
-        interests = np.array([])
-        for region in self.regions:
-            interests = np.append(interests, region.compute_interest())
+        interests = np.array([region.compute_interest() for region in self.regions], dtype=float)
 
         # Subtract the min interest
         min_interest = min(interests)
@@ -32,6 +32,7 @@ class Arm3dDiscEnv(MujocoEnv, Serializable):
 
     @overrides
     def get_current_obs(self):
+        self.sync_sim()
         return np.concatenate([
             self.model.data.qpos.flat, #[:self.model.nq // 2],
             self.model.data.qvel.flat, #[:self.model.nq // 2],
@@ -87,9 +88,11 @@ class Arm3dDiscEnv(MujocoEnv, Serializable):
 
 
     def get_disc_position(self):
+        self.sync_sim()
         return self.model.data.site_xpos[0]
 
     def get_goal_position(self):
+        self.sync_sim()
         return self.model.data.site_xpos[1]
         # return self.model.data.xpos[-1] + np.array([0, 0, 0.05]) # this allows position to be changed todo: check this
 
@@ -48,6 +48,7 @@ class Arm3dKeyEnv(MujocoEnv, Serializable):
             'alpha': 1e-5}
 
     def get_current_obs(self):
+        self.sync_sim()
         return np.concatenate([
             self.model.data.qpos.flat,
             self.model.data.qvel.flat,
@@ -78,13 +78,16 @@ class Arm3dMovePegEnv(MujocoEnv, Serializable):
 
     def get_peg_position(self):
         # self.get_body_com("peg")
+        self.sync_sim()
         return self.model.data.xpos[-1][:2]
 
     def get_disc_position(self):
+        self.sync_sim()
         return self.model.data.site_xpos[0]
 
     def get_goal_position(self):
         # return self.model.data.site_xpos[1]
+        self.sync_sim()
         return self.model.data.xpos[-1] + np.array([0, 0, 0.05])  # this allows position to be changed todo: check this
 
     def get_vec_to_goal(self):
@@ -138,6 +138,7 @@ class GoalExplorationEnv(GoalEnv, ProxyEnv, Serializable):
         # used by disk environment # todo: make more generalizable!  NOT USABLE FOR OTHER ENVS!!
         if 'init_state' in kwargs and len(kwargs['init_state']) == 9:
             delta = tuple(kwargs['init_state'][-2:])  # joint position is in terms of amount moved
+            self.wrapped_env.sync_sim()
             original_goal = self.wrapped_env.model.data.site_xpos[-1]
             new_goal = delta[0] + original_goal[0], delta[1] + original_goal[1], original_goal[2] # z dim unchanged
             self.update_goal(new_goal)
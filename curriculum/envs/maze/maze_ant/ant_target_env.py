@@ -16,6 +16,7 @@ class AntEnv(MujocoEnv, Serializable):
         Serializable.__init__(self, *args, **kwargs)
 
     def get_current_obs(self):
+        self.sync_sim()
         pos = self.model.data.qpos.flat[:-2]
         vel = self.model.data.qvel.flat[:-2]
         current_goal = self.model.data.qpos.flat[-2:].reshape(-1)
@@ -64,23 +65,15 @@ class AntEnv(MujocoEnv, Serializable):
 
             self.model.data.qacc = self.init_qacc
             self.model.data.ctrl = self.init_ctrl
+            sim_state = self.get_sim_state()
         else:
-            start = 0
-            for datum_name in ["qpos", "qvel", "qacc", "ctrl"]:
-                datum = getattr(self.model.data, datum_name)
-                datum_dim = datum.shape[0]
-                datum = init_state[start: start + datum_dim]
-                setattr(self.model.data, datum_name, datum)
-                start += datum_dim
+            sim_state = self.full_sim_state(init_state)
 
-        self.model.data.qpos = np.concatenate([np.array(self.model.data.qpos[:-2, :], dtype=float),
-                                               np.array(goal).reshape((2, 1)).astype(float)])
-        self.model.data.qvel = np.concatenate([np.array(self.model.data.qvel[:-2, :], dtype=float),
-                                               np.zeros((2, 1)).astype(float)])
-
-        self.model.forward()
-        self.current_com = self.model.data.com_subtree[0]
-        self.dcom = np.zeros_like(self.current_com)
+        # the last two joints of qpos (and qvel) are the goal
+        nq, nv = self.model.nq, self.model.nv
+        sim_state[nq - 2:nq] = np.asarray(goal, dtype=float).ravel()
+        sim_state[nq + nv - 2:nq + nv] = 0.
+        self.set_sim_state(sim_state)
         return self.get_current_obs()
 
     @overrides
@@ -17,6 +17,7 @@ from curriculum.envs.base import FixedStateGenerator
 # from curriculum.state.selectors import FixedStateSelector
 from curriculum.state.evaluator import evaluate_states
 from curriculum.logging.visualization import save_image
+from curriculum.logging.plot_renderer import render
 
 quick_test = False
 
@@ -324,8 +325,18 @@ def test_policy_parallel(policy, train_env, as_goals=True, visualize=True, sampl
     return avg_totRewards, avg_success, states, spacing, avg_time
 
 
+def plot_policy_success(avg_success, states, spacing, maze_id=None, center=None, limit=None):
+    plot_heatmap(avg_success, states, spacing=spacing, show_heatmap=False, maze_id=maze_id,
+                 center=center, limit=limit)
+    return save_image()
+
+
 def test_and_plot_policy(policy, env, as_goals=True, visualize=True, sampling_res=1,
-                         n_traj=1, max_reward=1, itr=0, report=None, center=None, limit=None, bounds=None):
+                         n_traj=1, max_reward=1, itr=0, report=None, center=None, limit=None, bounds=None,
+                         renderer=None):
+    """
+    :param renderer: PlotRenderer drawing the heatmap in the background: the report then gets the future of the image
+    """
 
     avg_totRewards, avg_success, states, spacing, avg_time = test_policy(policy, env, as_goals, visualize, center=center,
                                                                sampling_res=sampling_res, n_traj=n_traj, bounds=bounds)
@@ -333,9 +344,8 @@ def test_and_plot_policy(policy, env, as_goals=True, visualize=True, sampling_re
     while not hasattr(obj, '_maze_id') and hasattr(obj, 'wrapped_env'):
         obj = obj.wrapped_env
     maze_id = obj._maze_id if hasattr(obj, '_maze_id') else None
-    plot_heatmap(avg_success, states, spacing=spacing, show_heatmap=False, maze_id=maze_id,
-                 center=center, limit=limit)
-    reward_img = save_image()
+    reward_img = render(renderer, plot_policy_success, avg_success, states, spacing, maze_id=maze_id,
+                        center=center, limit=limit)
 
     # plot_heatmap(avg_time, states, spacing=spacing, show_heatmap=False, maze_id=maze_id,
     #              center=center, limit=limit, adaptive_range=True)
@@ -366,13 +376,20 @@ def test_and_plot_policy(policy, env, as_goals=True, visualize=True, sampling_re
     return mean_rewards, success
 
 
-def plot_policy_means(policy, env, sampling_res=2, report=None, center=None, limit=None):  # only for start envs!
+def plot_policy_means(policy, env, sampling_res=2, report=None, center=None, limit=None,
+                      renderer=None):  # only for start envs!
     states, spacing = find_empty_spaces(env, sampling_res=sampling_res)
     goal = env.current_goal
     observations = [np.concatenate([state, [0, ] * (env.observation_space.flat_dim - len(state) - len(goal)), goal]) for state in states]
     actions, agent_infos = policy.get_actions(observations)
     vecs = agent_infos['mean']
     vars = [np.exp(log_std) * 0.25 for log_std in agent_infos['log_std']]
+    vec_img = render(renderer, plot_mean_vectors, states, goal, vecs, vars)
+    if report is not None:
+        report.add_image(vec_img, 'policy mean')
+
+
+def plot_mean_vectors(states, goal, vecs, vars):
     ells = [patches.Ellipse(state, width=vars[i][0], height=vars[i][1], angle=0) for i, state in enumerate(states)]
 
     fig = plt.figure()
@@ -384,9 +401,7 @@ def plot_policy_means(policy, env, sampling_res=2, report=None, center=None, lim
     Q = plt.quiver(states[:,0], states[:,1], vecs[:, 0], vecs[:, 1], units='xy', angles='xy', scale_units='xy', scale=1)  # , np.linalg.norm(vars * 4)
     qk = plt.quiverkey(Q, 0.8, 0.85, 1, r'1 Nkg', labelpos='E', coordinates='figure')
     # cb = plt.colorbar(Q)
-    vec_img = save_image()
-    if report is not None:
-        report.add_image(vec_img, 'policy mean')
+    return save_image()
 
 
 def plot_policy_values(env, baseline, sampling_res=2, report=None, center=None, limit=None):  # TODO: try other baseline
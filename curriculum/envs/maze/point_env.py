@@ -62,10 +62,12 @@ class PointEnv(GoalEnv, MujocoEnv, Serializable):
             if np.array(init_state).size == 4:
                 qvel[:2] = np.array(init_state[2:]).reshape((2, 1))
         qpos[2:, :] = np.array(self.current_goal).reshape((2, 1))  # the goal is part of the mujoco!!
-        self.set_state(qpos, qvel)
-        # this is usually the usual reset
-        self.current_com = self.model.data.com_subtree[0]  # CF: this is very weird... gets 0, 2, 0.1 even when it's 0
-        self.dcom = np.zeros_like(self.current_com)
+        sim_state = self.get_sim_state()
+        sim_state[:self.model.nq] = qpos.ravel()
+        sim_state[self.model.nq:self.model.nq + self.model.nv] = qvel.ravel()
+        # the forward pass (and the reset of current_com and dcom) waits until something needs it: the observation
+        # only reads qpos and qvel
+        self.set_sim_state(sim_state)
         return self.get_current_obs()
 
     def step(self, action):
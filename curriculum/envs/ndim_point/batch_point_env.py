@@ -0,0 +1,174 @@
+import numpy as np
+
+from rllab.core.serializable import Serializable
+from rllab.envs.normalized_env import NormalizedEnv
+from rllab.envs.proxy_env import ProxyEnv
+
+from curriculum.envs.goal_env import GoalExplorationEnv
+from curriculum.envs.ndim_point.point_env import PointEnv
+
+
+class BatchGoalPointEnv(ProxyEnv, Serializable):
+    """
+    A GoalExplorationEnv around a (normalized) PointEnv that can also roll out many point agents at once with numpy.
+    Used as a single env it just relays to the wrapped goal env, so it can be handed to the algos as usual. Its
+    batch_rollout is picked up by evaluate_states (hence label_states) and by the VectorizedSampler.
+    """
+
+    def __init__(self, env, n_envs=1000):
+        """
+        :param env: GoalExplorationEnv wrapping a PointEnv, possibly through a NormalizedEnv without obs or reward
+        normalization. The goal space has to be the position of the point.
+        :param n_envs: default number of point agents rolled out at once
+        """
+        Serializable.quick_init(self, locals())
+        ProxyEnv.__init__(self, env)
+        self.n_envs = n_envs
+
+        if not isinstance(env, GoalExplorationEnv):
+            raise ValueError('BatchGoalPointEnv needs a GoalExplorationEnv, got {}'.format(env))
+        self._normalized_env = None
+        point_env = env.wrapped_env
+        if isinstance(point_env, NormalizedEnv):
+            if point_env._normalize_obs or point_env._normalize_reward:
+                raise ValueError('Observation and reward normalization are not supported')
+            self._normalized_env = point_env
+            point_env = point_env.wrapped_env
+        if not isinstance(point_env, PointEnv):
+            raise ValueError('BatchGoalPointEnv needs a PointEnv inside the goal env, got {}'.format(point_env))
+        if point_env.control_mode != 'linear':
+            raise NotImplementedError("Control mode not supported!")
+        self._point_env = point_env
+
+        obs = np.random.uniform(-point_env.state_ub, point_env.state_ub)
+        if not np.array_equal(np.asarray(env.transform_to_goal_space(obs)), obs[:point_env.dim]):
+            raise ValueError('The goal space of the env has to be the position of the point')
+
+    def _reset_batch(self, goals):
+        point_env = self._point_env
+        n = len(goals)
+        self._goals = np.asarray(goals, dtype=float).reshape(n, -1)
+        self._pos = np.clip(np.zeros((n, point_env.dim)), -point_env.state_ub[:point_env.dim],
+                            point_env.state_ub[:point_env.dim])
+        self._vel = np.clip(np.zeros((n, point_env.dim)), -point_env.state_ub[-point_env.dim:],
+                            point_env.state_ub[-point_env.dim:])
+        return self._get_batch_obs(np.arange(n))
+
+    def _get_batch_obs(self, idx):
+        obs = np.hstack([self._pos[idx], self._vel[idx]])
+        if not self.wrapped_env.append_goal_to_observation:
+            return obs
+        if self.wrapped_env.append_transformed_obs:
+            return np.hstack([obs, self._pos[idx], self._goals[idx]])
+        return np.hstack([obs, self._goals[idx]])
+
+    def _dist_to_goals(self, idx):
+        diff = self._pos[idx] - self._goals[idx]
+        metric = self.wrapped_env.distance_metric
+        if metric == 'L1':
+            return np.abs(diff).sum(axis=1)
+        elif metric == 'L2':
+            return np.sqrt(np.square(diff).sum(axis=1))
+        elif callable(metric):
+            return np.array([metric(pos, goal) for pos, goal in zip(self._pos[idx], self._goals[idx])])
+        raise NotImplementedError('Unsupported distance metric type.')
+
+    def _step_batch(self, idx, actions):
+        """ Step the point agents idx, with the same rewards and infos as GoalExplorationEnv.step """
+        point_env = self._point_env
+        goal_env = self.wrapped_env
+        dim = point_env.dim
+        if self._normalized_env is not None:
+            lb, ub = point_env.action_space.bounds
+            actions = lb + (actions + 1.) * 0.5 * (ub - lb)
+            if self._normalized_env._clip:
+                actions = np.clip(actions, lb, ub)
+
+        self._vel[idx] = np.clip(self._vel[idx] + actions * point_env.dt, -point_env.state_ub[-dim:],
+                                 point_env.state_ub[-dim:])
+        self._pos[idx] = np.clip(self._pos[idx] + self._vel[idx] * point_env.dt, -point_env.state_ub[:dim],
+                                 point_env.state_ub[:dim])
+
+        reward_ctrl = - np.square(actions).sum(axis=1)
+        reward = reward_ctrl
+        if self._normalized_env is not None:
+            reward = reward * self._normalized_env._scale_reward
+
+        reward_inner = goal_env.inner_weight * reward
+        distance = self._dist_to_goals(idx)
+        reward_dist = - goal_env.extend_dist_rew_weight * distance
+        reached = distance < goal_env.terminal_eps
+        if goal_env.only_feasible:
+            # PointEnv.is_feasible: the goal with zero velocity is in the observation space
+            reached &= np.all(np.abs(self._goals[idx]) <= point_env.state_ub[:dim], axis=1)
+        goal_reached = 1.0 * reached
+        dones = reached if goal_env.terminate_env else np.zeros(len(idx), dtype=bool)
+
+        env_infos = dict(
+            reward_ctrl=reward_ctrl,
+            reward_inner=reward_inner,
+            distance=distance,
+            reward_dist=reward_dist,
+            goal_reached=goal_reached,
+            goal=self._goals[idx].copy(),
+        )
+        rewards = reward_dist + reward_inner + goal_reached * goal_env.goal_weight
+        return self._get_batch_obs(idx), rewards, dones, env_infos
+
+    def batch_rollout(self, agent, max_path_length=np.inf, goals=None):
+        """
+        Roll out one path per goal in lock-step, with one agent query per timestep for all the agents still running.
+        :param goals: goal of each path. By default n_envs goals are drawn from the goal generator of the env.
+        :return: a list with one path per goal, in the same format as the ones returned by rollout
+        """
+        if goals is None:
+            goals = [self.wrapped_env.update_goal() for _ in range(self.n_envs)]
+        n = len(goals)
+        obs = self._reset_batch(goals)
+        agent.reset()
+
+        steps = []
+        live = np.arange(n)
+        path_length = 0
+        while live.size and path_length < max_path_length:
+            actions, agent_infos = agent.get_actions(obs[live])
+            actions = np.asarray(actions).reshape(live.size, -1)
+            next_obs, rewards, dones, env_infos = self._step_batch(live, actions)
+            steps.append((live, obs[live], actions, rewards, agent_infos, env_infos, dones))
+            # as in rollout, the last observation of a finished path is the one its last action was taken from
+            obs[live[~dones]] = next_obs[~dones]
+            live = live[~dones]
+            path_length += 1
+
+        if not steps:
+            return [dict(observations=np.asarray([]), actions=np.asarray([]), rewards=np.asarray([]),
+                         agent_infos=dict(), env_infos=dict(), dones=np.asarray([]), last_obs=o) for o in obs]
+
+        # Group the steps by path, keeping them in time order
+        path_ids = np.concatenate([step[0] for step in steps])
+        order = np.argsort(path_ids, kind='mergesort')
+        bounds = np.cumsum(np.bincount(path_ids, minlength=n))[:-1]
+
+        def by_path(values):
+            if isinstance(values[0], dict):
+                return {k: by_path([v[k] for v in values]) for k in values[0]}
+            return np.split(np.concatenate(values)[order], bounds)
+
+        columns = [by_path([step[i] for step in steps]) for i in range(1, 7)]
+
+        def path_dict(infos, i):
+            return {k: path_dict(v, i) if isinstance(v, dict) else v[i] for k, v in infos.items()}
+
+        observations, actions, rewards, agent_infos, env_infos, dones = columns
+        return [
+            dict(
+                observations=observations[i],
+                actions=actions[i],
+                rewards=rewards[i],
+                agent_infos=path_dict(agent_infos, i),
+                env_infos=path_dict(env_infos, i),
+                dones=dones[i],
+                last_obs=obs[i],
+            )
+            for i in range(n)
+        ]
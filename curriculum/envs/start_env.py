@@ -4,7 +4,10 @@ from the state environment base classes.
 """
 
 
+import itertools
+import os
 import random
+import shutil
 from collections import OrderedDict
 
 from rllab import spaces
@@ -36,7 +39,7 @@ from curriculum.experiments.asym_selfplay.algos.asym_selfplay import AsymSelfpla
 
 from curriculum.experiments.asym_selfplay.algos.asym_selfplay_batch import AsymSelfplayBatch
 from curriculum.experiments.asym_selfplay.envs.alice_env import AliceEnv
-from curriculum.state.evaluator import parallel_map, FunctionWrapper
+from curriculum.state.evaluator import parallel_map, parallel_stream, FunctionWrapper
 from curriculum.state.utils import StateCollection
 from curriculum.logging.visualization import plot_labeled_states, plot_labeled_samples
 from curriculum.state.evaluator import FunctionWrapper, parallel_map
@@ -197,8 +200,14 @@ def generate_starts_alice(env_alice, algo_alice, log_dir, start_states=None, num
 
 
 def generate_starts(env, policy=None, starts=None, horizon=50, size=10000, subsample=None, variance=1,
-                    zero_action=False, animated=False, speedup=1):
-    """ If policy is None, brownian motion applied """
+                    zero_action=False, animated=False, speedup=1, check_feasible=False, check_feasible_path_length=50,
+                    max_empty_rollouts=100):
+    """
+    If policy is None, brownian motion applied.
+    If not animated, the rollouts are streamed from the evaluation pool until exactly size states are collected.
+    With check_feasible, only the states passing check_feasibility are kept (checked in the workers), and the
+    collection stops early, with fewer states, after max_empty_rollouts rollouts in a row without any feasible state.
+    """
     if starts is None or len(starts) == 0:
         starts = [env.reset()]
     print("the starts from where we generate more is of len: ", len(starts))
@@ -216,8 +225,12 @@ def generate_starts(env, policy=None, starts=None, horizon=50, size=10000, subsa
         goal_reached = False
         # if animated:
         #     env.render()
-        while len(states) < size:
-            if animated:
+        if not animated:
+            states, num_roll, num_roll_reached_goal = _stream_brownian_starts(
+                env, policy, starts, states[0], size, horizon, variance, check_feasible, check_feasible_path_length,
+                max_empty_rollouts)
+        else:
+            while len(states) < size:
                 steps += 1
                 if done or steps >= horizon:
                     i += 1
@@ -245,44 +258,109 @@ def generate_starts(env, policy=None, starts=None, horizon=50, size=10000, subsa
                 # env.render()
                 # timestep = 0.05
                 # time.sleep(timestep / speedup)
-            else:
-                # import pdb; pdb.set_trace()
-                brownian_state_wrapper = FunctionWrapper(
-                    brownian,
-                    env=env,
-                    kill_outside=env.kill_outside,
-                    kill_radius=env.kill_radius,  # this should be set before passing the env to generate_starts
-                    horizon=horizon,
-                    variance=variance,
-                    policy=policy,
-                )
-                parallel_starts = [starts[j % n_starts] for j in range(i,i+singleton_pool.n_parallel)]
-                # print("parallel sampling from :", parallel_starts)
-                i += singleton_pool.n_parallel
-                results = parallel_map(brownian_state_wrapper, parallel_starts)
-                new_states = np.concatenate([result[0] for result in results])
-
-                # show where these states are:
-                np.random.shuffle(new_states)  # todo: this has a prety big impoact!! Why?? (related to collection)
-                # generate_starts(env, starts=new_states, horizon=10, variance=0,
-                #                 zero_action=True, animated=True, speedup=10, size=100)
-
-                print('Just collected {} rollouts, with {} states'.format(len(results), new_states.shape))
-                states.extend(new_states.tolist())
-                print('now the states are of len: ', len(states))
-                num_roll_reached_goal += np.sum([result[1] for result in results])
-                print("num_roll_reached_goal ",  np.sum([result[1] for result in results]))
-                num_roll += len(results)
+            if check_feasible:
+                states = [state for state in states if check_feasibility(state, env, check_feasible_path_length)]
         logger.log("Generating starts, rollouts that reached goal: " + str(num_roll_reached_goal) + " out of " + str(num_roll))
     logger.log("Starts generated.")
+    if not isinstance(states, np.ndarray):
+        states = np.stack([np.array(state) for state in states])
     if subsample is None:
-        return np.stack([np.array(state) for state in states])
+        return states
     else:
-        states = np.stack([np.array(state) for state in states])
         if len(states) < subsample:
             return states
         return states[np.random.choice(np.shape(states)[0], size=subsample)]
 
+def _brownian_starts(task, env, kill_outside, kill_radius, horizon, variance, policy=None, check_feasible=False,
+                     check_feasible_path_length=50, out_dir=None):
+    """
+    Task of _stream_brownian_starts: one brownian rollout from task = (start, seed), keeping only the feasible states
+    with check_feasible. When out_dir is given (a tmpfs folder shared with the master), the states are saved there and
+    their path is returned instead of the array.
+    """
+    start, seed = task
+    if seed is not None:
+        np.random.seed(seed)
+    states, goal_reached = brownian(start, env, kill_outside, kill_radius, horizon, variance, policy=policy)
+    states = np.array(states, dtype=float)
+    if check_feasible:
+        states = states[np.array([check_feasibility(state, env, check_feasible_path_length) for state in states],
+                                 dtype=bool)]
+    if out_dir is None:
+        return states, goal_reached
+    fd, path = tempfile.mkstemp(suffix='.npy', dir=out_dir)
+    os.close(fd)
+    np.save(path, states)
+    return path, goal_reached
+
+
+def _load_brownian_states(states):
+    if isinstance(states, str):
+        path, states = states, np.load(states)
+        os.remove(path)
+    return states
+
+
+def _stream_brownian_starts(env, policy, starts, first_state, size, horizon, variance, check_feasible=False,
+                            check_feasible_path_length=50, max_empty_rollouts=100):
+    """
+    Collect size states (first_state, then the shuffled states of brownian rollouts from the starts taken in turn)
+    with rollouts streamed from the evaluation pool, whose workers keep the env and policy between calls.
+    :param max_empty_rollouts: stop after that many rollouts in a row gave no state (they were all unfeasible), and
+    return the states collected so far
+    :return: the states, the number of rollouts and how many of them reached the goal
+    """
+    n_processes = singleton_pool.n_parallel
+    out_dir = None
+    if n_processes > 1:
+        out_dir = tempfile.mkdtemp(prefix='brownian_starts_', dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+    brownian_starts_wrapper = FunctionWrapper(
+        _brownian_starts,
+        env=env,
+        kill_outside=env.kill_outside,
+        kill_radius=env.kill_radius,  # this should be set before passing the env to generate_starts
+        horizon=horizon,
+        variance=variance,
+        policy=policy,
+        check_feasible=check_feasible,
+        check_feasible_path_length=check_feasible_path_length,
+        out_dir=out_dir,
+    )
+
+    def tasks():
+        # the forked workers start from the same random state: give each rollout its own seed
+        for i in itertools.count():
+            yield starts[i % len(starts)], np.random.randint(2 ** 31) if out_dir is not None else None
+
+    states = np.empty((max(size, 1),) + np.shape(first_state))
+    n_states, num_roll, num_roll_reached_goal, n_empty_rollouts = 0, 0, 0, 0
+    if not check_feasible or check_feasibility(first_state, env, check_feasible_path_length):
+        states[0] = first_state
+        n_states = 1
+    results = parallel_stream(brownian_starts_wrapper, tasks(), n_processes,
+                              discard=lambda result: _load_brownian_states(result[0]))
+    try:
+        while n_states < size:
+            if n_empty_rollouts >= max_empty_rollouts:
+                logger.log("Generating starts: the last %d rollouts had no feasible state, stopping with %d states "
+                           "out of %d" % (n_empty_rollouts, n_states, size))
+                break
+            new_states, goal_reached = next(results)
+            new_states = _load_brownian_states(new_states)
+            n_empty_rollouts = 0 if len(new_states) else n_empty_rollouts + 1
+            np.random.shuffle(new_states)  # todo: this has a prety big impoact!! Why?? (related to collection)
+            n_new = min(len(new_states), size - n_states)
+            states[n_states:n_states + n_new] = new_states[:n_new]
+            n_states += n_new
+            num_roll += 1
+            num_roll_reached_goal += goal_reached
+    finally:
+        results.close()
+        if out_dir is not None:
+            shutil.rmtree(out_dir, ignore_errors=True)
+    return states[:n_states], num_roll, num_roll_reached_goal
+
+
 def parallel_check_feasibility(starts, env, max_path_length=50, n_processes=-1):
     feasibility_wrapper = FunctionWrapper(
         check_feasibility,
@@ -378,14 +456,11 @@ def find_all_feasible_states_plotting(env, seed_starts, report, distance_thresho
             if len(added_states) > 0:
                 while len(starts) < 1.5 * num_samples:
                     starts = np.concatenate((starts, added_states), axis=0)
+        # filters starts so that we only keep the good starts (used for ant maze environment, where we ant to run
+        # no_action), directly in the workers generating them
         new_starts = generate_starts(env, starts=starts, horizon=horizon, size=size, variance=brownian_variance,
-                                     animated=animate, speedup=50)
-        # filters starts so that we only keep the good starts
-        if check_feasible: # used for ant maze environment, where we ant to run no_action
-            logger.log("Prefilteredstarts: {}".format(len(new_starts)))
-            new_starts = parallel_check_feasibility(env=env, starts=new_starts, max_path_length=check_feasible_path_length)
-            # new_starts = [start for start in new_starts if check_feasibility(env, start, check_feasible_path_length)]
-            logger.log("Filtered starts: {}".format(len(new_starts)))
+                                     animated=animate, speedup=50, check_feasible=check_feasible,
+                                     check_feasible_path_length=check_feasible_path_length)
         all_starts_samples = all_feasible_starts.sample(num_samples)
         added_states = all_feasible_starts.append(new_starts)
         num_new_starts = len(added_states)
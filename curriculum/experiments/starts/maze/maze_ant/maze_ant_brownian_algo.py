@@ -15,6 +15,7 @@ from rllab.misc import logger
 from collections import OrderedDict
 from curriculum.logging import HTMLReport
 from curriculum.logging import format_dict
+from curriculum.logging import PlotRenderer
 from curriculum.logging.logger import ExperimentLogger
 
 os.environ['THEANO_FLAGS'] = 'floatX=float32,device=cpu'
@@ -55,6 +56,8 @@ def run_task(v):
     if log_dir is None:
         log_dir = "/home/michael/"
     report = HTMLReport(osp.join(log_dir, 'report.html'), images_per_row=3)
+    # draws the plots of the labels while the next outer iteration trains
+    renderer = PlotRenderer()
 
     report.add_header("{}".format(EXPERIMENT_TYPE))
     report.add_text(format_dict(v))
@@ -228,7 +231,7 @@ def run_task(v):
 
         start_classes, text_labels = convert_label(labels)
         plot_labeled_states(starts, labels, report=report, itr=outer_iter, limit=v['goal_range'],
-                            center=v['goal_center'], maze_id=v['maze_id'])
+                            center=v['goal_center'], maze_id=v['maze_id'], renderer=renderer)
 
 
         labels = np.logical_and(labels[:, 0], labels[:, 1]).astype(int).reshape((-1, 1))
@@ -284,7 +287,7 @@ def run_task(v):
                 logger.log("Starts labelled")
                 plot_labeled_states(unif_starts, labels, report=report, itr=outer_iter, limit=v['goal_range'],
                                     center=v['goal_center'], maze_id=v['maze_id'],
-                                    summary_string_base='initial starts labels:\n')
+                                    summary_string_base='initial starts labels:\n', renderer=renderer)
                 # report.add_text("Success: " + str(np.mean(mean_reward)))
 
             with logger.tabular_prefix("Fixed_"):
@@ -297,10 +300,14 @@ def run_task(v):
                 logger.log("Starts labelled")
                 plot_labeled_states(init_pos, labels, report=report, itr=outer_iter, limit=v['goal_range'],
                                     center=v['goal_center'], maze_id=v['maze_id'],
-                                    summary_string_base='initial starts labels:\n')
+                                    summary_string_base='initial starts labels:\n', renderer=renderer)
                 report.add_text("Fixed Success: " + str(np.mean(mean_reward)))
 
             report.new_row()
             report.save()
             logger.record_tabular("Fixed test set_success: ", np.mean(mean_reward))
             logger.dump_tabular()
+
+    # the plots still being drawn end up in the report
+    renderer.shutdown()
+    report.close()
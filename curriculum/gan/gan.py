@@ -25,6 +25,7 @@ DEFAULT_GAN_CONFIGS = lambda: {
     'default_discriminator_iters': 1,
     'gan_type': 'lsgan',
     'wgan_gradient_penalty': 0.1,
+    'fused_training': False,  # generate fakes in the graph and update both networks in a single session call
 }
 
 
@@ -65,6 +66,8 @@ class FCGAN(object):
         self.generator_is_training = tf.placeholder_with_default(False, [])
         self.discriminator_is_training = tf.placeholder_with_default(False, [])
 
+        batch_size = self.configs['batch_size']
+
         # with self.tf_graph.as_default():
         with tf.variable_scope("generator"):
             self.generator = Generator(
@@ -72,11 +75,42 @@ class FCGAN(object):
                 self.generator_is_training, self.configs,
             )
 
+        # The real data lives in the graph during fused training: it is loaded once per call to train and the
+        # batches are sliced from it cyclically, like batch_feed_array does
+        with tf.variable_scope('fcgan_real_data'):
+            self._real_X_input = tf.placeholder(tf.float32, shape=[None, generator_output_size])
+            self._real_Y_input = tf.placeholder(tf.float32, shape=[None, discriminator_output_size])
+            real_X = tf.Variable(np.zeros((0, generator_output_size), dtype=np.float32),
+                                 trainable=False, validate_shape=False, name='X')
+            real_Y = tf.Variable(np.zeros((0, discriminator_output_size), dtype=np.float32),
+                                 trainable=False, validate_shape=False, name='Y')
+            batch_start = tf.Variable(0, trainable=False, name='batch_start')
+            self._load_real_data_op = tf.group(
+                tf.assign(real_X, self._real_X_input, validate_shape=False),
+                tf.assign(real_Y, self._real_Y_input, validate_shape=False),
+                tf.assign(batch_start, 0),
+            )
+            data_size = tf.maximum(tf.shape(real_X)[0], 1)
+            batch_indices = (batch_start + tf.range(tf.minimum(batch_size, data_size))) % data_size
+            real_X_batch = tf.reshape(tf.gather(real_X, batch_indices), [-1, generator_output_size])
+            real_Y_batch = tf.reshape(tf.gather(real_Y, batch_indices), [-1, discriminator_output_size])
+            self._next_real_batch_start = (batch_start + batch_size) % data_size
+            self._real_batch_start = batch_start
+
+        # Unless they are fed, the discriminator inputs default to a real batch stacked on top of fresh fakes
+        default_sample_input = tf.concat(
+            [real_X_batch, tf.stop_gradient(self.generator.output)], 0
+        )
+        default_label = tf.concat(
+            [real_Y_batch, tf.zeros([batch_size, discriminator_output_size])], 0
+        )
+
         with tf.variable_scope("discriminator"):
             self.discriminator = Discriminator(
                 self.generator.output, generator_output_size,
                 discriminator_layers, discriminator_output_size,
                 self.discriminator_is_training, self.configs,
+                default_sample_input=default_sample_input, default_label=default_label,
             )
 
         self.generator_variables = tf.get_collection(
@@ -100,6 +134,35 @@ class FCGAN(object):
                 var_list=self.discriminator_variables
             )
 
+        with tf.control_dependencies([self.discriminator_train_op]):
+            self.fused_discriminator_train_op = tf.assign(
+                self._real_batch_start, self._next_real_batch_start
+            )
+
+        # Simultaneous update of both networks: all the gradients (and the losses) are computed from the same fakes
+        # and the current parameters before any of the updates is applied, so the two updates never race
+        generator_grads_and_vars = self.configs['generator_optimizer'].compute_gradients(
+            self.discriminator.generator_loss, var_list=self.generator_variables
+        )
+        discriminator_grads_and_vars = self.configs['discriminator_optimizer'].compute_gradients(
+            self.discriminator.discriminator_loss, var_list=self.discriminator_variables
+        )
+        with tf.control_dependencies(
+                [grad for grad, _ in generator_grads_and_vars + discriminator_grads_and_vars if grad is not None]
+                + [self.discriminator.generator_loss, self.discriminator.discriminator_loss]):
+            with tf.variable_scope('fcgan_generator_optimizer'):
+                fused_generator_update = self.configs['generator_optimizer'].apply_gradients(
+                    generator_grads_and_vars
+                )
+            with tf.variable_scope('fcgan_discriminator_optimizer'):
+                fused_discriminator_update = self.configs['discriminator_optimizer'].apply_gradients(
+                    discriminator_grads_and_vars
+                )
+            self.fused_train_op = tf.group(
+                fused_generator_update, fused_discriminator_update,
+                tf.assign(self._real_batch_start, self._next_real_batch_start),
+            )
+
         self.generator_optimizer_variables = tf.get_collection(
             tf.GraphKeys.GLOBAL_VARIABLES,
             'fcgan_generator_optimizer'
@@ -166,6 +229,8 @@ class FCGAN(object):
         return np.vstack(generator_samples), np.vstack(generator_noise)
 
     def train(self, X, Y, outer_iters, generator_iters=None, discriminator_iters=None):
+        if self.configs['fused_training']:
+            return self.train_fused(X, Y, outer_iters, generator_iters, discriminator_iters)
         if generator_iters is None:
             generator_iters = self.configs['default_generator_iters']
         if discriminator_iters is None:
@@ -215,6 +280,55 @@ class FCGAN(object):
 
         return dis_log_loss, gen_log_loss
 
+    def train_fused(self, X, Y, outer_iters, generator_iters=None, discriminator_iters=None):
+        """
+        Same as train, but X and Y are loaded into the graph once and the fakes are generated in the graph, so
+        with the default iterations every outer iteration is a single session call. In that call, the gradients of
+        both networks are computed from the same fakes and parameters before either update is applied: the
+        generator step sees the discriminator from before its update, not the updated one as in train.
+        """
+        if generator_iters is None:
+            generator_iters = self.configs['default_generator_iters']
+        if discriminator_iters is None:
+            discriminator_iters = self.configs['default_discriminator_iters']
+
+        self.tf_session.run(
+            self._load_real_data_op,
+            {self._real_X_input: X, self._real_Y_input: Y}
+        )
+
+        for i in range(outer_iters):
+            if self.configs['reset_generator_optimizer']:
+                self.tf_session.run(
+                    self.initialize_generator_optimizer_op
+                )
+            if self.configs['reset_discriminator_optimizer']:
+                self.tf_session.run(
+                    self.initialize_discriminator_optimizer_op
+                )
+
+            for j in range(discriminator_iters - 1):
+                dis_log_loss, _ = self.tf_session.run(
+                    [self.discriminator.discriminator_loss, self.fused_discriminator_train_op],
+                    {self.discriminator_is_training: True}
+                )
+
+            dis_log_loss, gen_log_loss, _ = self.tf_session.run(
+                [self.discriminator.discriminator_loss, self.discriminator.generator_loss, self.fused_train_op],
+                {self.discriminator_is_training: True, self.generator_is_training: True}
+            )
+
+            for j in range(generator_iters - 1):
+                gen_log_loss, _ = self.tf_session.run(
+                    [self.discriminator.generator_loss, self.generator_train_op],
+                    {self.generator_is_training: True}
+                )
+
+            if i % self.configs['print_iteration'] == 0 and not self.configs['supress_all_logging']:
+                print('Iter: {}, generator loss: {}, discriminator loss: {}'.format(i, gen_log_loss, dis_log_loss))
+
+        return dis_log_loss, gen_log_loss
+
     def train_discriminator(self, X, Y, iters, no_batch=False):
         """
         :param X: goal that we know lables of
@@ -283,7 +397,10 @@ class FCGAN(object):
 class Generator(object):
     def __init__(self, output_size, hidden_layers, noise_size, is_training, configs):
         self.configs = configs
-        self._input = tf.placeholder(tf.float32, shape=[None, noise_size])
+        # Fresh noise is drawn in the graph when the input is not fed
+        self._input = tf.placeholder_with_default(
+            tf.random_normal([configs['batch_size'], noise_size]), shape=[None, noise_size]
+        )
         out = self._input
 
         for size in hidden_layers:
@@ -330,10 +447,16 @@ class Generator(object):
 
 class Discriminator(object):
     def __init__(self, generator_output, input_size, hidden_layers, output_size,
-                 is_training, configs):
+                 is_training, configs, default_sample_input=None, default_label=None):
         self._generator_input = generator_output
-        self._sample_input = tf.placeholder(tf.float32, shape=[None, input_size])
-        self._label = tf.placeholder(tf.float32, shape=[None, output_size])
+        if default_sample_input is None:
+            self._sample_input = tf.placeholder(tf.float32, shape=[None, input_size])
+        else:
+            self._sample_input = tf.placeholder_with_default(default_sample_input, shape=[None, input_size])
+        if default_label is None:
+            self._label = tf.placeholder(tf.float32, shape=[None, output_size])
+        else:
+            self._label = tf.placeholder_with_default(default_label, shape=[None, output_size])
         self.configs = configs
         
         self.sample_discriminator = DiscriminatorNet(
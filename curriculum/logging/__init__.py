@@ -2,9 +2,10 @@ from curriculum.logging.logger import AttrDict, ExperimentLogger, format_experim
 from curriculum.logging.visualization import plot_policy_reward, plot_labeled_samples, plot_gan_samples, \
     plot_line_graph
 from curriculum.logging.html_report import format_dict, HTMLReport
+from curriculum.logging.plot_renderer import PlotRenderer
 
 export = [
-    format_dict, HTMLReport,
+    format_dict, HTMLReport, PlotRenderer,
     AttrDict, ExperimentLogger, format_experiment_log_path, make_log_dirs,
     plot_policy_reward, plot_labeled_samples, plot_gan_samples,
     plot_line_graph,
@@ -8,11 +8,18 @@ from scipy.misc import imsave as sp_imsave
 from skimage.io import imread, imsave
 from skimage import img_as_int
 
+from concurrent.futures import Future, ThreadPoolExecutor
+import hashlib
 import os
+import uuid
+import weakref
 from io import BytesIO
 from base64 import b64encode
 import datetime
 
+import numpy as np
+from skimage.transform import resize
+
 
 def format_dict(d):
     s = ['']
@@ -28,45 +35,114 @@ def format_dict(d):
     return s[0]
 
 
+def _png_bytes(img_arr):
+    img_arr = img_as_int(img_arr)
+    sio = BytesIO()
+    sp_imsave(sio, img_arr, 'png')
+    data = sio.getvalue()
+    sio.close()
+    return data
+
+
+def _write_png(file_name, img_arr, width=None):
+    if os.path.exists(file_name):
+        return
+    if isinstance(img_arr, Future):
+        img_arr = img_arr.result()
+    if width is not None and img_arr.shape[1] > width:
+        height = max(int(round(img_arr.shape[0] * width / img_arr.shape[1])), 1)
+        img_arr = resize(img_arr, (height, width) + img_arr.shape[2:], preserve_range=True).astype(img_arr.dtype)
+    data = _png_bytes(img_arr)
+    os.makedirs(os.path.dirname(file_name), exist_ok=True)
+    # written under a temporary name first, so that a report never shows a partially written image
+    tmp_file_name = file_name + '.tmp'
+    with open(tmp_file_name, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_file_name, file_name)
+
+
 class HTMLReport:
-    def __init__(self, path, images_per_row=2, default_image_width=400):
+    """
+    Report appended to as it goes: the elements that are complete are written once at the end of the html file, and
+    only the table still being filled is rewritten on save.
+    Images are PNG encoded on a background thread, into files of the images directory next to the report named by
+    the hash of their content, unless inline_images, which embeds them in the html in base64 as they are added.
+    """
+
+    def __init__(self, path, images_per_row=2, default_image_width=400, thumbnail_width=None, inline_images=False):
+        """
+        :param thumbnail_width: if given, the report shows images downscaled to that width, linking to the full ones
+        """
         self.path = path
-        title = datetime.datetime.today().strftime(
+        self.title = datetime.datetime.today().strftime(
             "Report %Y-%m-%d_%H-%M-%S_{}".format(os.uname()[1])
         )
-        self.doc = dominate.document(title=title)
         self.images_per_row = images_per_row
         self.default_image_width = default_image_width
+        self.thumbnail_width = thumbnail_width
+        self.inline_images = inline_images
+        self.image_dir = os.path.splitext(os.path.basename(path))[0] + '_images'
         self.t = None
         self.row_image_count = 0
+        self._elements = []  # complete elements that are not written yet
+        self._written_size = None  # size of the html file without the table being filled, None before the first save
+        self._image_files = set()
+        self._image_executor = ThreadPoolExecutor(max_workers=1)
+        self._image_futures = []
+        self._future_names = weakref.WeakKeyDictionary()
+        self._closed = False
 
-    def add_header(self, str):
-        with self.doc:
-            h3(str, style='word-wrap: break-word; white-space: pre-wrap;')
+    def _add_element(self, element):
+        self._close_table()
+        self._elements.append(element)
+
+    def _close_table(self):
+        if self.t is not None:
+            self._elements.append(self.t)
         self.t = None
         self.row_image_count = 0
-        
+
+    def add_header(self, str):
+        self._add_element(h3(str, style='word-wrap: break-word; white-space: pre-wrap;'))
+
     def add_text(self, str):
-        with self.doc:
-            p(str, style='word-wrap: break-word; white-space: pre-wrap;')
-        self.t = None
-        self.row_image_count = 0
+        self._add_element(p(str, style='word-wrap: break-word; white-space: pre-wrap;'))
 
     def _add_table(self, border=1):
-        self.row_image_count = 0
+        self._close_table()
         self.t = table(border=border, style="table-layout: fixed;")
-        self.doc.add(self.t)
 
     def _encode_image(self, img_arr):
         """Save the image array as PNG and then encode with base64 for embedding"""
-        img_arr = img_as_int(img_arr)
-        sio = BytesIO()
-        sp_imsave(sio, img_arr, 'png')
-        encoded = b64encode(sio.getvalue()).decode()
-        sio.close()
-        return encoded
+        return b64encode(_png_bytes(img_arr)).decode()
+
+    def _image_file(self, img_arr, width=None):
+        """
+        Relative path of the PNG file of the image, scaled to width if given. The file is written in the background
+        the first time that image is added.
+        """
+        if isinstance(img_arr, Future):
+            # the image is not there yet to be hashed
+            if img_arr not in self._future_names:
+                self._future_names[img_arr] = uuid.uuid4().hex
+            name = self._future_names[img_arr] + ('' if width is None else '_%d' % width)
+        else:
+            img_arr = np.array(img_arr)
+            digest = hashlib.sha1(str((img_arr.shape, img_arr.dtype.str, width)).encode())
+            digest.update(np.ascontiguousarray(img_arr).view(np.uint8).data)
+            name = digest.hexdigest()
+        file_name = os.path.join(self.image_dir, name + '.png')
+        if file_name not in self._image_files:
+            self._image_files.add(file_name)
+            self._image_futures.append(self._image_executor.submit(
+                _write_png, os.path.join(os.path.dirname(self.path), file_name), img_arr, width))
+            self._image_futures = [f for f in self._image_futures if not f.done() or f.exception() is not None]
+        return file_name
 
     def add_image(self, im, txt='', width=None, font_pct=100):
+        """
+        :param im: image array, or future of one, e.g. from PlotRenderer.submit
+        """
         if width is None:
             width = self.default_image_width
         if self.t is None or self.row_image_count >= self.images_per_row:
@@ -76,10 +152,17 @@ class HTMLReport:
             #with td(style="word-wrap: break-word;", halign="center", valign="top"):
             with td(halign="center", valign="top"):
                 with p():
-                    img(
-                        style="width:%dpx" % width,
-                        src=r'data:image/png;base64,' + self._encode_image(im)
-                    )
+                    if self.inline_images:
+                        img(
+                            style="width:%dpx" % width,
+                            src=r'data:image/png;base64,' + self._encode_image(
+                                im.result() if isinstance(im, Future) else im)
+                        )
+                    elif self.thumbnail_width is not None:
+                        with a(href=self._image_file(im)):
+                            img(style="width:%dpx" % width, src=self._image_file(im, self.thumbnail_width))
+                    else:
+                        img(style="width:%dpx" % width, src=self._image_file(im))
                     br()
                     p(
                         txt,
@@ -91,19 +174,43 @@ class HTMLReport:
         self.row_image_count += 1
 
     def new_row(self):
+        self._close_table()
         self.save()
-        self.t = None
-        self.row_image_count = 0
 
     def add_images(self, ims, txts, width=256):
         for im, txt in zip(ims, txts):
             self.add_image(im, txt, width)
 
     def save(self):
-        f = open(self.path, 'w')
-        f.write(self.doc.render())
-        f.close()
-        
-    def __del__(self):
+        for future in self._image_futures:
+            if future.done():
+                future.result()
+        if self._written_size is None:
+            mode = 'w'
+            self._elements.insert(0, '<!DOCTYPE html>\n<html>\n<head>\n  <title>{}</title>\n</head>\n<body>\n'.format(
+                self.title))
+            self._written_size = 0
+        else:
+            mode = 'r+'
+        with open(self.path, mode) as f:
+            f.seek(self._written_size)
+            for element in self._elements:
+                f.write(element if isinstance(element, str) else element.render() + '\n')
+            self._written_size = f.tell()
+            self._elements = []
+            if self.t is not None:
+                f.write(self.t.render() + '\n')
+            f.truncate()
+
+    def close(self):
+        """ Save the report, and wait for its images to be written """
         self.save()
+        self._image_executor.shutdown(wait=True)
+        for future in self._image_futures:
+            future.result()
+        self._image_futures = []
+        self._closed = True
 
+    def __del__(self):
+        if not self._closed:
+            self.close()
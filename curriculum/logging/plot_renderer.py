@@ -0,0 +1,49 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+
+class PlotRenderer(object):
+    """
+    Draws plots in a separate process, so that they overlap with training instead of extending the iteration.
+    The plotting functions have to be module level functions of plain arrays (states, labels, rewards, bounds...)
+    returning the image, like plot_labeled_samples: submit returns the future of that image, which HTMLReport.add_image
+    accepts directly.
+    """
+
+    def __init__(self, max_pending=4):
+        """
+        :param max_pending: number of plots that can wait to be drawn. Submitting more waits for the oldest one.
+        """
+        self.max_pending = max_pending
+        self._executor = None
+        self._pending = deque()
+
+    def submit(self, func, *args, **kwargs):
+        if self._executor is None:
+            # the process is only started when the first plot is needed
+            self._executor = ProcessPoolExecutor(max_workers=1)
+        while self._pending and self._pending[0].done():
+            self._pending.popleft()
+        if len(self._pending) >= self.max_pending:
+            self._pending.popleft().result()
+        future = self._executor.submit(func, *args, **kwargs)
+        self._pending.append(future)
+        return future
+
+    def wait(self):
+        """ Block until all the submitted plots are drawn """
+        while self._pending:
+            self._pending.popleft().result()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self._pending.clear()
+
+
+def render(renderer, func, *args, **kwargs):
+    """ Future of func(*args, **kwargs) drawn by the renderer, or the result of func itself if renderer is None """
+    if renderer is None:
+        return func(*args, **kwargs)
+    return renderer.submit(func, *args, **kwargs)
@@ -1,6 +1,6 @@
-import tempfile
 import math
 import gc
+from io import BytesIO
 
 import numpy as np
 import scipy.misc
@@ -8,6 +8,7 @@ from collections import OrderedDict
 
 from curriculum.state.evaluator import evaluate_states, convert_label
 from curriculum.envs.base import FixedStateGenerator
+from curriculum.logging.plot_renderer import render
 from rllab.misc import logger
 
 import matplotlib as mpl
@@ -48,38 +49,46 @@ def plot_policy_reward(policy, env, limit, horizon=200, max_reward=6000, fname=N
     plt.colorbar()
     if fname is not None:
         plt.savefig(fname, format='png')
-        if return_rewards:
-            return scipy.misc.imread(fname), z
-        else:
-            return scipy.misc.imread(fname)
+    img = figure_to_array()
+    if return_rewards:
+        return img, z
     else:
-        fp = tempfile.TemporaryFile()
-        plt.savefig(fp, format='png')
-        fp.seek(0)
-        img = scipy.misc.imread(fp)
-        fp.close()
-        if return_rewards:
-            return img, z
-        else:
-            return img
+        return img
+
+
+def figure_to_array(fig=None, **savefig_kwargs):
+    """
+    RGBA pixels of the figure (the current one by default), as a uint8 array. They are read directly from the Agg
+    canvas, unless savefig_kwargs are needed (e.g. bbox_inches='tight'), in which case the figure goes through a PNG
+    in memory.
+    """
+    if fig is None:
+        fig = plt.gcf()
+    if savefig_kwargs:
+        buf = BytesIO()
+        fig.savefig(buf, format='png', **savefig_kwargs)
+        buf.seek(0)
+        return scipy.misc.imread(buf)
+    fig.canvas.draw()
+    width, height = fig.canvas.get_width_height()
+    return np.frombuffer(fig.canvas.buffer_rgba(), dtype=np.uint8).reshape(height, width, 4).copy()
 
 
 def save_image(fig=None, fname=None):
-    if fname is None:
-        fname = tempfile.TemporaryFile()
-    if fig is not None:
-        fig.savefig(fname)
-    else:
-        plt.savefig(fname, format='png')
+    if fig is None:
+        fig = plt.gcf()
+    if fname is not None:
+        fig.savefig(fname, format='png')
+    img = figure_to_array(fig)
     plt.close('all')
-    fname.seek(0)
-    img = scipy.misc.imread(fname)
-    fname.close()
     return img
 
 
 def plot_labeled_states(states, labels, convert_labels=convert_label, report=None,
-                        itr=0, limit=None, center=None, maze_id=None, summary_string_base=None):
+                        itr=0, limit=None, center=None, maze_id=None, summary_string_base=None, renderer=None):
+    """
+    :param renderer: PlotRenderer drawing the plot in the background: the report then gets the future of the image
+    """
     goal_classes, text_labels = convert_labels(labels)
     total_goals = labels.shape[0]
     goal_class_frac = OrderedDict()  # this needs to be an ordered dict!! (for the log tabular)
@@ -88,9 +97,13 @@ def plot_labeled_states(states, labels, convert_labels=convert_label, report=Non
         logger.record_tabular('GenGoal_frac_' + text_labels[k], frac)
         goal_class_frac[text_labels[k]] = frac
 
-    img = plot_labeled_samples(
-        samples=states, sample_classes=goal_classes, text_labels=text_labels, limit=limit,
-        center=center, maze_id=maze_id,
+    # subsampled here rather than in plot_labeled_samples, so that the random state is the same with or without
+    # a renderer
+    plotted_states, plotted_classes = _subsample_labeled(states, goal_classes, 1000)
+    img = render(
+        renderer, plot_labeled_samples,
+        samples=plotted_states, sample_classes=plotted_classes, text_labels=text_labels, limit=limit,
+        center=center, size=None, maze_id=maze_id,
     )
     if summary_string_base is None:
         summary_string_base = 'Labels for {} goals:\n'.format(len(states))
@@ -100,6 +113,12 @@ def plot_labeled_states(states, labels, convert_labels=convert_label, report=Non
     report.add_image(img, 'itr: {}\n{}'.format(itr, summary_string), width=500)
 
 
+def _subsample_labeled(samples, sample_classes, size):
+    size = min(size, samples.shape[0])
+    indices = np.random.choice(samples.shape[0], size, replace=False)
+    return samples[indices, :], sample_classes[indices]
+
+
 def plot_labeled_samples(samples, sample_classes=None, text_labels=None, markers=None, fname=None, limit=None,
                          center=None, size=1000, colors=('r', 'g', 'b', 'm', 'k'), bounds=None, maze_id=None):
     """
@@ -109,11 +128,10 @@ def plot_labeled_samples(samples, sample_classes=None, text_labels=None, markers
     :param markers: dic with marker for every sample_class (dict, or list if the keys are ints)
     :param colors: 
     :param fname: 
+    :param size: number of samples drawn at random to be plotted, None to plot them all
     """
-    size = min(size, samples.shape[0])
-    indices = np.random.choice(samples.shape[0], size, replace=False)
-    samples = samples[indices, :]
-    sample_classes = sample_classes[indices]
+    if size is not None:
+        samples, sample_classes = _subsample_labeled(samples, sample_classes, size)
     if markers is None:
         markers = {i: 'o' for i in text_labels.keys()}  # the keys of the text_labels are 0, 1, ...
 
@@ -187,24 +205,13 @@ def plot_labeled_samples(samples, sample_classes=None, text_labels=None, markers
 
     if fname is not None:
         plt.savefig(fname, format='png', bbox_extra_artists=(lgd,), bbox_inches='tight')
-        # plt.cla()
-        # plt.clf()
-        plt.close('all')
-        # del fig, ax, cmap, cbar, map_plot
-        gc.collect()
-        return scipy.misc.imread(fname)
-    else:
-        fp = tempfile.TemporaryFile()
-        plt.savefig(fp, format='png', bbox_extra_artists=(lgd,), bbox_inches='tight')
-        fp.seek(0)
-        img = scipy.misc.imread(fp)
-        fp.close()
-        # plt.cla()
-        # plt.clf()
-        plt.close('all')
-        # del fig, ax, cmap, cbar, map_plot
-        gc.collect()
-        return img
+    img = figure_to_array(fig, bbox_extra_artists=(lgd,), bbox_inches='tight')
+    # plt.cla()
+    # plt.clf()
+    plt.close('all')
+    # del fig, ax, cmap, cbar, map_plot
+    gc.collect()
+    return img
 
 
 def plot_bounds(ax, bounds, dim=2, label='', color='b'):
@@ -254,24 +261,13 @@ def plot_gan_samples(gan, limit, fname=None, size=500):
         plt.xlim(-limit, limit)
     if fname is not None:
         plt.savefig(fname, format='png')
-        # plt.cla()
-        # plt.clf()
-        plt.close('all')
-        # del fig, ax, cmap, cbar, map_plot
-        gc.collect()
-        return scipy.misc.imread(fname)
-    else:
-        fp = tempfile.TemporaryFile()
-        plt.savefig(fp, format='png')
-        fp.seek(0)
-        img = scipy.misc.imread(fp)
-        fp.close()
-        # plt.cla()
-        # plt.clf()
-        plt.close('all')
-        # del fig, ax, cmap, cbar, map_plot
-        gc.collect()
-        return img
+    img = figure_to_array(fig)
+    # plt.cla()
+    # plt.clf()
+    plt.close('all')
+    # del fig, ax, cmap, cbar, map_plot
+    gc.collect()
+    return img
 
 
 def plot_line_graph(fname=None, *args, **kwargs):
@@ -280,11 +276,4 @@ def plot_line_graph(fname=None, *args, **kwargs):
     plt.plot(*args, **kwargs)
     if fname is not None:
         plt.savefig(fname, format='png')
-        return scipy.misc.imread(fname)
-    else:
-        fp = tempfile.TemporaryFile()
-        plt.savefig(fp, format='png')
-        fp.seek(0)
-        img = scipy.misc.imread(fp)
-        fp.close()
-        return img
+    return figure_to_array()
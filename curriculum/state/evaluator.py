@@ -1,12 +1,19 @@
+import atexit
+import hashlib
+import itertools
 import multiprocessing
 import os
+import queue
+import shutil
 import tempfile
 import numpy as np
 from collections import OrderedDict
 import cloudpickle
 import time
 
-from rllab.sampler.utils import rollout
+from rllab.core.parameterized import Parameterized
+from rllab.core.serializable import Serializable
+from rllab.sampler.utils import rollout, has_batch_rollout
 from rllab.misc import logger
 
 from curriculum.envs.base import FixedStateGenerator
@@ -51,6 +58,190 @@ def disable_cuda_initializer(*args, **kwargs):
     os.environ['CUDA_VISIBLE_DEVICES'] = ''
 
 
+class _SharedObject(object):
+    """
+    Reference to a heavy object that the evaluation workers load from disk once. They keep its pickle between calls
+    and unpickle a fresh copy of it at every call, so that what a call does to the object is not seen by the next one.
+    """
+
+    def __init__(self, token, path, call_id, param_values=None):
+        self.token = token
+        self.path = path
+        self.call_id = call_id
+        self.param_values = param_values
+
+
+# worker side cache of the objects shipped through _SharedObject: token -> [pickle, obj, call_id]
+_worker_objects = OrderedDict()
+
+
+def _resolve_shared(value, max_cached_objects):
+    if not isinstance(value, _SharedObject):
+        return value
+    if value.token not in _worker_objects:
+        with open(value.path, 'rb') as f:
+            _worker_objects[value.token] = [f.read(), None, None]
+        while len(_worker_objects) > max_cached_objects:
+            _worker_objects.popitem(last=False)
+    else:
+        _worker_objects.move_to_end(value.token)
+    entry = _worker_objects[value.token]
+    if entry[2] != value.call_id:
+        entry[1] = cloudpickle.loads(entry[0])
+        entry[2] = value.call_id
+        if value.param_values is not None:
+            entry[1].set_param_values(value.param_values)
+    return entry[1]
+
+
+class _PooledFunctionWrapper(FunctionWrapper):
+    """ FunctionWrapper whose heavy arguments have been replaced by _SharedObject references. """
+
+    def __init__(self, func, args, kwargs, max_cached_objects):
+        super(_PooledFunctionWrapper, self).__init__(func, *args, **kwargs)
+        self.max_cached_objects = max_cached_objects
+
+    def __call__(self, obj):
+        args = [_resolve_shared(arg, self.max_cached_objects) for arg in self.args]
+        kwargs = {k: _resolve_shared(v, self.max_cached_objects) for k, v in self.kwargs.items()}
+        return FunctionWrapper(self.func, *args, **kwargs)(obj)
+
+    def __getstate__(self):
+        d = super(_PooledFunctionWrapper, self).__getstate__()
+        d['max_cached_objects'] = self.max_cached_objects
+        return d
+
+    def __setstate__(self, d):
+        super(_PooledFunctionWrapper, self).__setstate__(d)
+        self.max_cached_objects = d['max_cached_objects']
+
+
+class EvaluationPool(object):
+    """
+    Long-lived process pool behind parallel_map. The Serializable arguments of a FunctionWrapper (env, policy, ...)
+    are pickled to a shared temporary folder, under the hash of their state without the parameter values, and the
+    workers keep them across calls: an object is only pickled again when its state changed, and the flat parameters
+    of Parameterized objects (the policy) travel with the tasks.
+    """
+
+    def __init__(self, max_cached_objects=8):
+        self.n_processes = None
+        self.pool = None
+        self.max_cached_objects = max_cached_objects
+        self.timings = dict(spawn=0., serialize=0., compute=0.)
+        self._tmp_dir = None
+        self._n_calls = 0
+        # hash of the state -> path of the pickled object
+        self._shipped = OrderedDict()
+
+    def initialize(self, n_processes):
+        self.terminate()
+        self.pool = multiprocessing.Pool(
+            n_processes,
+            initializer=disable_cuda_initializer
+        )
+        self.n_processes = n_processes
+        self._tmp_dir = tempfile.mkdtemp(prefix='evaluation_pool_', dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+
+    def terminate(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        if self._tmp_dir is not None:
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+            self._tmp_dir = None
+        self._shipped.clear()
+        self.n_processes = None
+
+    def _share(self, obj):
+        state = obj.__getstate__()
+        param_values = None
+        if isinstance(obj, Parameterized):
+            state = dict(state)
+            state.pop('params', None)
+            param_values = obj.get_param_values()
+        token = hashlib.sha1(cloudpickle.dumps((type(obj), state), protocol=3)).hexdigest()
+        if token in self._shipped:
+            self._shipped.move_to_end(token)
+        else:
+            path = os.path.join(self._tmp_dir, token + '.pkl')
+            with open(path, 'wb') as f:
+                cloudpickle.dump(obj, f, protocol=3)
+            self._shipped[token] = path
+            while len(self._shipped) > self.max_cached_objects:
+                os.remove(self._shipped.popitem(last=False)[1])
+        return _SharedObject(token, self._shipped[token], self._n_calls, param_values)
+
+    def _wrap(self, func):
+        self._n_calls += 1
+        args = [self._share(arg) if isinstance(arg, Serializable) else arg for arg in func.args]
+        kwargs = {k: self._share(v) if isinstance(v, Serializable) else v for k, v in func.kwargs.items()}
+        return _PooledFunctionWrapper(func.func, args, kwargs, self.max_cached_objects)
+
+    def map(self, func, iterable_object, num_processes):
+        start = time.time()
+        if self.pool is None or self.n_processes != num_processes:
+            self.initialize(num_processes)
+        spawned = time.time()
+        if isinstance(func, FunctionWrapper):
+            func = self._wrap(func)
+        serialized = time.time()
+        results = self.pool.map(func, iterable_object)
+        computed = time.time()
+        self.timings['spawn'] += spawned - start
+        self.timings['serialize'] += serialized - spawned
+        self.timings['compute'] += computed - serialized
+        logger.log("Evaluation pool: spawn {:.2f}s, serialize {:.2f}s, compute {:.2f}s".format(
+            spawned - start, serialized - spawned, computed - serialized))
+        return results
+
+
+    def stream(self, func, iterable_object, num_processes, discard=None):
+        """
+        Generator over the results of func on the elements of iterable_object, in completion order. The elements are
+        only pulled from the iterable when a worker is free (so it can be endless), and the consumer can stop at any
+        time: closing the generator waits for the tasks still running and hands their results to discard.
+        """
+        if self.pool is None or self.n_processes != num_processes:
+            self.initialize(num_processes)
+        if isinstance(func, FunctionWrapper):
+            func = self._wrap(func)
+        start = time.time()
+        done = queue.Queue()
+        tasks = iter(iterable_object)
+        n_running = 0
+
+        def submit(n):
+            n_submitted = 0
+            for task in itertools.islice(tasks, n):
+                self.pool.apply_async(func, (task,), callback=lambda result: done.put((True, result)),
+                                      error_callback=lambda error: done.put((False, error)))
+                n_submitted += 1
+            return n_submitted
+
+        try:
+            n_running += submit(num_processes)
+            while n_running > 0:
+                success, result = done.get()
+                n_running -= 1
+                if not success:
+                    raise result
+                yield result
+                n_running += submit(1)
+        finally:
+            while n_running > 0:
+                success, result = done.get()
+                n_running -= 1
+                if success and discard is not None:
+                    discard(result)
+            self.timings['compute'] += time.time() - start
+
+
+evaluation_pool = EvaluationPool()
+atexit.register(evaluation_pool.terminate)
+
+
 def parallel_map(func, iterable_object, num_processes=-1):
     """Parallelized map function based on python process
     Args:
@@ -66,85 +257,163 @@ def parallel_map(func, iterable_object, num_processes=-1):
     if num_processes == -1:
         from rllab.sampler.stateful_pool import singleton_pool
         num_processes = singleton_pool.n_parallel
-    process_pool = multiprocessing.Pool(
-        num_processes,
-        initializer=disable_cuda_initializer
-    )
-    results = process_pool.map(func, iterable_object)
-    process_pool.close()
-    process_pool.join()
-    return results
+    return evaluation_pool.map(func, iterable_object, num_processes)
+
+def parallel_stream(func, iterable_object, num_processes=-1, discard=None):
+    """
+    Like parallel_map, but yields the results as they come (in any order) and only runs func on the elements that
+    are needed: see EvaluationPool.stream.
+    """
+    if num_processes == 1:
+        return (func(x) for x in iterable_object)
+    if num_processes == -1:
+        from rllab.sampler.stateful_pool import singleton_pool
+        num_processes = singleton_pool.n_parallel
+    return evaluation_pool.stream(func, iterable_object, num_processes, discard=discard)
+
+def _path_totals(paths, key='rewards'):
+    """ evaluate_path on a list of paths at once: the sum of path[key] (or path['env_infos'][key]) for each path. """
+    values = [np.ravel(path[key] if key in path else path['env_infos'][key]) for path in paths]
+    # bincount, unlike add.reduceat, gives 0 to the empty paths
+    path_indices = np.repeat(np.arange(len(values)), [len(value) for value in values])
+    return np.bincount(path_indices, weights=np.concatenate(values + [np.zeros(0)]).astype(float),
+                       minlength=len(values)).astype(float)
+
+
+def _path_states(paths, as_goal=True, env=None):
+    """ The goal (as_goal) or the start of each path, as the rows of an array. """
+    if as_goal:
+        return np.array([path['env_infos']['goal'][0] for path in paths], dtype=float)
+    # the start space transformation is defined by the env for a single observation
+    return np.array([
+        env.transform_to_start_space(path['observations'][0], {k: v[0] for k, v in path['env_infos'].items()})
+        for path in paths
+    ], dtype=float)
+
+
+def _state_keys(states, decimals=None):
+    """
+    One void scalar per row of states, so that np.unique can group identical states. With decimals, the states are
+    rounded first, so that states closer than this quantization share their key.
+    """
+    if decimals is not None:
+        states = np.round(states, decimals)
+    states = np.ascontiguousarray(states + 0.)  # so that -0. and 0. get the same key
+    return states.view(np.dtype((np.void, states.dtype.itemsize * states.shape[1]))).ravel()
+
+
+class StateRewardAggregator(object):
+    """
+    Running mean of the path rewards grouped by the state (goal or start) each path was rolled out from. Paths can be
+    added in chunks as they arrive; the grouping is done with np.unique on the rows of the states, and the groups are
+    kept in order of first appearance.
+    """
+
+    def __init__(self, key='rewards', as_goal=True, env=None, decimals=None):
+        self.key = key
+        self.as_goal = as_goal
+        self.env = env
+        self.decimals = decimals
+        self.states = None
+        self.reward_sums = np.zeros(0)
+        self.counts = np.zeros(0, dtype=int)
+        self._keys = None
+
+    @property
+    def n_states(self):
+        return len(self.counts)
+
+    def add_paths(self, paths):
+        if len(paths) == 0:
+            return
+        states = _path_states(paths, as_goal=self.as_goal, env=self.env)
+        rewards = _path_totals(paths, key=self.key)
+        keys = _state_keys(states, self.decimals)
+        n_old = self.n_states
+        if n_old > 0:
+            keys = np.concatenate([self._keys, keys])
+            states = np.concatenate([self.states, states])
+        _, first_idx, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        # renumber the groups by first appearance: the old groups, which come first, keep their number
+        order = np.argsort(first_idx)
+        group_of_unique = np.empty_like(order)
+        group_of_unique[order] = np.arange(len(order))
+        groups = group_of_unique[inverse[n_old:]]
+        reward_sums = np.bincount(groups, weights=rewards, minlength=len(order))
+        counts = np.bincount(groups, minlength=len(order))
+        reward_sums[:n_old] += self.reward_sums
+        counts[:n_old] += self.counts
+        self.reward_sums, self.counts = reward_sums, counts
+        self._keys = keys[first_idx[order]]
+        self.states = states[first_idx[order]]
+
+    def mean_rewards(self, n_traj=1):
+        """ :return: the states with at least n_traj paths, and their mean reward """
+        selected = self.counts >= n_traj
+        return self.states[selected], self.reward_sums[selected] / self.counts[selected]
+
+    def ordered_mean_rewards(self, states, n_traj=1):
+        """
+        :return: the mean reward of each of the given states (0 when it has less than n_traj paths), and whether it
+        had enough paths
+        """
+        states = np.array(states, dtype=float)
+        mean_rewards = np.zeros(len(states))
+        updated = np.zeros(len(states), dtype=bool)
+        if self.n_states == 0 or len(states) == 0:
+            return mean_rewards, updated
+        keys = np.concatenate([self._keys, _state_keys(states, self.decimals)])
+        _, inverse = np.unique(keys, return_inverse=True)
+        group_of_unique = -np.ones(inverse.max() + 1, dtype=int)
+        group_of_unique[inverse[:self.n_states]] = np.arange(self.n_states)
+        groups = group_of_unique[inverse[self.n_states:]]
+        found = groups >= 0
+        updated[found] = self.counts[groups[found]] >= n_traj
+        mean_rewards[updated] = self.reward_sums[groups[updated]] / self.counts[groups[updated]]
+        return mean_rewards, updated
+
 
 def compute_rewards_from_paths(all_paths, key='rewards', as_goal=True, env=None, terminal_eps=0.1):
-    all_rewards = []
-    all_states = []
-    for paths in all_paths:
-        for path in paths:
-            if key == 'competence':
-                #goal = tuple(path['env_infos']['goal'][0])
-                goal_np_array = np.array(tuple(path['env_infos']['goal'][0]))
-                start_state = np.array(tuple(env.transform_to_goal_space(path['observations'][0])))
-                end_state = np.array(tuple(env.transform_to_goal_space(path['observations'][-1])))
-                final_dist = np.linalg.norm(goal_np_array - end_state)
-                initial_dist = np.linalg.norm(start_state - goal_np_array)
-                if final_dist > initial_dist:
-                    competence = -1
-                elif final_dist < terminal_eps:
-                    competence = 0
-                else:
-                    competence = -final_dist / initial_dist
-                reward = competence
-            else:
-                reward = evaluate_path(path, key=key)
-
-            if as_goal:
-                state = tuple(path['env_infos']['goal'][0])
-            else:
-                state = tuple(env.transform_to_start_space(path['observations'][0]))
-
-            all_states.append(state)
-            all_rewards.append(reward)
-
-    return [all_states, all_rewards]
+    paths = [path for paths in all_paths for path in paths]
+    if len(paths) == 0:
+        return [[], []]
+    if key == 'competence':
+        goals = np.array([path['env_infos']['goal'][0] for path in paths], dtype=float)
+        start_states = np.array([env.transform_to_goal_space(path['observations'][0]) for path in paths])
+        end_states = np.array([env.transform_to_goal_space(path['observations'][-1]) for path in paths])
+        final_dist = np.linalg.norm(goals - end_states, axis=1)
+        initial_dist = np.linalg.norm(start_states - goals, axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rewards = -final_dist / initial_dist
+        rewards[final_dist < terminal_eps] = 0
+        rewards[final_dist > initial_dist] = -1
+    else:
+        rewards = _path_totals(paths, key=key)
+
+    if as_goal:
+        states = _path_states(paths, as_goal=True)
+    else:
+        states = np.array([env.transform_to_start_space(path['observations'][0]) for path in paths])
+
+    return [[tuple(state) for state in states], list(rewards)]
 
 
 def label_states_from_paths(all_paths, min_reward=0, max_reward=1, key='rewards', as_goal=True,
                  old_rewards=None, improvement_threshold=0, n_traj=1, env=None, return_mean_rewards = False,
                             order_of_states = None):
-    state_dict = {}
-    for paths in all_paths:
-        for path in paths:
-            reward = evaluate_path(path, key=key)
-            if as_goal:
-                state = tuple(path['env_infos']['goal'][0])
-            else:
-                env_infos_first_time_step = {key: value[0] for key, value in path['env_infos'].items()}
-                state = tuple(env.transform_to_start_space(path['observations'][0], env_infos_first_time_step))
-            if state in state_dict:
-                state_dict[state].append(reward)
-            else:
-                state_dict[state] = [reward]
-
-    states = []
-    unlabeled_state = []
-    mean_rewards = []
+    aggregator = StateRewardAggregator(key=key, as_goal=as_goal, env=env)
+    aggregator.add_paths([path for paths in all_paths for path in paths])
 
     if order_of_states is None:
-        for state, rewards in state_dict.items():
-            if len(rewards) >= n_traj:
-                states.append(list(state))
-                mean_rewards.append(np.mean(rewards))
+        if aggregator.n_states > 0:
+            states, mean_rewards = aggregator.mean_rewards(n_traj)
+        else:
+            states, mean_rewards = np.array([]), np.array([])
     # case where you want states returned in a specific order (useful for TSCL)
     else:
-        updated = []
-        for state in order_of_states:
-            states.append(state)
-            if state not in state_dict or len(state_dict[tuple(state)]) < n_traj:
-                mean_rewards.append(0)
-                updated.append(False)
-            else:
-                mean_rewards.append(np.mean(state_dict[tuple(state)]))
-                updated.append(True)
+        states = np.array(order_of_states)
+        mean_rewards, updated = aggregator.ordered_mean_rewards(order_of_states, n_traj)
+        updated = list(updated)
 
     # Make this a vertical list.
     mean_rewards = np.array(mean_rewards).reshape(-1, 1)
@@ -152,7 +421,6 @@ def label_states_from_paths(all_paths, min_reward=0, max_reward=1, key='rewards'
     labels = compute_labels(mean_rewards, old_rewards=old_rewards, min_reward=min_reward, max_reward=max_reward,
                             improvement_threshold=improvement_threshold)
 
-    states = np.array(states)
     if return_mean_rewards:
         if order_of_states is not None:
             return [states, labels, mean_rewards, updated] # updated is used for curriculum learning
@@ -161,11 +429,18 @@ def label_states_from_paths(all_paths, min_reward=0, max_reward=1, key='rewards'
 
 
 def label_states(states, env, policy, horizon, as_goals=True, min_reward=0.1, max_reward=0.9, key='rewards',
-                 old_rewards=None, improvement_threshold=0.1, n_traj=1, n_processes=-1, full_path=False, return_rew=False):
+                 old_rewards=None, improvement_threshold=0.1, n_traj=1, n_processes=-1, full_path=False, return_rew=False,
+                 early_stop=False, reward_bounds=(0, 1), confidence=1.):
+    """
+    :param early_stop: stop rolling out a state as soon as its label is settled (see evaluate_states). The mean rewards
+    of those states are then the ones of the rollouts done. Not used with old_rewards, whose label needs the exact mean.
+    """
     logger.log("Labelling starts")
+    reward_band = (min_reward, max_reward) if early_stop and old_rewards is None else None
     result = evaluate_states(
         states, env, policy, horizon, as_goals=as_goals,
-        n_traj=n_traj, n_processes=n_processes, key=key, full_path=full_path
+        n_traj=n_traj, n_processes=n_processes, key=key, full_path=full_path,
+        reward_band=reward_band, reward_bounds=reward_bounds, confidence=confidence,
     )
     if full_path:
         mean_rewards, paths = result
@@ -239,9 +514,114 @@ def convert_label(labels):
     return new_labels, classes
 
 
+class _RewardBandTest(object):
+    """
+    Sequential test telling, as the rollouts of each state come in, whether its mean reward over n_traj rollouts is
+    already known to be <= min_reward, >= max_reward or in between (the band of compute_labels). The rewards of a
+    rollout are assumed within reward_bounds, which bounds the mean of the remaining rollouts. With confidence < 1, the
+    label is also settled when the Hoeffding interval of the expected reward at that confidence is.
+    """
+
+    def __init__(self, n_states, n_traj, reward_band, reward_bounds=(0, 1), confidence=1.):
+        self.n_traj = n_traj
+        self.min_reward, self.max_reward = reward_band
+        self.low, self.high = reward_bounds
+        self.confidence = confidence
+        self.n_done = np.zeros(n_states, dtype=int)
+        self.sums = np.zeros(n_states)
+        self.decided = np.zeros(n_states, dtype=bool)
+
+    def _settles(self, lower, upper):
+        return (lower > self.min_reward) == (upper > self.min_reward) and \
+               (lower < self.max_reward) == (upper < self.max_reward)
+
+    def add(self, index, value):
+        self.n_done[index] += 1
+        self.sums[index] += value
+        n, total = self.n_done[index], self.sums[index]
+        n_left = self.n_traj - n
+        decided = self._settles((total + n_left * self.low) / self.n_traj, (total + n_left * self.high) / self.n_traj)
+        if not decided and self.confidence < 1:
+            width = (self.high - self.low) * np.sqrt(np.log(2. / (1. - self.confidence)) / (2. * n))
+            decided = self._settles(total / n - width, total / n + width)
+        self.decided[index] = decided or n_left == 0
+
+    @property
+    def n_saved(self):
+        return int(self.n_traj * len(self.n_done) - self.n_done.sum())
+
+
+def _evaluate_state_once(task, env, policy, horizon, full_path=False, key='rewards', as_goals=True,
+                         aggregator=(np.sum, np.mean)):
+    """ Task of sequential_evaluate_states: one rollout of task = (index, state), aggregated with aggregator[0] """
+    index, state = task
+    value, paths = evaluate_state(state, env, policy, horizon, n_traj=1, full_path=True, key=key, as_goals=as_goals,
+                                  aggregator=(aggregator[0], lambda values: values[0]))
+    return index, value, paths[0] if full_path else None
+
+
+def sequential_evaluate_states(states, env, policy, horizon, reward_band, n_traj=1, n_processes=-1, full_path=False,
+                               key='rewards', as_goals=True, aggregator=(np.sum, np.mean), reward_bounds=(0, 1),
+                               confidence=1.):
+    """
+    evaluate_states that stops rolling out a state once _RewardBandTest settles its label. The rollouts are handed out
+    one at a time to the free workers, to the undecided state with the fewest rollouts.
+    """
+    assert aggregator[1] is np.mean, "The sequential test is only defined for the mean over the rollouts"
+    test = _RewardBandTest(len(states), n_traj, reward_band, reward_bounds, confidence)
+    n_running = np.zeros(len(states), dtype=int)
+    values = [[] for _ in states]
+    paths = [[] for _ in states]
+
+    def tasks():
+        while True:
+            n_started = test.n_done + n_running
+            candidates = np.flatnonzero(~test.decided & (n_started < n_traj))
+            if not candidates.size:
+                return
+            index = candidates[np.argmin(n_started[candidates])]
+            n_running[index] += 1
+            yield index, states[index]
+
+    evaluate_state_wrapper = FunctionWrapper(
+        _evaluate_state_once,
+        env=env,
+        policy=policy,
+        horizon=horizon,
+        full_path=full_path,
+        key=key,
+        as_goals=as_goals,
+        aggregator=aggregator,
+    )
+    for index, value, path in parallel_stream(evaluate_state_wrapper, tasks(), n_processes):
+        n_running[index] -= 1
+        test.add(index, value)
+        values[index].append(value)
+        paths[index].append(path)
+
+    logger.log("Sequential evaluation saved {} rollouts out of {}".format(test.n_saved, n_traj * len(states)))
+    logger.record_tabular('EvalRolloutsSaved', test.n_saved)
+    mean_rewards = np.array([aggregator[1](state_values) for state_values in values])
+    if full_path:
+        return mean_rewards, [path for state_paths in paths for path in state_paths]
+    return mean_rewards
+
+
 def evaluate_states(states, env, policy, horizon, n_traj=1, n_processes=-1, full_path=False, key='rewards',
                     as_goals=True,
-                    aggregator=(np.sum, np.mean)):
+                    aggregator=(np.sum, np.mean), reward_band=None, reward_bounds=(0, 1), confidence=1.):
+    """
+    :param reward_band: (min_reward, max_reward) to stop rolling out the states whose label is settled early, see
+    _RewardBandTest. The mean rewards of those states are then the ones of the rollouts done.
+    """
+    if as_goals and has_batch_rollout(env):
+        return batch_evaluate_states(states, env, policy, horizon, n_traj=n_traj, full_path=full_path, key=key,
+                                     aggregator=aggregator, reward_band=reward_band, reward_bounds=reward_bounds,
+                                     confidence=confidence)
+    if reward_band is not None:
+        return sequential_evaluate_states(states, env, policy, horizon, reward_band, n_traj=n_traj,
+                                          n_processes=n_processes, full_path=full_path, key=key, as_goals=as_goals,
+                                          aggregator=aggregator, reward_bounds=reward_bounds, confidence=confidence)
     evaluate_state_wrapper = FunctionWrapper(
         evaluate_state,
         env=env,
@@ -264,6 +644,56 @@ def evaluate_states(states, env, policy, horizon, n_traj=1, n_processes=-1, full
     return np.array(result)
 
 
+def batch_evaluate_states(states, env, policy, horizon, n_traj=1, full_path=False, key='rewards',
+                          aggregator=(np.sum, np.mean), reward_band=None, reward_bounds=(0, 1), confidence=1.):
+    """ Same as evaluate_states for goals, in this process, with the paths rolled out env.n_envs at a time. """
+    if reward_band is not None:
+        return _batch_sequential_evaluate_states(states, env, policy, horizon, reward_band, n_traj=n_traj,
+                                                 full_path=full_path, key=key, aggregator=aggregator,
+                                                 reward_bounds=reward_bounds, confidence=confidence)
+    goals = np.repeat(np.asarray(states), n_traj, axis=0)
+    paths = []
+    for i in range(0, len(goals), env.n_envs):
+        paths.extend(env.batch_rollout(policy, horizon, goals=goals[i:i + env.n_envs]))
+
+    aggregated_data = np.array([
+        aggregator[0](path[key] if key in path else path['env_infos'][key]) for path in paths
+    ]).reshape(-1, n_traj)
+    mean_rewards = np.array([aggregator[1](state_data) for state_data in aggregated_data])
+
+    if full_path:
+        return mean_rewards, paths
+    return mean_rewards
+
+
+def _batch_sequential_evaluate_states(states, env, policy, horizon, reward_band, n_traj=1, full_path=False,
+                                      key='rewards', aggregator=(np.sum, np.mean), reward_bounds=(0, 1), confidence=1.):
+    """ sequential_evaluate_states with batch_rollout: one rollout of every undecided goal per round """
+    assert aggregator[1] is np.mean, "The sequential test is only defined for the mean over the rollouts"
+    states = np.asarray(states)
+    test = _RewardBandTest(len(states), n_traj, reward_band, reward_bounds, confidence)
+    values = [[] for _ in states]
+    paths = [[] for _ in states]
+    for _ in range(n_traj):
+        undecided = np.flatnonzero(~test.decided)
+        if not undecided.size:
+            break
+        for i in range(0, len(undecided), env.n_envs):
+            indices = undecided[i:i + env.n_envs]
+            for index, path in zip(indices, env.batch_rollout(policy, horizon, goals=states[indices])):
+                value = aggregator[0](path[key] if key in path else path['env_infos'][key])
+                test.add(index, value)
+                values[index].append(value)
+                paths[index].append(path)
+
+    logger.log("Sequential evaluation saved {} rollouts out of {}".format(test.n_saved, n_traj * len(states)))
+    logger.record_tabular('EvalRolloutsSaved', test.n_saved)
+    mean_rewards = np.array([aggregator[1](state_values) for state_values in values])
+    if full_path:
+        return mean_rewards, [path for state_paths in paths for path in state_paths]
+    return mean_rewards
+
+
 def evaluate_state(state, env, policy, horizon, n_traj=1, full_path=False, key='rewards', as_goals=True,
                    aggregator=(np.sum, np.mean)):
     aggregated_data = []
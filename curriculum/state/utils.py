@@ -18,130 +18,227 @@ import scipy.misc
 from curriculum.state.evaluator import parallel_map, disable_cuda_initializer
 
 
+class _GrowableArray(object):
+    """ Array of rows with amortized O(1) appends (the capacity doubles when full). """
+
+    def __init__(self):
+        self._data = None
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def data(self):
+        if self._data is None:
+            return np.empty((0, 0))
+        return self._data[:self._size]
+
+    def extend(self, rows):
+        rows = np.asarray(rows)
+        if len(rows) == 0:
+            return
+        if self._data is None:
+            self._data = np.empty((max(len(rows), 16),) + rows.shape[1:], dtype=rows.dtype)
+        elif self._size + len(rows) > len(self._data):
+            new_data = np.empty((max(2 * len(self._data), self._size + len(rows)),) + self._data.shape[1:],
+                                dtype=np.result_type(self._data, rows))
+            new_data[:self._size] = self._data[:self._size]
+            self._data = new_data
+        self._data[self._size:self._size + len(rows)] = rows
+        self._size += len(rows)
+
+    def clear(self):
+        self._data = None
+        self._size = 0
+
+
+class _StateIndex(object):
+    """
+    Nearest neighbour index used for the distance threshold checks: a cKDTree over most of the points, and the latest
+    additions kept aside (and checked by brute force) until they are numerous enough to justify rebuilding the tree.
+    """
+
+    def __init__(self, rebuild_fraction=0.1, min_pending=512):
+        self.rebuild_fraction = rebuild_fraction
+        self.min_pending = min_pending
+        self.tree = None
+        self.pending = []
+        self.n_pending = 0
+
+    def __len__(self):
+        return (0 if self.tree is None else self.tree.n) + self.n_pending
+
+    def add(self, points):
+        if len(points) == 0:
+            return
+        self.pending.append(np.array(points, dtype=float))
+        self.n_pending += len(points)
+        tree_size = 0 if self.tree is None else self.tree.n
+        if self.n_pending > max(self.min_pending, self.rebuild_fraction * tree_size):
+            if self.tree is not None:
+                self.pending.insert(0, self.tree.data)
+            self.tree = scipy.spatial.cKDTree(np.concatenate(self.pending))
+            self.pending = []
+            self.n_pending = 0
+
+    def min_dists(self, points):
+        """ Distance from each of the given points to its nearest neighbour in the index. """
+        dists = np.inf * np.ones(len(points))
+        if self.tree is not None:
+            dists = self.tree.query(points, k=1)[0]
+        for pending in self.pending:
+            dists = np.minimum(dists, np.amin(scipy.spatial.distance.cdist(points, pending), axis=1))
+        return dists
+
+
+def filter_close_points(points, distance_threshold):
+    """
+    Greedily keep the points that are at more than distance_threshold from all the previously kept ones, in order.
+    Only the kept points are queried against a cKDTree of the batch, so the cost grows with the number of kept points
+    and the size of their neighbourhoods instead of quadratically.
+    :return: indices of the kept points
+    """
+    if len(points) == 0:
+        return np.zeros(0, dtype=int)
+    tree = scipy.spatial.cKDTree(points)
+    removed = np.zeros(len(points), dtype=bool)
+    kept = []
+    for i in range(len(points)):
+        if not removed[i]:
+            kept.append(i)
+            removed[tree.query_ball_point(points[i], distance_threshold)] = True
+    return np.array(kept, dtype=int)
+
+
 class StateCollection(object):
-    """ A collection of states, with minimum distance threshold for new states. """
+    """
+    A collection of states, with minimum distance threshold for new states. The states are stored in a growable
+    numpy array, and the distance checks go through an incremental kd-tree over state[:idx_lim] (or over the
+    transformed states when a states_transform is given).
+    """
 
     def __init__(self, distance_threshold=None, states_transform = None, idx_lim=None):
         self.distance_threshold = distance_threshold
-        self.state_list = []
         self.states_transform = states_transform
         self.idx_lim = idx_lim
+        self._states = _GrowableArray()
         if self.states_transform:
-            self.transformed_state_list = []
+            self._transformed_states = _GrowableArray()
+        self._index = _StateIndex()
 
     @property
     def size(self):
-        return len(self.state_list)
+        return len(self._states)
+
+    @property
+    def state_list(self):
+        return self._states.data
+
+    @property
+    def transformed_state_list(self):
+        return self._transformed_states.data
 
     def empty(self):
-        self.state_list = []
+        self._states.clear()
+        if self.states_transform:
+            self._transformed_states.clear()
+        self._index = _StateIndex()
 
     def sample(self, size, replace=False, replay_noise=0):
-        states = sample_matrix_row(np.array(self.state_list), size, replace)
+        states = sample_matrix_row(self.state_list, size, replace)
+        if states.base is self._states._data:
+            states = states.copy()
         if replay_noise > 0:
             states += replay_noise * np.random.randn(*states.shape)
         return states
 
+    @property
+    def _filtering(self):
+        return self.distance_threshold is not None and self.distance_threshold > 0
+
     def append(self, states, n_process=None):
+        """
+        Add the states that are at more than distance_threshold from each other and from the ones already in the
+        collection. n_process is kept for backwards compatibility: the kd-tree makes the selection cheap enough to run
+        in the calling process.
+        :return: the added states
+        """
         if self.states_transform:
             return self.append_states_transform(states)
         if len(states) > 0:
             states = np.array(states)
             logger.log("we are trying to append states: {}".format(states.shape))
-            if self.distance_threshold is not None and self.distance_threshold > 0:
+            if self._filtering:
                 states = self._process_states(states)
             logger.log("after processing, we are left with : {}".format(states.shape))
-            if n_process is None:
-                n_process = singleton_pool.n_parallel
-            elif n_process in [-1, 0]:
-                n_process = 1
-            if states.shape[0] >= n_process > 1:
-                states_per_process = states.shape[0] // singleton_pool.n_parallel
-                list_of_states = [states[i * states_per_process: (i+1) * states_per_process, :] for i in range(n_process-1)]
-                list_of_states.append(states[states_per_process * (n_process - 1):, :])
-                states = parallel_map(self._select_states, list_of_states)
-                states = np.concatenate(states)
-            else:
-                states = self._select_states(states)
-            self.state_list.extend(states.tolist())
+            states = self._select_states(states)
+            self._states.extend(states)
+            self._index.add(states[:, :self.idx_lim])
             return states
 
     def _select_states(self, states):
-        # print('selecting states from shape: ', states.shape)
-        selected_states = states
-        selected_states_idx_lim = np.array([state[:self.idx_lim] for state in states])
-        # print('selecting states from shape (after idx_lim of ', self.idx_lim, ': ', selected_states_idx_lim.shape)
-        state_list_idx_lim = np.array([state[:self.idx_lim] for state in self.state_list])
-        # print('the state_list_idx_lim shape: ', np.shape(self.state_list))
-        if self.distance_threshold is not None and self.distance_threshold > 0:
-            if len(self.state_list) > 0:
-                dists = scipy.spatial.distance.cdist(state_list_idx_lim, selected_states_idx_lim)
-                indices = np.amin(dists, axis=0) > self.distance_threshold
-                selected_states = selected_states[indices, :]
-        # print('the selected states are: {}'.format(selected_states.shape))
-        return selected_states
+        """ Drop the states that are within distance_threshold of the ones already in the collection. """
+        if self._filtering and len(self._index) > 0 and len(states) > 0:
+            indices = self._index.min_dists(states[:, :self.idx_lim]) > self.distance_threshold
+            states = states[indices, :]
+        return states
 
     def _process_states(self, states):
         "keep only the states that are at more than dist_threshold from each other"
-        # adding a states transform allows you to maintain full state information while possibly disregarding some dim
         states = np.array(states)
-        results = [states[0]]
-        results_idx_lim = [states[0][:self.idx_lim]]
-        for i, state in enumerate(states[1:]):
-            # print("analyzing state : ", i)
-            if np.amin(scipy.spatial.distance.cdist(results_idx_lim, state.reshape(1, -1)[:self.idx_lim])) > self.distance_threshold:
-                results.append(state)
-                results_idx_lim.append(state[:self.idx_lim])
-        return np.array(results)
+        return states[filter_close_points(states[:, :self.idx_lim], self.distance_threshold)]
 
     def _process_states_transform(self, states, transformed_states):
         "keep only the states that are at more than dist_threshold from each other"
         # adding a states transform allows you to maintain full state information while possibly disregarding some dim
-        results = [states[0]]
-        transformed_results = [transformed_states[0]]
-        for i in range(1, len(states)):
-            # checks if valid in transformed space
-            if np.amin(scipy.spatial.distance.cdist(transformed_results, transformed_states[i].reshape(1, -1))) > self.distance_threshold:
-                results.append(states[i])
-                transformed_results.append(transformed_states[i])
-        return np.array(results), np.array(transformed_results)
+        kept = filter_close_points(transformed_states, self.distance_threshold)
+        return states[kept], transformed_states[kept]
 
     def append_states_transform(self, states):
         assert self.idx_lim is None, "Can't use state transform and idx_lim with StateCollection!"
         if len(states) > 0:
             states = np.array(states)
-            transformed_states = self.states_transform(states)
-            if self.distance_threshold is not None and self.distance_threshold > 0:
+            transformed_states = np.array(self.states_transform(states))
+            if self._filtering:
                 states, transformed_states = self._process_states_transform(states, transformed_states)
-                if len(self.state_list) > 0:
-                    print("hi")
-                    dists = scipy.spatial.distance.cdist(self.transformed_state_list, transformed_states)
-                    indices = np.amin(dists, axis=0) > self.distance_threshold
+                if len(self._index) > 0:
+                    indices = self._index.min_dists(transformed_states) > self.distance_threshold
                     states = states[indices, :]
                     transformed_states = transformed_states[indices, :]
-            self.state_list.extend(states)
-            self.transformed_state_list.extend(transformed_states)
-            assert(len(self.state_list) == len(self.transformed_state_list))
+            self._states.extend(states)
+            self._transformed_states.extend(transformed_states)
+            self._index.add(transformed_states)
+            assert(len(self._states) == len(self._transformed_states))
         return states # modifed to return added states
 
-    # def append(self, states):
-    #     if self.states_transform:
-    #         return self.append_states_transform(states)
-    #     if len(states) > 0:
-    #         states = np.array(states)
-    #         if self.distance_threshold is not None and self.distance_threshold > 0:
-    #             states = self._process_states(states)
-    #             if len(self.state_list) > 0:
-    #                 dists = scipy.spatial.distance.cdist(self.state_list, states)
-    #                 indices = np.amin(dists, axis=0) > self.distance_threshold
-    #                 states = states[indices, :]
-    #         self.state_list.extend(states)
-    #     return states # modifed to return added states
-
     @property
     def states(self):
         return np.array(self.state_list)
 
+    def __getstate__(self):
+        d = self.__dict__.copy()
+        # the kd-tree is rebuilt on loading
+        del d['_index']
+        return d
+
+    def __setstate__(self, d):
+        if 'state_list' in d:
+            # collection pickled before the states were stored in a numpy array
+            states = _GrowableArray()
+            states.extend(np.array(d.pop('state_list')))
+            d['_states'] = states
+            if 'transformed_state_list' in d:
+                transformed_states = _GrowableArray()
+                transformed_states.extend(np.array(d.pop('transformed_state_list')))
+                d['_transformed_states'] = transformed_states
+        self.__dict__.update(d)
+        self._index = _StateIndex()
+        if self.states_transform:
+            self._index.add(self.transformed_state_list)
+        else:
+            self._index.add(self.state_list[:, :self.idx_lim])
+
 class SmartStateCollection(StateCollection):
     # should be used same as before, just need to update Q values
     #TODO: update alpha smartly
@@ -1,5 +1,10 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
 from rllab.algos.base import RLAlgorithm
 from rllab.sampler import parallel_sampler
+from rllab.sampler.stateful_pool import singleton_pool
 from rllab.sampler.base import BaseSampler
 import rllab.misc.logger as logger
 import rllab.plotter as plotter
@@ -19,10 +24,11 @@ class BatchSampler(BaseSampler):
     def shutdown_worker(self):
         parallel_sampler.terminate_task(scope=self.algo.scope)
 
-    def obtain_samples(self, itr):
-        cur_params = self.algo.policy.get_param_values()
+    def obtain_samples(self, itr, policy_params=None):
+        if policy_params is None:
+            policy_params = self.algo.policy.get_param_values()
         paths = parallel_sampler.sample_paths(
-            policy_params=cur_params,
+            policy_params=policy_params,
             max_samples=self.algo.batch_size,
             max_path_length=self.algo.max_path_length,
             scope=self.algo.scope,
@@ -60,6 +66,8 @@ class BatchPolopt(RLAlgorithm):
             whole_paths=True,
             sampler_cls=None,
             sampler_args=None,
+            pipelined=False,
+            max_is_ratio=None,
             **kwargs
     ):
         """
@@ -81,6 +89,9 @@ class BatchPolopt(RLAlgorithm):
         :param positive_adv: Whether to shift the advantages so that they are always positive. When used in
         conjunction with center_adv the advantages will be standardized before shifting.
         :param store_paths: Whether to save all paths data to the snapshot.
+        :param pipelined: Whether to collect the paths of the next iteration while optimizing on the current ones, and
+        write the snapshots on a background thread. Requires parallel workers and a non recurrent policy.
+        :param max_is_ratio: Truncation of the importance weights correcting the pipelined paths for their staleness.
         """
         self.env = env
         self.policy = policy
@@ -98,6 +109,8 @@ class BatchPolopt(RLAlgorithm):
         self.positive_adv = positive_adv
         self.store_paths = store_paths
         self.whole_paths = whole_paths
+        self.pipelined = pipelined
+        self.max_is_ratio = max_is_ratio
         if sampler_cls is None:
             sampler_cls = BatchSampler
         if sampler_args is None:
@@ -114,6 +127,10 @@ class BatchPolopt(RLAlgorithm):
         self.sampler.shutdown_worker()
 
     def train(self, already_init=False):
+        if self.pipelined:
+            if singleton_pool.n_parallel > 1 and not self.policy.recurrent:
+                return self.train_pipelined(already_init=already_init)
+            logger.log("Pipelined training needs parallel workers and a non recurrent policy: running sequentially")
         self.start_worker()
         if not already_init:
             self.init_opt()
@@ -143,6 +160,78 @@ class BatchPolopt(RLAlgorithm):
         self.shutdown_worker()
         return all_paths
 
+    def train_pipelined(self, already_init=False):
+        """
+        Same loop as train, except that the workers already collect the paths of the next iteration, with the current
+        policy parameters, while the master processes and optimizes on the ones of this iteration. The paths used are
+        therefore one policy update old: see correct_stale_samples. Snapshots are written on a background thread.
+        """
+        self.start_worker()
+        if not already_init:
+            self.init_opt()
+        all_paths = []
+        sampling_executor = ThreadPoolExecutor(max_workers=1)
+        snapshot_executor = ThreadPoolExecutor(max_workers=1)
+        saved = None
+        next_paths = sampling_executor.submit(
+            self.sampler.obtain_samples, self.current_itr, self.policy.get_param_values())
+        try:
+            for itr in range(self.current_itr, self.n_itr):
+                with logger.prefix('itr #%d | ' % itr):
+                    paths = next_paths.result()
+                    if itr + 1 < self.n_itr:
+                        next_paths = sampling_executor.submit(
+                            self.sampler.obtain_samples, itr + 1, self.policy.get_param_values())
+                    if saved is not None:
+                        # the previous snapshot must be written before the baseline and the policy change
+                        saved.result()
+                    samples_data = self.sampler.process_samples(itr, paths)
+                    self.correct_stale_samples(samples_data)
+                    self.log_diagnostics(paths)
+                    self.optimize_policy(itr, samples_data)
+                    logger.log("saving snapshot in the background...")
+                    params = self.get_itr_snapshot(itr, samples_data)
+                    self.current_itr = itr + 1
+                    params["algo"] = self
+                    if self.store_paths:
+                        params["paths"] = samples_data["paths"]
+                    all_paths.append(paths)
+                    saved = snapshot_executor.submit(logger.save_itr_params, itr, params)
+                    logger.dump_tabular(with_prefix=False)
+                    if self.plot:
+                        self.update_plot()
+                        if self.pause_for_plot:
+                            input("Plotting evaluation run: Press Enter to "
+                                  "continue...")
+        finally:
+            if saved is not None:
+                saved.result()
+            sampling_executor.shutdown()
+            snapshot_executor.shutdown()
+
+        self.shutdown_worker()
+        return all_paths
+
+    def correct_stale_samples(self, samples_data):
+        """
+        Importance weight the advantages of paths collected with the previous policy parameters by the likelihood
+        ratio between the current policy and the one that sampled them (truncated at max_is_ratio), and replace the
+        dist infos by the current ones. The algorithms then see on-policy data, and trust regions stay centered on
+        the current policy.
+        """
+        dist = self.policy.distribution
+        agent_infos = samples_data["agent_infos"]
+        _, cur_infos = self.policy.get_actions(samples_data["observations"])
+        cur_dist_infos = {k: cur_infos[k] for k in dist.dist_info_keys}
+        ratio = np.exp(dist.log_likelihood(samples_data["actions"], cur_dist_infos) -
+                       dist.log_likelihood(samples_data["actions"], agent_infos))
+        if self.max_is_ratio is not None:
+            ratio = np.minimum(ratio, self.max_is_ratio)
+        samples_data["advantages"] = samples_data["advantages"] * ratio
+        agent_infos.update(cur_dist_infos)
+        logger.record_tabular('AverageISRatio', np.mean(ratio))
+        logger.record_tabular('MaxISRatio', np.max(ratio))
+
     def log_diagnostics(self, paths):
         self.env.log_diagnostics(paths)
         self.policy.log_diagnostics(paths)
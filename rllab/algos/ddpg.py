@@ -8,6 +8,7 @@ from functools import partial
 import rllab.misc.logger as logger
 import theano.tensor as TT
 import pickle as pickle
+import os
 import numpy as np
 import pyprind
 import lasagne
@@ -23,22 +24,44 @@ def parse_update_method(update_method, **kwargs):
 
 
 class SimpleReplayPool(object):
+    """
+    Circular buffer of transitions, stored with compact dtypes. With a memmap_dir, the buffers are np.memmap files in
+    that directory (so the pool can outgrow the RAM), and a pool created again on the same directory with the same
+    sizes and dtypes picks up the transitions stored there.
+    """
+
     def __init__(
-            self, max_pool_size, observation_dim, action_dim):
+            self, max_pool_size, observation_dim, action_dim, observation_dtype=np.float32,
+            action_dtype=np.float32, reward_dtype=np.float32, memmap_dir=None):
         self._observation_dim = observation_dim
         self._action_dim = action_dim
         self._max_pool_size = max_pool_size
-        self._observations = np.zeros(
-            (max_pool_size, observation_dim),
-        )
-        self._actions = np.zeros(
-            (max_pool_size, action_dim),
-        )
-        self._rewards = np.zeros(max_pool_size)
-        self._terminals = np.zeros(max_pool_size, dtype='uint8')
-        self._bottom = 0
-        self._top = 0
-        self._size = 0
+        self._memmap_dir = memmap_dir
+        self._resumed = memmap_dir is not None
+        if memmap_dir is not None:
+            if not os.path.isdir(memmap_dir):
+                os.makedirs(memmap_dir)
+            # bottom, top and size live in the directory too
+            self._pointers = self._buffer('pointers', (3,), np.int64)
+        else:
+            self._pointers = np.zeros(3, dtype=np.int64)
+        self._observations = self._buffer('observations', (max_pool_size, observation_dim), observation_dtype)
+        self._actions = self._buffer('actions', (max_pool_size, action_dim), action_dtype)
+        self._rewards = self._buffer('rewards', (max_pool_size,), reward_dtype)
+        self._terminals = self._buffer('terminals', (max_pool_size,), 'uint8')
+        if not self._resumed:
+            self._pointers[:] = 0
+        self._bottom, self._top, self._size = (int(p) for p in self._pointers)
+
+    def _buffer(self, name, shape, dtype):
+        if self._memmap_dir is None:
+            return np.zeros(shape, dtype=dtype)
+        file_name = os.path.join(self._memmap_dir, '%s.dat' % name)
+        expected_size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        if os.path.exists(file_name) and os.path.getsize(file_name) == expected_size:
+            return np.memmap(file_name, dtype=dtype, mode='r+', shape=shape)
+        self._resumed = False
+        return np.memmap(file_name, dtype=dtype, mode='w+', shape=shape)
 
     def add_sample(self, observation, action, reward, terminal):
         self._observations[self._top] = observation
@@ -50,24 +73,13 @@ class SimpleReplayPool(object):
             self._bottom = (self._bottom + 1) % self._max_pool_size
         else:
             self._size += 1
+        self._pointers[:] = (self._bottom, self._top, self._size)
 
     def random_batch(self, batch_size):
         assert self._size > batch_size
-        indices = np.zeros(batch_size, dtype='uint64')
-        transition_indices = np.zeros(batch_size, dtype='uint64')
-        count = 0
-        while count < batch_size:
-            index = np.random.randint(self._bottom, self._bottom + self._size) % self._max_pool_size
-            # make sure that the transition is valid: if we are at the end of the pool, we need to discard
-            # this sample
-            if index == self._size - 1 and self._size <= self._max_pool_size:
-                continue
-            # if self._terminals[index]:
-            #     continue
-            transition_index = (index + 1) % self._max_pool_size
-            indices[count] = index
-            transition_indices[count] = transition_index
-            count += 1
+        # Every stored sample but the latest one, whose next observation is not in the pool yet, starts a transition
+        indices = (self._bottom + np.random.randint(self._size - 1, size=batch_size)) % self._max_pool_size
+        transition_indices = (indices + 1) % self._max_pool_size
         return dict(
             observations=self._observations[indices],
             actions=self._actions[indices],
@@ -76,6 +88,12 @@ class SimpleReplayPool(object):
             next_observations=self._observations[transition_indices]
         )
 
+    def flush(self):
+        """ Write the memmap buffers to disk. """
+        for buffer in (self._pointers, self._observations, self._actions, self._rewards, self._terminals):
+            if isinstance(buffer, np.memmap):
+                buffer.flush()
+
     @property
     def size(self):
         return self._size
@@ -97,6 +115,8 @@ class DDPG(RLAlgorithm):
             epoch_length=1000,
             min_pool_size=10000,
             replay_pool_size=1000000,
+            replay_pool_observation_dtype=np.float32,
+            replay_pool_dir=None,
             discount=0.99,
             max_path_length=250,
             qf_weight_decay=0.,
@@ -123,6 +143,9 @@ class DDPG(RLAlgorithm):
         :param epoch_length: How many timesteps for each epoch.
         :param min_pool_size: Minimum size of the pool to start training.
         :param replay_pool_size: Size of the experience replay pool.
+        :param replay_pool_observation_dtype: dtype the observations are stored with in the pool (e.g. uint8 for images)
+        :param replay_pool_dir: if given, the pool is kept in np.memmap files in this directory, where it can be
+        resumed from by a later run
         :param discount: Discount factor for the cumulative return.
         :param max_path_length: Discount factor for the cumulative return.
         :param qf_weight_decay: Weight decay factor for parameters of the Q function.
@@ -150,6 +173,8 @@ class DDPG(RLAlgorithm):
         self.epoch_length = epoch_length
         self.min_pool_size = min_pool_size
         self.replay_pool_size = replay_pool_size
+        self.replay_pool_observation_dtype = replay_pool_observation_dtype
+        self.replay_pool_dir = replay_pool_dir
         self.discount = discount
         self.max_path_length = max_path_length
         self.qf_weight_decay = qf_weight_decay
@@ -197,6 +222,8 @@ class DDPG(RLAlgorithm):
             max_pool_size=self.replay_pool_size,
             observation_dim=self.env.observation_space.flat_dim,
             action_dim=self.env.action_space.flat_dim,
+            observation_dtype=self.replay_pool_observation_dtype,
+            memmap_dir=self.replay_pool_dir,
         )
         self.start_worker()
 
@@ -250,6 +277,7 @@ class DDPG(RLAlgorithm):
                 itr += 1
 
             logger.log("Training finished")
+            pool.flush()
             if pool.size >= self.min_pool_size:
                 self.evaluate(epoch, pool)
                 params = self.get_epoch_snapshot(epoch)
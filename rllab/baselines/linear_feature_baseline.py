@@ -4,9 +4,16 @@ import numpy as np
 
 
 class LinearFeatureBaseline(Baseline):
-    def __init__(self, env_spec, reg_coeff=1e-5):
+    def __init__(self, env_spec, reg_coeff=1e-5, max_chunk_size=10000):
+        """
+        :param max_chunk_size: when fitting paths whose features are not cached, the normal equations are accumulated
+        over chunks of at most that many timesteps (or one path if it is longer)
+        """
         self._coeffs = None
         self._reg_coeff = reg_coeff
+        self._max_chunk_size = max_chunk_size
+        # features of the last batch given to predict_n, reused by fit: (paths, feature matrix)
+        self._cached_features = None
 
     @overrides
     def get_param_values(self, **tags):
@@ -17,27 +24,73 @@ class LinearFeatureBaseline(Baseline):
         self._coeffs = val
 
     def _features(self, path):
-        o = np.clip(path["observations"], -10, 10)
-        l = len(path["rewards"])
-        al = np.arange(l).reshape(-1, 1) / 100.0
-        return np.concatenate([o, o ** 2, al, al ** 2, al ** 3, np.ones((l, 1))], axis=1)
+        return self._batch_features([path])
 
-    @overrides
-    def fit(self, paths):
-        featmat = np.concatenate([self._features(path) for path in paths])
-        returns = np.concatenate([path["returns"] for path in paths])
+    def _batch_features(self, paths):
+        """ Features of all the timesteps of the paths, concatenated """
+        lengths = np.asarray([len(path["rewards"]) for path in paths], dtype=int)
+        o = np.clip(np.concatenate([path["observations"] for path in paths]), -10, 10)
+        starts = np.cumsum(lengths) - lengths
+        al = (np.arange(lengths.sum()) - np.repeat(starts, lengths)).reshape(-1, 1) / 100.0
+        return np.concatenate([o, o ** 2, al, al ** 2, al ** 3, np.ones((len(al), 1))], axis=1)
+
+    def _pop_cached_features(self, paths):
+        cached, self._cached_features = self._cached_features, None
+        if cached is not None and len(cached[0]) == len(paths) and all(p is q for p, q in zip(cached[0], paths)):
+            return cached[1]
+        return None
+
+    def normal_equations(self, paths):
+        """
+        Accumulate X^T X and X^T y of the least squares fit of the returns of the paths.
+        They add up over batches of paths, so the ones of several batches can be summed before fit_normal_equations.
+        """
+        featmat = self._pop_cached_features(paths)
+        if featmat is not None:
+            returns = np.concatenate([path["returns"] for path in paths])
+            return featmat.T.dot(featmat), featmat.T.dot(returns)
+
+        xtx, xty = 0., 0.
+        chunk, chunk_size = [], 0
+        for idx, path in enumerate(paths):
+            chunk.append(path)
+            chunk_size += len(path["rewards"])
+            if chunk_size >= self._max_chunk_size or idx == len(paths) - 1:
+                featmat = self._batch_features(chunk)
+                returns = np.concatenate([p["returns"] for p in chunk])
+                xtx = xtx + featmat.T.dot(featmat)
+                xty = xty + featmat.T.dot(returns)
+                chunk, chunk_size = [], 0
+        return xtx, xty
+
+    def fit_normal_equations(self, xtx, xty):
         reg_coeff = self._reg_coeff
         for _ in range(5):
             self._coeffs = np.linalg.lstsq(
-                featmat.T.dot(featmat) + reg_coeff * np.identity(featmat.shape[1]),
-                featmat.T.dot(returns)
+                xtx + reg_coeff * np.identity(xtx.shape[0]),
+                xty
             )[0]
             if not np.any(np.isnan(self._coeffs)):
                 break
             reg_coeff *= 10
 
+    @overrides
+    def fit(self, paths):
+        self.fit_normal_equations(*self.normal_equations(paths))
+
     @overrides
     def predict(self, path):
         if self._coeffs is None:
             return np.zeros(len(path["rewards"]))
         return self._features(path).dot(self._coeffs)
+
+    def predict_n(self, paths):
+        """
+        Predict all the paths at once. Their features are kept for the next call to fit on the same paths.
+        """
+        featmat = self._batch_features(paths)
+        self._cached_features = (list(paths), featmat)
+        bounds = np.cumsum([len(path["rewards"]) for path in paths])[:-1]
+        if self._coeffs is None:
+            return np.split(np.zeros(len(featmat)), bounds)
+        return np.split(featmat.dot(self._coeffs), bounds)
@@ -16,6 +16,7 @@ class AntEnv(MujocoEnv, Serializable):
         Serializable.__init__(self, *args, **kwargs)
 
     def get_current_obs(self):
+        self.sync_sim()
         return np.concatenate([
             self.model.data.qpos.flat,
             self.model.data.qvel.flat,
@@ -26,14 +26,6 @@ class HalfCheetahEnv(MujocoEnv, Serializable):
             self.get_body_com("torso").flat,
         ])
 
-    def get_body_xmat(self, body_name):
-        idx = self.model.body_names.index(body_name)
-        return self.model.data.xmat[idx].reshape((3, 3))
-
-    def get_body_com(self, body_name):
-        idx = self.model.body_names.index(body_name)
-        return self.model.data.com_subtree[idx]
-
     def step(self, action):
         self.forward_dynamics(action)
         next_obs = self.get_current_obs()
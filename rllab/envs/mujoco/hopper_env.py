@@ -36,6 +36,7 @@ class HopperEnv(MujocoEnv, Serializable):
 
     @overrides
     def get_current_obs(self):
+        self.sync_sim()
         return np.concatenate([
             self.model.data.qpos[0:1].flat,
             self.model.data.qpos[2:].flat,
@@ -23,6 +23,7 @@ class InvertedDoublePendulumEnv(MujocoEnv, Serializable):
 
     @overrides
     def get_current_obs(self):
+        self.sync_sim()
         return np.concatenate([
             self.model.data.qpos[:1],  # cart x pos
             np.sin(self.model.data.qpos[1:]),  # link angles
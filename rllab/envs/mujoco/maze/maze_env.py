@@ -8,7 +8,7 @@ from rllab import spaces
 from rllab.envs.base import Step
 from rllab.envs.proxy_env import ProxyEnv
 from rllab.envs.mujoco.maze.maze_env_utils import construct_maze
-from rllab.envs.mujoco.maze.maze_env_utils import ray_segment_intersect, point_distance
+from rllab.envs.mujoco.maze.maze_env_utils import point_distance
 from rllab.envs.mujoco.mujoco_env import MODEL_DIR, BIG
 from rllab.core.serializable import Serializable
 from rllab.misc.overrides import overrides
@@ -119,7 +119,8 @@ class MazeEnv(ProxyEnv, Serializable):
         tree.write(file_path)  # here we write a temporal file with the robot specifications. Why not the original one??
 
         self._goal_range = self._find_goal_range()
-        self._cached_segments = None
+        self._cached_segments = self._find_segments()
+        self._wall_boxes = self._find_wall_boxes()
 
         inner_env = model_cls(*args, file_path=file_path, **kwargs)  # file to the robot specifications
         ProxyEnv.__init__(self, inner_env)  # here is where the robot env will be initialized
@@ -130,62 +131,46 @@ class MazeEnv(ProxyEnv, Serializable):
         robot_x, robot_y = self.wrapped_env.get_body_com("torso")[:2]
         ori = self.get_ori()
 
-        structure = self.MAZE_STRUCTURE
-        size_scaling = self.MAZE_SIZE_SCALING
-
-        segments = []
-        # compute the distance of all segments
-
-        # Get all line segments of the goal and the obstacles
-        for i in range(len(structure)):
-            for j in range(len(structure[0])):
-                if structure[i][j] == 1 or structure[i][j] == 'g':
-                    cx = j * size_scaling - self._init_torso_x
-                    cy = i * size_scaling - self._init_torso_y
-                    x1 = cx - 0.5 * size_scaling
-                    x2 = cx + 0.5 * size_scaling
-                    y1 = cy - 0.5 * size_scaling
-                    y2 = cy + 0.5 * size_scaling
-                    struct_segments = [
-                        ((x1, y1), (x2, y1)),
-                        ((x2, y1), (x2, y2)),
-                        ((x2, y2), (x1, y2)),
-                        ((x1, y2), (x1, y1)),
-                    ]
-                    for seg in struct_segments:
-                        segments.append(dict(
-                            segment=seg,
-                            type=structure[i][j],
-                        ))
-
         wall_readings = np.zeros(self._n_bins)
         goal_readings = np.zeros(self._n_bins)
 
-        for ray_idx in range(self._n_bins):
-            ray_ori = ori - self._sensor_span * 0.5 + 1.0 * (2 * ray_idx + 1) / (2 * self._n_bins) * self._sensor_span
-            ray_segments = []
-            for seg in segments:
-                p = ray_segment_intersect(ray=((robot_x, robot_y), ray_ori), segment=seg["segment"])
-                if p is not None:
-                    ray_segments.append(dict(
-                        segment=seg["segment"],
-                        type=seg["type"],
-                        ray_ori=ray_ori,
-                        distance=point_distance(p, (robot_x, robot_y)),
-                    ))
-            if len(ray_segments) > 0:
-                first_seg = sorted(ray_segments, key=lambda x: x["distance"])[0]
-                # print first_seg
-                if first_seg["type"] == 1:
-                    # Wall -> add to wall readings
-                    if first_seg["distance"] <= self._sensor_range:
-                        wall_readings[ray_idx] = (self._sensor_range - first_seg["distance"]) / self._sensor_range
-                elif first_seg["type"] == 'g':
-                    # Goal -> add to goal readings
-                    if first_seg["distance"] <= self._sensor_range:
-                        goal_readings[ray_idx] = (self._sensor_range - first_seg["distance"]) / self._sensor_range
-                else:
-                    assert False
+        # All the rays against all the segments at once, with the arithmetic of ray_segment_intersect
+        ray_oris = [ori - self._sensor_span * 0.5 + 1.0 * (2 * ray_idx + 1) / (2 * self._n_bins) * self._sensor_span
+                    for ray_idx in range(self._n_bins)]
+        x1 = robot_x
+        y1 = robot_y
+        dx1 = (x1 + np.array([math.cos(ray_ori) for ray_ori in ray_oris]))[:, None] - x1
+        dy1 = (y1 + np.array([math.sin(ray_ori) for ray_ori in ray_oris]))[:, None] - y1
+        x, y, dx, dy, is_goal = self._cached_segments
+
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            DET = (-dx1 * dy + dy1 * dx)
+            DETinv = 1.0 / DET
+            r = DETinv * (-dy * (x - x1) + dx * (y - y1))
+            s = DETinv * (-dy1 * (x - x1) + dx1 * (y - y1))
+            xi = (x1 + r * dx1 + x + s * dx) / 2.0
+            yi = (y1 + r * dy1 + y + s * dy) / 2.0
+            hit = (np.abs(DET) >= 0.00000001) & (r >= 0) & (0 <= s) & (s <= 1)
+            squared_distances = np.where(hit, (xi - robot_x) ** 2 + (yi - robot_y) ** 2, np.inf)
+
+        # The squared distances only shortlist the closest segments of each ray: the readings use the distances of
+        # point_distance, whose scalar powers can differ in the last bit from the array ones
+        closest = np.min(squared_distances, axis=1)
+        near = squared_distances <= closest[:, None] * (1 + 1e-12)
+        first_seg = np.zeros(self._n_bins, dtype=int)
+        first_distance = np.full(self._n_bins, np.inf)
+        for ray_idx in np.flatnonzero(np.isfinite(closest)):
+            candidates = np.flatnonzero(near[ray_idx])
+            distances = [point_distance((xi[ray_idx, k], yi[ray_idx, k]), (robot_x, robot_y)) for k in candidates]
+            first_seg[ray_idx] = candidates[np.argmin(distances)]
+            first_distance[ray_idx] = min(distances)
+
+        # the closest segment of each ray (the first one listed on ties) gives its reading, if it is in range
+        readings = (self._sensor_range - first_distance) / self._sensor_range
+        in_range = first_distance <= self._sensor_range
+        first_is_goal = is_goal[first_seg]
+        wall_readings[in_range & ~first_is_goal] = readings[in_range & ~first_is_goal]
+        goal_readings[in_range & first_is_goal] = readings[in_range & first_is_goal]
 
         obs = np.concatenate([
             wall_readings,
@@ -261,10 +246,41 @@ class MazeEnv(ProxyEnv, Serializable):
                     maxy = i * size_scaling + size_scaling * 0.5 - self._init_torso_y
                     return minx, maxx, miny, maxy
 
-    def _is_in_collision(self, pos):
-        x, y = pos
+    def _find_segments(self):
+        """
+        Start points, directions and goal flags of the sides of all the wall and goal blocks, as arrays in the order
+        in which get_current_maze_obs checks them.
+        """
         structure = self.MAZE_STRUCTURE
         size_scaling = self.MAZE_SIZE_SCALING
+        segments = []
+        is_goal = []
+        # Get all line segments of the goal and the obstacles
+        for i in range(len(structure)):
+            for j in range(len(structure[0])):
+                if structure[i][j] == 1 or structure[i][j] == 'g':
+                    cx = j * size_scaling - self._init_torso_x
+                    cy = i * size_scaling - self._init_torso_y
+                    x1 = cx - 0.5 * size_scaling
+                    x2 = cx + 0.5 * size_scaling
+                    y1 = cy - 0.5 * size_scaling
+                    y2 = cy + 0.5 * size_scaling
+                    segments += [
+                        ((x1, y1), (x2, y1)),
+                        ((x2, y1), (x2, y2)),
+                        ((x2, y2), (x1, y2)),
+                        ((x1, y2), (x1, y1)),
+                    ]
+                    is_goal += [structure[i][j] == 'g'] * 4
+        segments = np.array(segments, dtype=float).reshape(-1, 2, 2)
+        x, y = segments[:, 0, 0], segments[:, 0, 1]
+        return x, y, segments[:, 1, 0] - x, segments[:, 1, 1] - y, np.array(is_goal, dtype=bool)
+
+    def _find_wall_boxes(self):
+        """ minx, maxx, miny, maxy of every wall block, one column each. """
+        structure = self.MAZE_STRUCTURE
+        size_scaling = self.MAZE_SIZE_SCALING
+        boxes = []
         for i in range(len(structure)):
             for j in range(len(structure[0])):
                 if structure[i][j] == 1:
@@ -272,9 +288,13 @@ class MazeEnv(ProxyEnv, Serializable):
                     maxx = j * size_scaling + size_scaling * 0.5 - self._init_torso_x
                     miny = i * size_scaling - size_scaling * 0.5 - self._init_torso_y
                     maxy = i * size_scaling + size_scaling * 0.5 - self._init_torso_y
-                    if minx <= x <= maxx and miny <= y <= maxy:
-                        return True
-        return False
+                    boxes.append((minx, maxx, miny, maxy))
+        return np.array(boxes, dtype=float).reshape(-1, 4).T
+
+    def _is_in_collision(self, pos):
+        x, y = pos
+        minx, maxx, miny, maxy = self._wall_boxes
+        return bool(np.any((minx <= x) & (x <= maxx) & (miny <= y) & (y <= maxy)))
 
     def step(self, action):
         if self.MANUAL_COLLISION:
@@ -93,6 +93,7 @@ class MujocoEnv(Env):
             self.init_qpos = init_qpos
         self.dcom = None
         self.current_com = None
+        self._sim_synced = True
         self.reset()
         super(MujocoEnv, self).__init__()
 
@@ -130,45 +131,81 @@ class MujocoEnv(Env):
             self.model.data.qacc = self.init_qacc
             self.model.data.ctrl = self.init_ctrl
         else:
-            start = 0
-            for datum_name in ["qpos", "qvel", "qacc", "ctrl"]:
-                datum = getattr(self.model.data, datum_name)
-                datum_dim = datum.shape[0]
-                datum = init_state[start: start + datum_dim]
-                if len(datum) == 0:
-                    datum = getattr(self, 'init_' + datum_name)
-                setattr(self.model.data, datum_name, datum)
-                start += datum_dim
-                self.model.forward()
+            self.set_sim_state(self.full_sim_state(init_state))
         # print("inside mujoco reset: ", self.model.data.qpos, self.model.data.qvel, self.model.data.qacc, self.model.data.ctrl)
 
     @overrides
     def reset(self, init_state=None, *args, **kwargs):
+        self._sim_synced = True
         self.reset_mujoco(init_state)
-        self.model.forward()
-        self.current_com = self.model.data.com_subtree[0]
-        self.dcom = np.zeros_like(self.current_com)
+        if self._sim_synced:
+            # reset_mujoco set the state field by field instead of through set_sim_state
+            self.model.forward()
+            self.current_com = self.model.data.com_subtree[0]
+            self.dcom = np.zeros_like(self.current_com)
         # print("outside mujoco reset: ", self.model.data.qpos, self.model.data.qvel, self.model.data.qacc, self.model.data.ctrl)
         return self.get_current_obs()
 
+    def full_sim_state(self, init_state):
+        """
+        Physics state (as returned by get_sim_state) starting with init_state, which can stop after any of qpos, qvel
+        or qacc: the fields it leaves out are taken from the initial state of the env
+        """
+        state = []
+        start = 0
+        for datum_name in self.model.data.STATE_FIELDS:
+            datum_dim = self.model.data.view(datum_name).shape[0]
+            datum = init_state[start: start + datum_dim]
+            if len(datum) == 0:
+                datum = getattr(self, 'init_' + datum_name)
+            state.append(np.ravel(datum))
+            start += datum_dim
+        return np.concatenate(state)
+
+    def get_sim_state(self):
+        """
+        Copy of the physics state (qpos, qvel, qacc and ctrl, concatenated), to be restored with set_sim_state
+        """
+        return self.model.data.get_state()
+
+    def set_sim_state(self, sim_state):
+        """
+        Restore a physics state returned by get_sim_state, as if the env had been reset to it (so dcom is 0).
+        The forward pass updating the derived quantities is deferred to the next observation, step or sync_sim, so
+        get_current_obs implementations that read those from model.data have to call sync_sim first.
+        """
+        self.model.data.set_state(sim_state)
+        self._sim_synced = False
+
+    def sync_sim(self):
+        """
+        Run the forward pass deferred by set_sim_state, if any
+        """
+        if not self._sim_synced:
+            self.model.forward()
+            self._sim_synced = True
+            self.current_com = self.model.data.com_subtree[0]
+            self.dcom = np.zeros_like(self.current_com)
+
     def get_current_obs(self):
         return self._get_full_obs()
 
     def _get_full_obs(self):
+        self.sync_sim()
         data = self.model.data
-        cdists = np.copy(self.model.geom_margin).flat
-        for c in self.model.data.contact:
-            cdists[c.geom2] = min(cdists[c.geom2], c.dist)
+        cdists = self.model.view('geom_margin').ravel().copy()
+        contacts = data.contacts()
+        np.minimum.at(cdists, contacts['geom2'], contacts['dist'])
         obs = np.concatenate([
-            data.qpos.flat,
-            data.qvel.flat,
+            data.view('qpos').flat,
+            data.view('qvel').flat,
             # data.cdof.flat,
-            data.cinert.flat,
-            data.cvel.flat,
+            data.view('cinert').flat,
+            data.view('cvel').flat,
             # data.cacc.flat,
-            data.qfrc_actuator.flat,
-            data.cfrc_ext.flat,
-            data.qfrc_constraint.flat,
+            data.view('qfrc_actuator').flat,
+            data.view('cfrc_ext').flat,
+            data.view('qfrc_constraint').flat,
             cdists,
             # data.qfrc_bias.flat,
             # data.qfrc_passive.flat,
@@ -185,12 +222,7 @@ class MujocoEnv(Env):
 
     @property
     def _full_state(self):
-        return np.concatenate([
-            self.model.data.qpos,
-            self.model.data.qvel,
-            self.model.data.qacc,
-            self.model.data.ctrl,
-        ]).ravel()
+        return self.model.data.get_state()
 
     def inject_action_noise(self, action):
         # generate action noise
@@ -202,6 +234,7 @@ class MujocoEnv(Env):
         return action + noise
 
     def forward_dynamics(self, action):
+        self.sync_sim()
         self.model.data.ctrl = self.inject_action_noise(action)
         for _ in range(self.frame_skip):
             self.model.step()
@@ -266,14 +299,17 @@ class MujocoEnv(Env):
         mjlib.mj_deleteData(self.data._wrapped)
 
     def get_body_xmat(self, body_name):
+        self.sync_sim()
         idx = self.model.body_names.index(body_name)
         return self.model.data.xmat[idx].reshape((3, 3))
 
     def get_body_com(self, body_name):
+        self.sync_sim()
         idx = self.model.body_names.index(body_name)
         return self.model.data.com_subtree[idx]
 
     def get_body_comvel(self, body_name):
+        self.sync_sim()
         idx = self.model.body_names.index(body_name)
         return self.model.body_comvels[idx]
 
@@ -307,3 +343,18 @@ class MujocoEnv(Env):
 
     def set_param_values(self, values):
         pass
+
+
+def get_sim_states(envs):
+    """
+    Physics states of several env copies, stacked (see MujocoEnv.get_sim_state)
+    """
+    return np.stack([env.get_sim_state() for env in envs])
+
+
+def set_sim_states(envs, sim_states):
+    """
+    Restore one physics state per env copy (see MujocoEnv.set_sim_state)
+    """
+    for env, sim_state in zip(envs, sim_states):
+        env.set_sim_state(sim_state)
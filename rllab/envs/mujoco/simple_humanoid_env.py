@@ -34,6 +34,7 @@ class SimpleHumanoidEnv(MujocoEnv, Serializable):
         Serializable.quick_init(self, locals())
 
     def get_current_obs(self):
+        self.sync_sim()
         data = self.model.data
         return np.concatenate([
             data.qpos.flat,
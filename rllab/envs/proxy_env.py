@@ -44,6 +44,15 @@ class ProxyEnv(Env, Serializable):
 
     def set_param_values(self, params):
         self._wrapped_env.set_param_values(params)
+
+    def get_sim_state(self):
+        return self._wrapped_env.get_sim_state()
+
+    def set_sim_state(self, sim_state):
+        self._wrapped_env.set_sim_state(sim_state)
+
+    def sync_sim(self):
+        self._wrapped_env.sync_sim()
         
     def __getattr__(self, name):
         """ Relay unknown attribute access to the wrapped_env. """
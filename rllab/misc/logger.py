@@ -3,6 +3,8 @@ from enum import Enum
 from rllab.misc.tabulate import tabulate
 from rllab.misc.console import mkdir_p, colorize
 from rllab.misc.autoargs import get_all_parameters
+from rllab.misc.metrics_store import MetricsStore, export_csv
+from rllab.misc import snapshot
 from contextlib import contextmanager
 import numpy as np
 import os
@@ -15,6 +17,7 @@ import joblib
 import json
 import pickle
 import base64
+import atexit
 
 _prefixes = []
 _prefix_str = ''
@@ -23,6 +26,7 @@ _tabular_prefixes = []
 _tabular_prefix_str = ''
 
 _tabular = []
+_tabular_values = []  # the values of _tabular before they are turned into str, for the metrics stores
 
 _text_outputs = []
 _tabular_outputs = []
@@ -31,10 +35,14 @@ _text_fds = {}
 _tabular_fds = {}  # key: file_name, value: open file
 _tabular_fds_hold = {}
 _tabular_header_written = set()
+_metrics_outputs = []
+_metrics_stores = {}  # key: store path, value: (MetricsStore, csv file to export it to when removed)
 
 _snapshot_dir = None
 _snapshot_mode = 'all'
 _snapshot_gap = 1
+_snapshot_dedup = False
+_snapshot_writer = None
 
 _log_tabular_only = False
 _header_printed = False
@@ -109,6 +117,26 @@ def remove_tabular_output(file_name):
     _remove_output(file_name, _tabular_outputs, _tabular_fds)
 
 
+def add_metrics_output(path, csv_file=None, mode='w'):
+    """
+    Also log the tabular data to an append-only metrics store (see rllab.misc.metrics_store), which does not need to
+    be rewritten when keys are added during the run.
+    :param csv_file: if given, the store is exported to that csv file when it is removed
+    """
+    if path not in _metrics_outputs:
+        _metrics_outputs.append(path)
+        _metrics_stores[path] = (MetricsStore(path, mode=mode), csv_file)
+
+
+def remove_metrics_output(path):
+    if path in _metrics_outputs:
+        _metrics_outputs.remove(path)
+        store, csv_file = _metrics_stores.pop(path)
+        store.close()
+        if csv_file is not None:
+            export_csv(path, csv_file)
+
+
 def hold_tabular_output(file_name):
     # what about _tabular_header_written?
     if file_name in _tabular_outputs:
@@ -162,6 +190,29 @@ def set_snapshot_gap(gap):
     _snapshot_gap = gap
 
 
+def get_snapshot_dedup():
+    return _snapshot_dedup
+
+
+def set_snapshot_dedup(dedup):
+    """
+    Whether save_itr_params writes deduplicated snapshots (see rllab.misc.snapshot), which store the Serializable
+    objects that did not change only once, and their parameter values at every iteration
+    """
+    global _snapshot_dedup
+    _snapshot_dedup = dedup
+
+
+def set_snapshot_max_pending(max_pending):
+    """
+    Write the snapshots on a background thread, with at most max_pending of them waiting to be written. 0 writes them
+    in save_itr_params.
+    """
+    global _snapshot_writer
+    wait_for_snapshots()
+    _snapshot_writer = snapshot.SnapshotWriter(max_pending) if max_pending > 0 else None
+
+
 def set_log_tabular_only(log_tabular_only):
     global _log_tabular_only
     _log_tabular_only = log_tabular_only
@@ -201,6 +252,7 @@ def log(s, with_prefix=True, with_timestamp=True, color=None):
 def record_tabular(key, val, *args, **kwargs):
     # if not _disabled and not _tabular_disabled:
     _tabular.append((_tabular_prefix_str + str(key), str(val)))
+    _tabular_values.append((_tabular_prefix_str + str(key), val))
 
 
 def push_tabular_prefix(key):
@@ -307,7 +359,11 @@ def dump_tabular(*args, **kwargs):
                             tabular_dict[key] = np.nan
                     writer.writerow(tabular_dict)
                     tabular_fd.flush()
+                for store, _ in _metrics_stores.values():
+                    store.append(_tabular_values)
+                    store.flush()
             del _tabular[:]
+            del _tabular_values[:]
 
 
 def pop_prefix():
@@ -332,12 +388,28 @@ def save_itr_params(itr, params, use_cloudpickle=True, pkl_prefix=''):
             return
         else:
             raise NotImplementedError
-        if use_cloudpickle:
+        if _snapshot_dedup:
+            data = snapshot.dumps(params, use_cloudpickle=use_cloudpickle)
+        elif use_cloudpickle:
             import cloudpickle
-            with open(file_name, 'wb') as f:
-                cloudpickle.dump(params, f, protocol=3)
+            data = snapshot.Snapshot(cloudpickle.dumps(params, protocol=3), dict())
         else:
             joblib.dump(params, file_name, compress=3)
+            return
+        # params are pickled right away, so that they can change while the snapshot is being written
+        if _snapshot_writer is not None:
+            _snapshot_writer.submit(file_name, data)
+        else:
+            snapshot.write(file_name, data)
+
+
+def wait_for_snapshots():
+    """ Block until the snapshots written in the background are on disk """
+    if _snapshot_writer is not None:
+        _snapshot_writer.wait()
+
+
+atexit.register(wait_for_snapshots)
 
 
 def log_parameters(log_file, args, classes):
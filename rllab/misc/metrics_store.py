@@ -0,0 +1,222 @@
+"""
+Append-only columnar store for the tabular logs.
+
+A store is a directory holding one file per column and a schema file listing the columns in the order they appeared:
+- numeric values are appended as little-endian float64 to `<column id>.f8`, with NaN for missing values
+- any other value is appended as one json line to `<column id>.jsonl`, with null for missing values
+- `schema.jsonl` has one json line per column: name, dtype, file, and first_row, the row at which the column appeared
+
+A column that appears mid-run only starts at its first row, so new keys never rewrite what has been logged before.
+Rows are buffered and written in chunks, one write per column, by flush.
+"""
+from collections import OrderedDict
+import csv
+import json
+import os
+import os.path as osp
+
+import numpy as np
+
+from rllab.misc.console import mkdir_p
+
+SCHEMA_FILE = 'schema.jsonl'
+STORE_EXTENSION = '.metrics'
+
+_FLOAT = 'float64'
+_STR = 'str'
+_FLOAT_DTYPE = np.dtype('<f8')
+
+
+def store_path(csv_path):
+    """ Path of the store kept next to a tabular csv file, e.g. progress.metrics for progress.csv """
+    return osp.splitext(csv_path)[0] + STORE_EXTENSION
+
+
+def is_store(path):
+    return osp.isfile(osp.join(path, SCHEMA_FILE))
+
+
+def _is_numeric(val):
+    if isinstance(val, np.ndarray):
+        return val.ndim == 0 and (np.issubdtype(val.dtype, np.number) or val.dtype == np.bool_)
+    return isinstance(val, (bool, int, float, np.number, np.bool_))
+
+
+def _to_float(val):
+    try:
+        return float(val)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _read_schema(path):
+    columns = []
+    with open(osp.join(path, SCHEMA_FILE), 'r') as f:
+        for line in f:
+            # a torn last line is a column that was never written to
+            try:
+                columns.append(json.loads(line))
+            except ValueError:
+                break
+    return columns
+
+
+def _column_length(path, column):
+    file_name = osp.join(path, column['file'])
+    if not osp.exists(file_name):
+        return 0
+    if column['dtype'] == _FLOAT:
+        return osp.getsize(file_name) // _FLOAT_DTYPE.itemsize
+    with open(file_name, 'rb') as f:
+        return sum(1 for line in f if line.endswith(b'\n'))
+
+
+class MetricsStore(object):
+    def __init__(self, path, mode='w'):
+        """
+        :param path: directory of the store
+        :param mode: 'w' to start a new store, discarding the one at path if any, or 'a' to append to it
+        """
+        self.path = path
+        self._columns = OrderedDict()  # name -> schema entry
+        self._fds = dict()
+        self._pending = []
+        self._n_rows = 0
+        mkdir_p(path)
+        if mode == 'a' and is_store(path):
+            self._resume()
+        elif mode in ('w', 'a'):
+            for file_name in os.listdir(path):
+                if file_name == SCHEMA_FILE or osp.splitext(file_name)[1] in ('.f8', '.jsonl'):
+                    os.remove(osp.join(path, file_name))
+            open(osp.join(path, SCHEMA_FILE), 'w').close()
+        else:
+            raise ValueError("Unknown mode: %s" % mode)
+        self._schema_fd = open(osp.join(path, SCHEMA_FILE), 'a')
+
+    def _resume(self):
+        columns = _read_schema(self.path)
+        # only keep the rows that made it to all the columns, in case the last flush was interrupted
+        self._n_rows = min([c['first_row'] + _column_length(self.path, c) for c in columns] or [0])
+        with open(osp.join(self.path, SCHEMA_FILE), 'w') as f:
+            for column in columns:
+                if column['first_row'] <= self._n_rows:
+                    f.write(json.dumps(column) + '\n')
+                    self._columns[column['name']] = column
+        for column in self._columns.values():
+            n = self._n_rows - column['first_row']
+            file_name = osp.join(self.path, column['file'])
+            if column['dtype'] == _FLOAT:
+                with open(file_name, 'ab') as f:
+                    f.truncate(n * _FLOAT_DTYPE.itemsize)
+            else:
+                with open(file_name, 'rb') as f:
+                    lines = [f.readline() for _ in range(n)]
+                with open(file_name, 'wb') as f:
+                    f.writelines(lines)
+
+    @property
+    def n_rows(self):
+        return self._n_rows + len(self._pending)
+
+    @property
+    def keys(self):
+        return list(self._columns.keys())
+
+    def _add_column(self, name, val):
+        dtype = _FLOAT if _is_numeric(val) else _STR
+        column = dict(
+            name=name,
+            dtype=dtype,
+            file='%04d%s' % (len(self._columns), '.f8' if dtype == _FLOAT else '.jsonl'),
+            first_row=self.n_rows,
+        )
+        self._schema_fd.write(json.dumps(column) + '\n')
+        self._schema_fd.flush()
+        self._columns[name] = column
+
+    def append(self, row):
+        """
+        Append a row of values. Keys that were never seen add a column to the store; the columns that are not in
+        the row get a missing value.
+        :param row: dict (or list of pairs) from key to value
+        """
+        row = OrderedDict(row)
+        for key, val in row.items():
+            if key not in self._columns:
+                self._add_column(key, val)
+        self._pending.append(row)
+
+    def flush(self):
+        if not self._pending:
+            return
+        for name, column in self._columns.items():
+            start = max(column['first_row'] - self._n_rows, 0)
+            values = [row.get(name) for row in self._pending[start:]]
+            if name not in self._fds:
+                self._fds[name] = open(osp.join(self.path, column['file']), 'ab')
+            fd = self._fds[name]
+            if column['dtype'] == _FLOAT:
+                fd.write(np.asarray([_to_float(v) for v in values], dtype=_FLOAT_DTYPE).tobytes())
+            else:
+                fd.write(b''.join(
+                    (json.dumps(None if v is None else str(v)) + '\n').encode('utf-8') for v in values))
+            fd.flush()
+        self._n_rows += len(self._pending)
+        self._pending = []
+
+    def close(self):
+        self.flush()
+        for fd in self._fds.values():
+            fd.close()
+        self._fds = dict()
+        self._schema_fd.close()
+
+
+def read_metrics(path, keys=None):
+    """
+    Read a store as whole columns.
+    :param keys: names of the columns to read, all of them by default
+    :return: OrderedDict from column name to array with one value per row: float64 for numeric columns, with NaN
+    before the column appeared, and object arrays of str (or None) otherwise
+    """
+    columns = _read_schema(path)
+    n_rows = min([c['first_row'] + _column_length(path, c) for c in columns] or [0])
+    if keys is not None:
+        keys = set(keys)
+        columns = [c for c in columns if c['name'] in keys]
+    data = OrderedDict()
+    for column in columns:
+        first_row = min(column['first_row'], n_rows)
+        file_name = osp.join(path, column['file'])
+        if column['dtype'] == _FLOAT:
+            values = np.full(n_rows, np.nan)
+            if osp.exists(file_name):
+                values[first_row:] = np.fromfile(file_name, dtype=_FLOAT_DTYPE, count=n_rows - first_row)
+        else:
+            values = np.empty(n_rows, dtype=object)
+            if osp.exists(file_name):
+                with open(file_name, 'r') as f:
+                    for i in range(first_row, n_rows):
+                        values[i] = json.loads(f.readline())
+        data[column['name']] = values
+    return data
+
+
+def _format_csv_value(val):
+    if val is None:
+        return 'nan'
+    if isinstance(val, float) and val.is_integer() and abs(val) < 2 ** 53:
+        return '%d' % val
+    return repr(val) if isinstance(val, float) else val
+
+
+def export_csv(path, csv_path):
+    """ Write a store as a csv file like the ones of add_tabular_output: one column per key, nan when missing """
+    data = read_metrics(path)
+    with open(csv_path, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(list(data.keys()))
+        columns = [values.tolist() for values in data.values()]
+        for row in zip(*columns):
+            writer.writerow([_format_csv_value(v) for v in row])
@@ -0,0 +1,248 @@
+"""
+Snapshots of the training iterations that store what does not change between iterations only once.
+
+In a deduplicated snapshot, every Serializable object (env, policy, baseline, optimizer...) is pickled on its own, as
+its class and the state given by __getstate__ without its parameter values, and stored once in the objects directory
+next to the snapshot, under the sha1 of that pickle. The snapshot file itself only holds the rest of the params dict,
+with references to those objects, the flat parameter values of each of them, and the list of the objects it refers to.
+When a snapshot file is replaced (as with snapshot_mode='last'), the objects that no snapshot file of the directory
+refers to anymore are removed.
+
+load_snapshot reassembles the full params dict, and also loads the snapshots written by joblib or cloudpickle.
+"""
+from collections import namedtuple
+import hashlib
+import io
+import os
+import os.path as osp
+import pickle
+import queue
+import threading
+
+import joblib
+import numpy as np
+
+from rllab.core.serializable import Serializable
+
+MAGIC = b"RLLAB-SNAPSHOT-2\n"
+# the first version did not list the objects it refers to
+_MAGIC_V1 = b"RLLAB-SNAPSHOT-1\n"
+OBJECTS_DIR = "objects"
+
+# data: content of the snapshot file, blobs: sha1 -> pickle of the objects it refers to
+Snapshot = namedtuple("Snapshot", ["data", "blobs"])
+
+
+class _CyclicReference(Exception):
+    pass
+
+
+class _Dumper(object):
+    def __init__(self, use_cloudpickle):
+        if use_cloudpickle:
+            import cloudpickle
+            self._pickler_class = cloudpickle.CloudPickler
+        else:
+            self._pickler_class = pickle.Pickler
+        self._refs = dict()  # id -> reference, None while the object is being pickled
+        self._objects = []  # keeps the objects alive, so that their ids are not reused
+        self.param_values = []
+        self.blobs = dict()
+
+    def dumps(self, obj):
+        buf = io.BytesIO()
+        dumper = self
+
+        class _Pickler(self._pickler_class):
+            def persistent_id(self, obj):
+                if isinstance(obj, Serializable):
+                    return dumper.reference(obj)
+                return None
+
+        _Pickler(buf, protocol=pickle.HIGHEST_PROTOCOL).dump(obj)
+        return buf.getvalue()
+
+    def reference(self, obj):
+        key = id(obj)
+        if key in self._refs:
+            if self._refs[key] is None:
+                raise _CyclicReference()
+            return self._refs[key]
+        slot = len(self.param_values)
+        self._refs[key] = None
+        self._objects.append(obj)
+        self.param_values.append(None)
+        state = obj.__getstate__()
+        if isinstance(state, dict) and isinstance(state.get("params"), np.ndarray):
+            state = dict(state)
+            self.param_values[slot] = state.pop("params")
+        blob = self.dumps((type(obj), state))
+        sha1 = hashlib.sha1(blob).hexdigest()
+        self.blobs[sha1] = blob
+        self._refs[key] = ("serializable", slot, sha1)
+        return self._refs[key]
+
+
+def dumps(params, use_cloudpickle=True):
+    """
+    Pickle params as a deduplicated snapshot. If its Serializable objects refer to each other in a cycle, which cannot
+    be split, it falls back to a plain pickle of params.
+    :return: Snapshot
+    """
+    dumper = _Dumper(use_cloudpickle)
+    try:
+        data = dumper.dumps(params)
+    except _CyclicReference:
+        if use_cloudpickle:
+            import cloudpickle
+            return Snapshot(cloudpickle.dumps(params, protocol=3), dict())
+        return Snapshot(pickle.dumps(params, protocol=3), dict())
+    header = pickle.dumps(sorted(dumper.blobs), protocol=pickle.HIGHEST_PROTOCOL) \
+        + pickle.dumps(dumper.param_values, protocol=pickle.HIGHEST_PROTOCOL)
+    return Snapshot(MAGIC + header + data, dumper.blobs)
+
+
+def _write_file(file_name, data):
+    # write next to the file and rename, so that readers never see a partially written file
+    tmp_file_name = "%s.%d.%d.tmp" % (file_name, os.getpid(), threading.get_ident())
+    with open(tmp_file_name, "wb") as f:
+        f.write(data)
+    os.replace(tmp_file_name, file_name)
+
+
+def _blob_refs(file_name):
+    """
+    sha1 of the objects the snapshot file refers to (none for a plain pickle), or None if the snapshot does not list
+    them
+    """
+    try:
+        with open(file_name, "rb") as f:
+            magic = f.read(len(MAGIC))
+            if magic == _MAGIC_V1:
+                return None
+            if magic != MAGIC:
+                return set()
+            return set(pickle.load(f))
+    except (IOError, pickle.UnpicklingError, EOFError):
+        return set()
+
+
+def _remove_unreferenced_blobs(snapshot_dir, sha1s):
+    """ Remove the objects among sha1s that no snapshot file of snapshot_dir refers to """
+    sha1s = set(sha1s)
+    for file_name in os.listdir(snapshot_dir):
+        path = osp.join(snapshot_dir, file_name)
+        if not file_name.endswith(".pkl") or not osp.isfile(path):
+            continue
+        refs = _blob_refs(path)
+        if refs is None:
+            # cannot tell what that snapshot needs
+            return
+        sha1s -= refs
+    for sha1 in sha1s:
+        try:
+            os.remove(osp.join(snapshot_dir, OBJECTS_DIR, sha1 + ".pkl"))
+        except OSError:
+            pass
+
+
+def write(file_name, snapshot):
+    """
+    Write a Snapshot to file_name, and the objects it refers to that are not stored yet. If it replaces a snapshot,
+    the objects that were only referred to by the replaced one are removed.
+    """
+    old_refs = _blob_refs(file_name) if osp.exists(file_name) else set()
+    objects_dir = osp.join(osp.dirname(file_name), OBJECTS_DIR)
+    if snapshot.blobs:
+        os.makedirs(objects_dir, exist_ok=True)
+        for sha1, blob in snapshot.blobs.items():
+            blob_file_name = osp.join(objects_dir, sha1 + ".pkl")
+            if not osp.exists(blob_file_name):
+                _write_file(blob_file_name, blob)
+    _write_file(file_name, snapshot.data)
+    unreferenced = (old_refs or set()) - set(snapshot.blobs)
+    if unreferenced:
+        _remove_unreferenced_blobs(osp.dirname(file_name) or ".", unreferenced)
+
+
+class _Loader(object):
+    def __init__(self, objects_dir, param_values):
+        self._objects_dir = objects_dir
+        self._param_values = param_values
+        self._objects = dict()  # slot -> object
+
+    def load(self, f):
+        loader = self
+
+        class _Unpickler(pickle.Unpickler):
+            def persistent_load(self, pid):
+                return loader.persistent_load(pid)
+
+        return _Unpickler(f).load()
+
+    def persistent_load(self, pid):
+        kind, slot, sha1 = pid
+        if kind != "serializable":
+            raise pickle.UnpicklingError("Unknown reference: %s" % (pid,))
+        if slot not in self._objects:
+            with open(osp.join(self._objects_dir, sha1 + ".pkl"), "rb") as f:
+                cls, state = self.load(f)
+            if self._param_values[slot] is not None:
+                state = dict(state, params=self._param_values[slot])
+            obj = cls.__new__(cls)
+            obj.__setstate__(state)
+            self._objects[slot] = obj
+        return self._objects[slot]
+
+
+def load_snapshot(file_name):
+    """ Load a snapshot written by logger.save_itr_params, deduplicated or not """
+    with open(file_name, "rb") as f:
+        magic = f.read(len(MAGIC))
+        if magic not in (MAGIC, _MAGIC_V1):
+            f.close()
+            return joblib.load(file_name)
+        if magic == MAGIC:
+            pickle.load(f)  # the sha1 of the objects
+        param_values = pickle.load(f)
+        return _Loader(osp.join(osp.dirname(file_name), OBJECTS_DIR), param_values).load(f)
+
+
+class SnapshotWriter(object):
+    """
+    Writes snapshots on a background thread. At most max_pending snapshots wait to be written: submit blocks
+    until there is room for one more.
+    """
+
+    def __init__(self, max_pending=2):
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self._error = None
+
+    def submit(self, file_name, snapshot):
+        self._raise_error()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+        self._queue.put((file_name, snapshot))
+
+    def _run(self):
+        while True:
+            file_name, snapshot = self._queue.get()
+            try:
+                write(file_name, snapshot)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def wait(self):
+        """ Block until all the submitted snapshots are written """
+        self._queue.join()
+        self._raise_error()
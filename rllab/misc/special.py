@@ -111,6 +111,30 @@ def discount_cumsum(x, discount):
     return scipy.signal.lfilter([1], [1, float(-discount)], x[::-1], axis=0)[::-1]
 
 
+def discount_cumsum_segments(x, discount, lengths):
+    """
+    discount_cumsum of each of the consecutive segments of x with the given lengths, without splitting x.
+    The segments are scanned together backwards from their ends, one timestep per step, which yields the same values
+    as calling discount_cumsum on every segment.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    lengths = np.asarray(lengths, dtype=int)
+    y = np.empty_like(x)
+    # longest segments first, so that the segments still running at step k are a prefix
+    order = np.argsort(-lengths, kind='mergesort')
+    sorted_lengths = lengths[order]
+    ends = np.cumsum(lengths)[order] - 1
+    max_length = sorted_lengths[0] if len(lengths) else 0
+    n_live = np.searchsorted(-sorted_lengths, -np.arange(max_length), side='left')
+    acc = np.zeros((len(lengths),) + x.shape[1:])
+    discount = float(discount)
+    for k, n in enumerate(n_live):
+        idx = ends[:n] - k
+        acc = x[idx] + discount * acc[:n]
+        y[idx] = acc
+    return y
+
+
 def discount_return(x, discount):
     return np.sum(x * (discount ** np.arange(len(x))))
 
@@ -20,13 +20,53 @@ def register_license(file_path):
     return result
 
 
+def _array_view(ptr, dtype, shape):
+    """
+    numpy array of the given dtype and shape aliasing the memory ptr points to, without copying it
+    """
+    dtype = np.dtype(dtype)
+    count = int(np.prod(shape))
+    if count == 0:
+        return np.zeros(shape, dtype=dtype)
+    buf = (ctypes.c_char * (count * dtype.itemsize)).from_address(ctypes.addressof(ptr.contents))
+    return np.frombuffer(buf, dtype=dtype).reshape(shape)
+
+
+class _ArrayViews(object):
+    """
+    Persistent numpy views over the double buffers of a wrapped mjModel or mjData. Unlike the generated properties,
+    which copy the buffer at every read, a view is created once and then follows the simulation. Writing to a view
+    writes to MuJoCo directly. The views are only valid as long as the model (or data) they come from.
+    """
+
+    def view(self, name):
+        views = self.__dict__.setdefault('_views', {})
+        if name not in views:
+            field_types = dict(type(self._wrapped.contents)._fields_)
+            if field_types.get(name) is not POINTER(c_double):
+                raise ValueError('%s is not a double buffer of %s' % (name, type(self._wrapped.contents).__name__))
+            # the generated property knows the shape of the buffer
+            shape = getattr(self, name).shape
+            views[name] = _array_view(getattr(self._wrapped.contents, name), np.float64, shape)
+        return views[name]
+
+
+# fields of an mjContact read by MjData.contacts
+_CONTACT_DTYPE = np.dtype(dict(
+    names=['dist', 'geom1', 'geom2'],
+    formats=[np.float64, np.intc, np.intc],
+    offsets=[MJCONTACT.dist.offset, MJCONTACT.geom1.offset, MJCONTACT.geom2.offset],
+    itemsize=sizeof(MJCONTACT),
+))
+
+
 class dict2(dict):
     def __init__(self, **kwargs):
         dict.__init__(self, kwargs)
         self.__dict__ = self
 
 
-class MjModel(MjModelWrapper):
+class MjModel(MjModelWrapper, _ArrayViews):
 
     def __init__(self, xml_path=None, xml_string=None):
         assert xml_path is not None or xml_string is not None, "Must provide either xml_path or xml_string"
@@ -144,7 +184,9 @@ class MjModel(MjModelWrapper):
                 for inc in self.name_numericadr.flatten()]
 
 
-class MjData(MjDataWrapper):
+class MjData(MjDataWrapper, _ArrayViews):
+    # the simulation state handled by get_state and set_state, in that order
+    STATE_FIELDS = ("qpos", "qvel", "qacc", "ctrl")
 
     def __init__(self, wrapped, size_src=None):
         super(MjData, self).__init__(wrapped, size_src)
@@ -159,3 +201,29 @@ class MjData(MjDataWrapper):
     def contact(self):
         contacts = self._wrapped.contents.contact[:self.ncon]
         return [MjContactWrapper(pointer(c)) for c in contacts]
+
+    def contacts(self):
+        """
+        Structured array (fields dist, geom1 and geom2) aliasing the current contacts
+        """
+        return _array_view(self._wrapped.contents.contact, _CONTACT_DTYPE, (self.ncon,))
+
+    def get_state(self):
+        """
+        qpos, qvel, qacc and ctrl, flattened and concatenated
+        """
+        return np.concatenate([self.view(name).ravel() for name in self.STATE_FIELDS])
+
+    def set_state(self, state):
+        """
+        Set qpos, qvel, qacc and ctrl at once from the concatenation returned by get_state. The derived quantities are
+        only updated by the next forward of the model.
+        """
+        state = np.asarray(state, dtype=np.float64).ravel()
+        start = 0
+        for name in self.STATE_FIELDS:
+            datum = self.view(name)
+            datum.flat[:] = state[start:start + datum.size]
+            start += datum.size
+        if start != len(state):
+            raise ValueError('Expected a state of size %d, got %d' % (start, len(state)))
@@ -16,8 +16,49 @@ from rllab.misc.overrides import overrides
 from rllab.misc import logger
 from rllab.misc import ext
 from rllab.distributions.diagonal_gaussian import DiagonalGaussian
+import theano
 import theano.tensor as TT
 
+# numpy versions of the nonlinearities the numpy forward pass supports (None stands for the identity)
+_NUMPY_NONLINEARITIES = {
+    NL.identity: None,
+    NL.linear: None,
+    NL.tanh: np.tanh,
+    NL.rectify: lambda x: np.maximum(x, 0.),
+    NL.sigmoid: lambda x: 1. / (1. + np.exp(-x)),
+}
+
+
+def _log_min_std(min_std):
+    # a floatX constant, so that clipping the log std keeps it in floatX instead of upcasting it to float64
+    return np.cast[theano.config.floatX](np.log(min_std))
+
+
+def _dense_chain(output_layer, input_layer):
+    """
+    The DenseLayers going from input_layer to output_layer, or None if the network is anything else than such a chain
+    with supported nonlinearities.
+    """
+    layers = []
+    layer = output_layer
+    while layer is not input_layer:
+        if not isinstance(layer, L.DenseLayer) or layer.nonlinearity not in _NUMPY_NONLINEARITIES:
+            return None
+        layers.append(layer)
+        layer = layer.input_layer
+    return layers[::-1]
+
+
+def _dense_forward(layers, x):
+    for layer in layers:
+        x = x.dot(layer.W.get_value(borrow=True))
+        if layer.b is not None:
+            x = x + layer.b.get_value(borrow=True)
+        nonlinearity = _NUMPY_NONLINEARITIES[layer.nonlinearity]
+        if nonlinearity is not None:
+            x = nonlinearity(x)
+    return x
+
 
 class GaussianMLPPolicy(StochasticPolicy, LasagnePowered, Serializable):
     def __init__(
@@ -103,7 +144,7 @@ class GaussianMLPPolicy(StochasticPolicy, LasagnePowered, Serializable):
         mean_var, log_std_var = L.get_output([l_mean, l_log_std])
 
         if self.min_std is not None:
-            log_std_var = TT.maximum(log_std_var, np.log(min_std))
+            log_std_var = TT.maximum(log_std_var, _log_min_std(min_std))
 
         self._mean_var, self._log_std_var = mean_var, log_std_var
 
@@ -120,16 +161,41 @@ class GaussianMLPPolicy(StochasticPolicy, LasagnePowered, Serializable):
             outputs=[mean_var, log_std_var],
         )
 
+        # Plain MLPs are also evaluated with numpy when sampling actions, which is much cheaper than calling _f_dist
+        # for a few observations. The weights are read through the borrowed values of the shared variables at every
+        # call, so they are always the current ones (after set_param_values as well as after in-place updates).
+        self._np_mean_layers = _dense_chain(l_mean, mean_network.input_layer)
+        if isinstance(l_log_std, ParamLayer) and l_log_std.input_layer is mean_network.input_layer:
+            self._np_log_std_layers = l_log_std
+        else:
+            self._np_log_std_layers = _dense_chain(l_log_std, mean_network.input_layer)
+        self._use_numpy_forward = self._np_mean_layers is not None and self._np_log_std_layers is not None
+
+    def _dist_info_n(self, flat_obs):
+        """ Means and log stds for a batch of flat observations, like _f_dist """
+        if not self._use_numpy_forward:
+            return self._f_dist(flat_obs)
+        dtype = self._np_mean_layers[-1].W.get_value(borrow=True).dtype
+        flat_obs = np.asarray(flat_obs, dtype=dtype)
+        means = _dense_forward(self._np_mean_layers, flat_obs)
+        if isinstance(self._np_log_std_layers, ParamLayer):
+            log_stds = np.tile(self._np_log_std_layers.param.get_value(borrow=True), (len(flat_obs), 1))
+        else:
+            log_stds = _dense_forward(self._np_log_std_layers, flat_obs)
+        if self.min_std is not None:
+            log_stds = np.maximum(log_stds, _log_min_std(self.min_std))
+        return means, log_stds
+
     def dist_info_sym(self, obs_var, state_info_vars=None):
         mean_var, log_std_var = L.get_output([self._l_mean, self._l_log_std], obs_var)
         if self.min_std is not None:
-            log_std_var = TT.maximum(log_std_var, np.log(self.min_std))
+            log_std_var = TT.maximum(log_std_var, _log_min_std(self.min_std))
         return dict(mean=mean_var, log_std=log_std_var)
 
     @overrides
     def get_action(self, observation):
         flat_obs = self.observation_space.flatten(observation)
-        mean, log_std = [x[0] for x in self._f_dist([flat_obs])]
+        mean, log_std = [x[0] for x in self._dist_info_n([flat_obs])]
         if self._set_std_to_0:
             action = mean
             log_std = -1e6 * np.ones_like(log_std)
@@ -140,7 +206,7 @@ class GaussianMLPPolicy(StochasticPolicy, LasagnePowered, Serializable):
 
     def get_actions(self, observations):
         flat_obs = self.observation_space.flatten_n(observations)
-        means, log_stds = self._f_dist(flat_obs)
+        means, log_stds = self._dist_info_n(flat_obs)
         if self._set_std_to_0:
             actions = means
             log_stds = -1e6 * np.ones_like(log_stds)
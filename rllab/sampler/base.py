@@ -46,36 +46,34 @@ class BaseSampler(Sampler):
         self.algo = algo
 
     def process_samples(self, itr, paths):
-        baselines = []
-        returns = []
-
         if hasattr(self.algo.baseline, "predict_n"):
             all_path_baselines = self.algo.baseline.predict_n(paths)
         else:
             all_path_baselines = [self.algo.baseline.predict(path) for path in paths]
 
-        for idx, path in enumerate(paths):
-            path_baselines = np.append(all_path_baselines[idx], 0)
-            deltas = path["rewards"] + \
-                     self.algo.discount * path_baselines[1:] - \
-                     path_baselines[:-1]
-            path["advantages"] = special.discount_cumsum(
-                deltas, self.algo.discount * self.algo.gae_lambda)
-            path["returns"] = special.discount_cumsum(path["rewards"], self.algo.discount)
-            baselines.append(path_baselines[:-1])
-            returns.append(path["returns"])
-
-        ev = special.explained_variance_1d(
-            np.concatenate(baselines),
-            np.concatenate(returns)
-        )
+        # Work on the whole batch at once: paths are the segments [starts[i], ends[i]) of the concatenated arrays
+        path_lengths = np.asarray([len(path["rewards"]) for path in paths], dtype=int)
+        ends = np.cumsum(path_lengths)
+        starts = ends - path_lengths
+        rewards = tensor_utils.concat_tensor_list([path["rewards"] for path in paths])
+        # the empty int array promotes the baselines like the np.append(path_baselines, 0) this replaces
+        baselines = np.concatenate([np.ravel(b) for b in all_path_baselines] + [np.zeros(0, dtype=int)])
+        next_baselines = np.zeros_like(baselines)
+        next_baselines[:-1] = baselines[1:]
+        next_baselines[ends[path_lengths > 0] - 1] = 0
+        deltas = rewards + self.algo.discount * next_baselines - baselines
+        advantages = special.discount_cumsum_segments(
+            deltas, self.algo.discount * self.algo.gae_lambda, path_lengths)
+        returns = special.discount_cumsum_segments(rewards, self.algo.discount, path_lengths)
+        for path, start, end in zip(paths, starts, ends):
+            path["advantages"] = advantages[start:end]
+            path["returns"] = returns[start:end]
+
+        ev = special.explained_variance_1d(baselines, returns)
 
         if not self.algo.policy.recurrent:
             observations = tensor_utils.concat_tensor_list([path["observations"] for path in paths])
             actions = tensor_utils.concat_tensor_list([path["actions"] for path in paths])
-            rewards = tensor_utils.concat_tensor_list([path["rewards"] for path in paths])
-            returns = tensor_utils.concat_tensor_list([path["returns"] for path in paths])
-            advantages = tensor_utils.concat_tensor_list([path["advantages"] for path in paths])
             env_infos = tensor_utils.concat_tensor_dict_list([path["env_infos"] for path in paths])
             agent_infos = tensor_utils.concat_tensor_dict_list([path["agent_infos"] for path in paths])
 
@@ -85,8 +83,7 @@ class BaseSampler(Sampler):
             if self.algo.positive_adv:
                 advantages = util.shift_advantages_to_positive(advantages)
 
-            average_discounted_return = \
-                np.mean([path["returns"][0] for path in paths])
+            average_discounted_return = np.mean(returns[starts])
 
             undiscounted_returns = [sum(path["rewards"]) for path in paths]
 
@@ -103,30 +100,32 @@ class BaseSampler(Sampler):
                 paths=paths,
             )
         else:
-            max_path_length = max([len(path["advantages"]) for path in paths])
+            max_path_length = max(path_lengths)
+            # (row, column) of every timestep of the batch in the padded arrays
+            pad_idx = (np.repeat(np.arange(len(paths)), path_lengths),
+                       np.arange(len(rewards)) - np.repeat(starts, path_lengths))
+
+            def pad(x):
+                padded = np.zeros((len(paths), max_path_length) + x.shape[1:], dtype=x.dtype)
+                padded[pad_idx] = x
+                return padded
 
             # make all paths the same length (pad extra advantages with 0)
             obs = [path["observations"] for path in paths]
             obs = tensor_utils.pad_tensor_n(obs, max_path_length)
 
             if self.algo.center_adv:
-                raw_adv = np.concatenate([path["advantages"] for path in paths])
-                adv_mean = np.mean(raw_adv)
-                adv_std = np.std(raw_adv) + 1e-8
-                adv = [(path["advantages"] - adv_mean) / adv_std for path in paths]
+                adv_mean = np.mean(advantages)
+                adv_std = np.std(advantages) + 1e-8
+                adv = pad((advantages - adv_mean) / adv_std)
             else:
-                adv = [path["advantages"] for path in paths]
-
-            adv = np.asarray([tensor_utils.pad_tensor(a, max_path_length) for a in adv])
+                adv = pad(advantages)
 
             actions = [path["actions"] for path in paths]
             actions = tensor_utils.pad_tensor_n(actions, max_path_length)
 
-            rewards = [path["rewards"] for path in paths]
-            rewards = tensor_utils.pad_tensor_n(rewards, max_path_length)
-
-            returns = [path["returns"] for path in paths]
-            returns = tensor_utils.pad_tensor_n(returns, max_path_length)
+            padded_returns = pad(returns)
+            rewards = pad(rewards)
 
             agent_infos = [path["agent_infos"] for path in paths]
             agent_infos = tensor_utils.stack_tensor_dict_list(
@@ -138,11 +137,9 @@ class BaseSampler(Sampler):
                 [tensor_utils.pad_tensor_dict(p, max_path_length) for p in env_infos]
             )
 
-            valids = [np.ones_like(path["returns"]) for path in paths]
-            valids = tensor_utils.pad_tensor_n(valids, max_path_length)
+            valids = pad(np.ones_like(returns))
 
-            average_discounted_return = \
-                np.mean([path["returns"][0] for path in paths])
+            average_discounted_return = np.mean(returns[starts])
 
             undiscounted_returns = [sum(path["rewards"]) for path in paths]
 
@@ -153,7 +150,7 @@ class BaseSampler(Sampler):
                 actions=actions,
                 advantages=adv,
                 rewards=rewards,
-                returns=returns,
+                returns=padded_returns,
                 valids=valids,
                 agent_infos=agent_infos,
                 env_infos=env_infos,
@@ -1,14 +1,71 @@
-from rllab.sampler.utils import rollout
-from rllab.sampler.stateful_pool import singleton_pool, SharedGlobal
+from rllab.sampler.utils import rollout, vectorized_rollout, has_batch_rollout
+from rllab.sampler.stateful_pool import singleton_pool, SharedGlobal, _SHM_DIR
 from rllab.misc import ext
 from rllab.misc import logger
 from rllab.misc import tensor_utils
 # import pickle
+import atexit
 import cloudpickle as pickle
 import numpy as np
+import os
+import tempfile
 import tensorflow as tf
 
 
+class SharedParams(object):
+    """
+    Flat parameter vector published by the master through a memory-mapped file in /dev/shm. A version counter, odd
+    while a write is in progress, lets the workers detect new parameters and copy them without any barrier.
+    """
+
+    def __init__(self, size, file_name=None):
+        self.size = size
+        self.owner = file_name is None
+        if self.owner:
+            fd, file_name = tempfile.mkstemp(prefix='rllab_params_', dir=_SHM_DIR)
+            os.close(fd)
+        self.file_name = file_name
+        mode = 'w+' if self.owner else 'r'
+        self._version = np.memmap(file_name, dtype=np.int64, mode=mode, shape=(1,))
+        self._data = np.memmap(file_name, dtype=np.float64, mode=mode, offset=8, shape=(size,))
+
+    @property
+    def version(self):
+        return int(self._version[0])
+
+    def publish(self, values):
+        version = self.version
+        self._version[0] = version + 1
+        self._data[:] = values
+        self._version[0] = version + 2
+
+    def read(self, last_version):
+        """
+        :return: a copy of the parameters and their version, or None instead of the parameters if the version is
+        still last_version
+        """
+        while True:
+            version = self.version
+            if version == last_version:
+                return None, version
+            if version % 2 == 1:
+                continue
+            values = np.array(self._data)
+            if self.version == version:
+                return values, version
+
+    def close(self):
+        self._version = self._data = None
+        if self.owner and os.path.exists(self.file_name):
+            os.remove(self.file_name)
+
+    def __getstate__(self):
+        return dict(size=self.size, file_name=self.file_name)
+
+    def __setstate__(self, d):
+        self.__init__(d['size'], d['file_name'])
+
+
 def _worker_init(G, id):
     if singleton_pool.n_parallel > 1:
         import os
@@ -41,6 +98,13 @@ def _worker_populate_task(G, env, policy, scope=None):
 
 def _worker_terminate_task(G, scope=None):
     G = _get_scoped_G(G, scope)
+    for shared in getattr(G, "shared_params", dict()).values():
+        shared.close()
+    G.shared_params = dict()
+    if getattr(G, "vec_envs", None):
+        for env in G.vec_envs[1:]:
+            env.terminate()
+        G.vec_envs = None
     if getattr(G, "env", None):
         G.env.terminate()
         G.env = None
@@ -74,11 +138,35 @@ def populate_task(env, policy, scope=None):
     logger.log("Populated")
 
 
+def _worker_populate_vec_envs(G, n_envs, scope=None):
+    G = _get_scoped_G(G, scope)
+    if has_batch_rollout(G.env):
+        # the env rolls out its n_envs copies itself
+        G.env.n_envs = n_envs
+        G.vec_envs = [G.env]
+    else:
+        G.vec_envs = [G.env] + [pickle.loads(pickle.dumps(G.env)) for _ in range(n_envs - 1)]
+
+
+def populate_vec_envs(n_envs, scope=None):
+    """
+    Give each worker n_envs copies of its env (the first one being the env itself), to be stepped in lock-step by
+    sample_paths(..., vectorized=True). Envs with a batch_rollout method are rolled out n_envs at a time by it instead.
+    Must be called after populate_task.
+    """
+    singleton_pool.run_each(
+        _worker_populate_vec_envs,
+        [(n_envs, scope)] * singleton_pool.n_parallel
+    )
+
+
 def terminate_task(scope=None):
     singleton_pool.run_each(
         _worker_terminate_task,
         [(scope,)] * singleton_pool.n_parallel
     )
+    for key in [key for key in _shared_params if key[0] == scope]:
+        _shared_params.pop(key).close()
     del _cached_populate_env[scope]
     del _cached_populate_policy[scope]
 
@@ -105,12 +193,76 @@ def _worker_set_env_params(G, params, scope=None):
     G.env.set_param_values(params)
 
 
+# (scope, 'policy' or 'env') -> SharedParams, on the master
+_shared_params = dict()
+
+
+def _close_shared_params():
+    for shared in _shared_params.values():
+        shared.close()
+    _shared_params.clear()
+
+
+atexit.register(_close_shared_params)
+
+
+def _worker_attach_shared_params(G, key, shared, scope=None):
+    G = _get_scoped_G(G, scope)
+    if not hasattr(G, "shared_params"):
+        G.shared_params = dict()
+        G.shared_param_versions = dict()
+    G.shared_params[key] = shared
+    G.shared_param_versions[key] = shared.version
+
+
+def _worker_sync_params(G):
+    """ Pick up the parameters published since the last rollout, if any. """
+    for key, shared in getattr(G, "shared_params", dict()).items():
+        values, version = shared.read(G.shared_param_versions[key])
+        if values is not None:
+            if key == "env":
+                for env in [G.env] + (getattr(G, "vec_envs", None) or [])[1:]:
+                    env.set_param_values(values)
+            else:
+                G.policy.set_param_values(values)
+            G.shared_param_versions[key] = version
+
+
+def _publish_params(key, params, scope=None):
+    """
+    Publish flat parameters for the workers to pick up at the start of their next rollout. The workers only need to
+    be synchronized with when the shared buffer is first created, or re-created because the size changed.
+    """
+    shared = _shared_params.get((scope, key))
+    if shared is None or shared.size != len(params):
+        if shared is not None:
+            shared.close()
+        shared = SharedParams(len(params))
+        _shared_params[(scope, key)] = shared
+        singleton_pool.run_each(
+            _worker_attach_shared_params,
+            [(key, shared, scope)] * singleton_pool.n_parallel
+        )
+    shared.publish(params)
+
+
 def _worker_collect_one_path(G, max_path_length, scope=None):
     G = _get_scoped_G(G, scope)
+    _worker_sync_params(G)
     path = rollout(G.env, G.policy, max_path_length)
     return path, len(path["rewards"])
 
 
+def _worker_collect_vec_paths(G, max_path_length, scope=None):
+    G = _get_scoped_G(G, scope)
+    _worker_sync_params(G)
+    if has_batch_rollout(G.env):
+        paths = G.env.batch_rollout(G.policy, max_path_length)
+    else:
+        paths = vectorized_rollout(G.vec_envs, G.policy, max_path_length)
+    return paths, sum(len(path["rewards"]) for path in paths)
+
+
 # def _worker_collect_one_path_snn(G, max_path_length, switch_lat_every=0, scope=None):
 #     G = _get_scoped_G(G, scope)
 #     path = rollout_snn(G.env, G.policy, max_path_length, switch_lat_every=switch_lat_every)
@@ -121,24 +273,43 @@ def sample_paths(
         max_samples,
         max_path_length=np.inf,
         env_params=None,
-        scope=None):
+        scope=None,
+        vectorized=False):
     """
-    :param policy_params: parameters for the policy. This will be updated on each worker process
+    :param policy_params: parameters for the policy. This will be updated on each worker process, at the start of
+    its next rollout
     :param max_samples: desired maximum number of samples to be collected. The actual number of collected samples
     might be greater since all trajectories will be rolled out either until termination or until max_path_length is
     reached
     :param max_path_length: horizon / maximum length of a single trajectory
+    :param vectorized: step the env copies set up by populate_vec_envs in lock-step, with one batched policy call per
+    timestep, instead of rolling out a single env at a time
     :return: a list of collected paths
     """
-    singleton_pool.run_each(
-        _worker_set_policy_params,
-        [(policy_params, scope)] * singleton_pool.n_parallel
-    )
-    if env_params is not None:
+    if singleton_pool.n_parallel > 1:
+        # the workers pick the new parameters up lazily, without a barrier
+        _publish_params("policy", policy_params, scope)
+    else:
         singleton_pool.run_each(
-            _worker_set_env_params,
-            [(env_params, scope)] * singleton_pool.n_parallel
+            _worker_set_policy_params,
+            [(policy_params, scope)] * singleton_pool.n_parallel
+        )
+    if env_params is not None:
+        if singleton_pool.n_parallel > 1 and isinstance(env_params, np.ndarray):
+            _publish_params("env", env_params, scope)
+        else:
+            singleton_pool.run_each(
+                _worker_set_env_params,
+                [(env_params, scope)] * singleton_pool.n_parallel
+            )
+    if vectorized:
+        path_batches = singleton_pool.run_collect(
+            _worker_collect_vec_paths,
+            threshold=max_samples,
+            args=(max_path_length, scope),
+            show_prog_bar=True
         )
+        return sum(path_batches, [])
     return singleton_pool.run_collect(
         _worker_collect_one_path,
         threshold=max_samples,
@@ -1,11 +1,18 @@
 from joblib.pool import MemmapingPool
 import multiprocessing as mp
 from rllab.misc import logger
+import numpy as np
+import os
+import pickle
 import pyprind
+import struct
+import tempfile
 import time
 import traceback
 import sys
 
+_SHM_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
 
 class ProgBarCounter(object):
     def __init__(self, total_count):
@@ -41,6 +48,8 @@ class StatefulPool(object):
         self.pool = None
         self.queue = None
         self.worker_queue = None
+        self.collect_counter = None
+        self.collect_done = None
         self.G = SharedGlobal()
 
     def initialize(self, n_parallel):
@@ -54,6 +63,9 @@ class StatefulPool(object):
         if n_parallel > 1:
             self.queue = mp.Queue()
             self.worker_queue = mp.Queue()
+            # created before forking the pool so that the workers inherit them
+            self.collect_counter = mp.Value('l', 0)
+            self.collect_done = mp.Event()
             # FIXME: memmap is slow.
             # self.pool = MemmapingPool(
             #     self.n_parallel,
@@ -101,13 +113,17 @@ class StatefulPool(object):
             for args in args_list:
                 yield runner(self.G, *args)
 
-    def run_collect(self, collect_once, threshold, args=None, show_prog_bar=True):
+    def run_collect(self, collect_once, threshold, args=None, show_prog_bar=True, use_shm=True):
         """
         Run the collector method using the worker pool. The collect_once method will receive 'G' as
         its first argument, followed by the provided args, if any. The method should return a pair of values.
         The first should be the object to be collected, and the second is the increment to be added.
         This will continue until the total ncrement reaches or exceeds the given threshold.
 
+        The workers share the increment through a counter in shared memory, and the one reaching the threshold wakes
+        up the master. With use_shm, each worker writes the numpy arrays of its collected objects to a single file in
+        /dev/shm instead of pickling them back through the pool, and the master reads them back as views of one buffer.
+
         Sample script:
 
         def collect_once(G):
@@ -122,29 +138,29 @@ class StatefulPool(object):
         if args is None:
             args = tuple()
         if self.pool:
-            manager = mp.Manager()
-            counter = manager.Value('i', 0)
-            lock = manager.RLock()
+            self.collect_counter.value = 0
+            self.collect_done.clear()
             results = self.pool.map_async(
                 _worker_run_collect,
-                [(collect_once, counter, lock, threshold, args)] * self.n_parallel
+                [(collect_once, threshold, args, use_shm)] * self.n_parallel
             )
             if show_prog_bar:
                 pbar = ProgBarCounter(threshold)
             last_value = 0
-            while True:
-                time.sleep(0.1)
-                with lock:
-                    if counter.value >= threshold:
-                        if show_prog_bar:
-                            pbar.stop()
-                        break
-                    if show_prog_bar:
-                        pbar.inc(counter.value - last_value)
-                    last_value = counter.value
+            # the timeout only serves the progress bar: the master is woken up as soon as the threshold is reached
+            while not self.collect_done.wait(0.1) and not results.ready():
+                if show_prog_bar:
+                    value = self.collect_counter.value
+                    pbar.inc(value - last_value)
+                    last_value = value
+            if show_prog_bar:
+                pbar.stop()
             print('Done sampling.')
             start = time.time()
-            out = sum(results.get(), [])
+            if use_shm:
+                out = sum([_load_collected(file_name) for file_name in results.get()], [])
+            else:
+                out = sum(results.get(), [])
             stop = time.time()
             print('Returning results ({} sec).'.format(stop - start))
             return out
@@ -181,22 +197,92 @@ def _worker_run_each(all_args):
 
 def _worker_run_collect(all_args):
     try:
-        collect_once, counter, lock, threshold, args = all_args
+        collect_once, threshold, args, use_shm = all_args
+        counter = singleton_pool.collect_counter
         collected = []
-        while True:
-            with lock:
-                if counter.value >= threshold:
-                    return collected
+        while counter.value < threshold:
             result, inc = collect_once(singleton_pool.G, *args)
             collected.append(result)
-            with lock:
+            with counter.get_lock():
                 counter.value += inc
-                if counter.value >= threshold:
-                    return collected
+                value = counter.value
+            if value >= threshold:
+                singleton_pool.collect_done.set()
+        if use_shm:
+            return _dump_collected(collected)
+        return collected
     except Exception:
         raise Exception("".join(traceback.format_exception(*sys.exc_info())))
 
 
+class _SharedArrayRef(object):
+    __slots__ = ['index']
+
+    def __init__(self, index):
+        self.index = index
+
+
+def _strip_arrays(obj, arrays):
+    """ Replace the numeric numpy arrays nested in dicts / lists / tuples by references into the arrays list. """
+    if isinstance(obj, np.ndarray) and obj.dtype != object:
+        arrays.append(obj)
+        return _SharedArrayRef(len(arrays) - 1)
+    if isinstance(obj, dict):
+        return {k: _strip_arrays(v, arrays) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_strip_arrays(v, arrays) for v in obj]
+    if isinstance(obj, tuple):
+        return tuple(_strip_arrays(v, arrays) for v in obj)
+    return obj
+
+
+def _restore_arrays(obj, arrays):
+    if isinstance(obj, _SharedArrayRef):
+        return arrays[obj.index]
+    if isinstance(obj, dict):
+        return {k: _restore_arrays(v, arrays) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_restore_arrays(v, arrays) for v in obj]
+    if isinstance(obj, tuple):
+        return tuple(_restore_arrays(v, arrays) for v in obj)
+    return obj
+
+
+def _dump_collected(collected):
+    """
+    Write the collected objects to a file in shared memory: a pickled skeleton where the arrays are replaced by
+    _SharedArrayRef, followed by the raw (16 bytes aligned) array data.
+    :return: the name of the file
+    """
+    arrays = []
+    skeleton = _strip_arrays(collected, arrays)
+    specs = []
+    offset = 0
+    for x in arrays:
+        specs.append((x.dtype, x.shape, offset))
+        offset += (x.nbytes + 15) // 16 * 16
+    header = pickle.dumps((skeleton, specs), protocol=pickle.HIGHEST_PROTOCOL)
+    fd, file_name = tempfile.mkstemp(prefix='rllab_collect_', dir=_SHM_DIR)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for x in arrays:
+            f.write(np.ascontiguousarray(x).tobytes())
+            f.write(b'\0' * ((-x.nbytes) % 16))
+    return file_name
+
+
+def _load_collected(file_name):
+    with open(file_name, 'rb') as f:
+        header_len = struct.unpack('<Q', f.read(8))[0]
+        skeleton, specs = pickle.loads(f.read(header_len))
+        buf = np.fromfile(f, dtype=np.uint8)
+    os.remove(file_name)
+    arrays = [buf[offset:offset + dtype.itemsize * int(np.prod(shape))].view(dtype).reshape(shape)
+              for dtype, shape, offset in specs]
+    return _restore_arrays(skeleton, arrays)
+
+
 def _worker_run_map(all_args):
     try:
         runner, args = all_args
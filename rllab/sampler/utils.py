@@ -3,13 +3,113 @@ from rllab.misc import tensor_utils
 import time
 
 
+class _ArrayBuffer(object):
+    """
+    Growable array whose dtype and row shape are taken from the first value written. It falls back to a plain list
+    (stacked at the end, as before) when the values are not numeric or do not keep the same shape.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.data = None
+        self.rows = None
+        self._check_dtype = False
+
+    def write(self, idx, value):
+        if self.rows is not None:
+            self.rows.append(value)
+            return
+        if self.data is None:
+            example = np.asarray(value)
+            if example.dtype.kind not in 'biufc':
+                self.rows = [value]
+                return
+            self.data = np.empty((self.capacity,) + example.shape, dtype=example.dtype)
+            # integer and boolean buffers could silently truncate later values
+            self._check_dtype = example.dtype.kind in 'biu'
+        elif idx >= len(self.data):
+            self.data = np.concatenate([self.data, np.empty_like(self.data)])
+        try:
+            self.data[idx] = value
+        except (ValueError, TypeError):
+            self.rows = list(self.data[:idx]) + [value]
+            self.data = None
+            return
+        if self._check_dtype and not np.array_equal(self.data[idx], value):
+            self.data = self.data.astype(np.result_type(self.data, np.asarray(value)))
+            self.data[idx] = value
+
+    def get(self, length):
+        if self.rows is not None:
+            return tensor_utils.stack_tensor_list(self.rows)
+        if self.data is None:
+            return np.asarray([])
+        if 2 * length >= len(self.data):
+            return self.data[:length]
+        # don't keep a mostly empty buffer alive behind a short path
+        return self.data[:length].copy()
+
+
+class _DictBuffer(object):
+    """ Nested _ArrayBuffer's for info dicts, with the keys taken from the first dict written. """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.buffers = None
+
+    def write(self, idx, value):
+        if self.buffers is None:
+            self.buffers = {k: _DictBuffer(self.capacity) if isinstance(v, dict) else _ArrayBuffer(self.capacity)
+                            for k, v in value.items()}
+        for k, buffer in self.buffers.items():
+            buffer.write(idx, value[k])
+
+    def get(self, length):
+        if self.buffers is None:
+            return dict()
+        return {k: buffer.get(length) for k, buffer in self.buffers.items()}
+
+
+class PathBuffer(object):
+    """
+    Collects a path step by step into arrays preallocated for max_path_length steps (grown by doubling when the
+    horizon is infinite), and hands them out trimmed to the actual path length.
+    """
+
+    def __init__(self, max_path_length=np.inf):
+        capacity = int(max_path_length) if max_path_length < np.inf else 128
+        self.length = 0
+        self.observations = _ArrayBuffer(capacity)
+        self.actions = _ArrayBuffer(capacity)
+        self.rewards = _ArrayBuffer(capacity)
+        self.agent_infos = _DictBuffer(capacity)
+        self.env_infos = _DictBuffer(capacity)
+        self.dones = _ArrayBuffer(capacity)
+
+    def append(self, observation, action, reward, agent_info, env_info, done):
+        idx = self.length
+        self.observations.write(idx, observation)
+        self.actions.write(idx, action)
+        self.rewards.write(idx, reward)
+        self.agent_infos.write(idx, agent_info)
+        self.env_infos.write(idx, env_info)
+        self.dones.write(idx, done)
+        self.length += 1
+
+    def to_path(self, last_obs):
+        return dict(
+            observations=self.observations.get(self.length),
+            actions=self.actions.get(self.length),
+            rewards=self.rewards.get(self.length),
+            agent_infos=self.agent_infos.get(self.length),
+            env_infos=self.env_infos.get(self.length),
+            dones=self.dones.get(self.length),
+            last_obs=last_obs,
+        )
+
+
 def rollout(env, agent, max_path_length=np.inf, animated=False, speedup=1, init_state=None, no_action = False):
-    observations = []
-    actions = []
-    rewards = []
-    agent_infos = []
-    env_infos = []
-    dones = []
+    path_buffer = PathBuffer(max_path_length)
     # no_action = True
     if init_state is not None:
         o = env.reset(init_state)
@@ -24,12 +124,7 @@ def rollout(env, agent, max_path_length=np.inf, animated=False, speedup=1, init_
         if no_action:
             a = np.zeros_like(a)
         next_o, r, d, env_info = env.step(a)
-        observations.append(env.observation_space.flatten(o))
-        rewards.append(r)
-        actions.append(env.action_space.flatten(a))
-        agent_infos.append(agent_info)
-        env_infos.append(env_info)
-        dones.append(d)
+        path_buffer.append(env.observation_space.flatten(o), env.action_space.flatten(a), r, agent_info, env_info, d)
         path_length += 1
         if d:
             break
@@ -41,12 +136,50 @@ def rollout(env, agent, max_path_length=np.inf, animated=False, speedup=1, init_
     if animated:
         env.render(close=False)
 
-    return dict(
-        observations=tensor_utils.stack_tensor_list(observations),
-        actions=tensor_utils.stack_tensor_list(actions),
-        rewards=tensor_utils.stack_tensor_list(rewards),
-        agent_infos=tensor_utils.stack_tensor_dict_list(agent_infos),
-        env_infos=tensor_utils.stack_tensor_dict_list(env_infos),
-        dones=np.asarray(dones),
-        last_obs=o,
-    )
+    return path_buffer.to_path(last_obs=o)
+
+
+def has_batch_rollout(env):
+    """
+    Whether env rolls out its copies itself, with a batch_rollout method. The method is looked up on the class of env,
+    since wrappers relay the attributes of the env they wrap: the batch_rollout of a wrapped env would skip the wrapper.
+    """
+    return callable(getattr(type(env), 'batch_rollout', None))
+
+
+def vectorized_rollout(envs, agent, max_path_length=np.inf, init_states=None):
+    """
+    Roll out one path on each of the given env copies in lock-step. The agent is queried once per timestep with the
+    observations of all the envs that are still running (through get_actions when it has it), and envs drop out of the
+    batch as soon as they are done.
+    :param envs: list of independent env copies
+    :param init_states: optional list with one init_state per env, passed to reset
+    :return: a list with one path per env, in the same format as the ones returned by rollout
+    """
+    if init_states is not None:
+        obs = [env.reset(init_state) for env, init_state in zip(envs, init_states)]
+    else:
+        obs = [env.reset() for env in envs]
+    agent.reset()
+    path_buffers = [PathBuffer(max_path_length) for _ in envs]
+    live = list(range(len(envs)))
+    path_length = 0
+    while len(live) > 0 and path_length < max_path_length:
+        if hasattr(agent, "get_actions"):
+            actions, agent_infos = agent.get_actions([obs[i] for i in live])
+            agent_infos = tensor_utils.split_tensor_dict_list(agent_infos) or [dict() for _ in live]
+        else:
+            actions, agent_infos = zip(*[agent.get_action(obs[i]) for i in live])
+        still_live = []
+        for i, a, agent_info in zip(live, actions, agent_infos):
+            env = envs[i]
+            next_o, r, d, env_info = env.step(a)
+            path_buffers[i].append(env.observation_space.flatten(obs[i]), env.action_space.flatten(a), r, agent_info,
+                                   env_info, d)
+            if not d:
+                obs[i] = next_o
+                still_live.append(i)
+        live = still_live
+        path_length += 1
+
+    return [path_buffer.to_path(last_obs=o) for path_buffer, o in zip(path_buffers, obs)]
@@ -0,0 +1,49 @@
+import numpy as np
+
+from rllab.algos.batch_polopt import BatchSampler
+from rllab.sampler import parallel_sampler
+from rllab.sampler.stateful_pool import singleton_pool
+from rllab.sampler.utils import has_batch_rollout
+
+
+class VectorizedSampler(BatchSampler):
+    """
+    Batch sampler where every worker steps n_envs copies of the env in lock-step, so that the policy is queried once
+    per timestep for all of them. Use it through BatchPolopt(..., sampler_cls=VectorizedSampler).
+    """
+
+    def __init__(self, algo, n_envs=None):
+        """
+        :type algo: BatchPolopt
+        :param n_envs: number of env copies per worker. By default, enough for one round of max_path_length long
+        paths on all the workers to fill the batch (at most 100 copies, unless the env rolls them out itself with
+        batch_rollout).
+        """
+        super(VectorizedSampler, self).__init__(algo)
+        assert not algo.policy.recurrent, "The vectorized sampler does not support recurrent policies"
+        if n_envs is None:
+            n_envs = int(np.ceil(algo.batch_size / (algo.max_path_length * singleton_pool.n_parallel)))
+            if not has_batch_rollout(algo.env):
+                n_envs = min(100, n_envs)
+            n_envs = max(1, n_envs)
+        self.n_envs = n_envs
+
+    def start_worker(self):
+        super(VectorizedSampler, self).start_worker()
+        parallel_sampler.populate_vec_envs(self.n_envs, scope=self.algo.scope)
+
+    def obtain_samples(self, itr, policy_params=None):
+        if policy_params is None:
+            policy_params = self.algo.policy.get_param_values()
+        paths = parallel_sampler.sample_paths(
+            policy_params=policy_params,
+            max_samples=self.algo.batch_size,
+            max_path_length=self.algo.max_path_length,
+            scope=self.algo.scope,
+            vectorized=True,
+        )
+        if self.algo.whole_paths:
+            return paths
+        else:
+            paths_truncated = parallel_sampler.truncate_paths(paths, self.algo.batch_size)
+            return paths_truncated
@@ -1,11 +1,14 @@
 import csv
 from rllab.misc import ext
+from rllab.misc import metrics_store
 import os
 import numpy as np
 import base64
 import pickle
 import json
 import itertools
+import hashlib
+import multiprocessing
 # import ipywidgets
 # import IPython.display
 # import plotly.offline as po
@@ -21,20 +24,35 @@ def flatten(l):
     return [item for sublist in l for item in sublist]
 
 
+def _to_float(v):
+    try:
+        return float(v)
+    except:
+        return 0.
+
+
 def load_progress(progress_csv_path):
+    store_path = metrics_store.store_path(progress_csv_path)
+    if metrics_store.is_store(store_path):
+        # the run was logged to a metrics store: read its columns directly rather than parsing the csv
+        print("Reading %s" % store_path)
+        entries = metrics_store.read_metrics(store_path)
+        return dict((k, v if v.dtype != object else np.array([_to_float(x) if x is not None else np.nan for x in v]))
+                    for k, v in entries.items())
     print("Reading %s" % progress_csv_path)
-    entries = dict()
     with open(progress_csv_path, 'r') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            for k, v in row.items():
-                if k not in entries:
-                    entries[k] = []
-                try:
-                    entries[k].append(float(v))
-                except:
-                    entries[k].append(0.)
-    entries = dict([(k, np.array(v)) for k, v in entries.items()])
+        reader = csv.reader(csvfile)
+        header = next(reader, [])
+        rows = [(row + [''] * len(header))[:len(header)] for row in reader]
+    entries = dict()
+    if len(rows) == 0:
+        return entries
+    # parse whole columns at once, only going cell by cell for the columns that are not all numbers
+    for k, column in zip(header, zip(*rows)):
+        try:
+            entries[k] = np.array(column, dtype=float)
+        except ValueError:
+            entries[k] = np.array([_to_float(v) for v in column])
     return entries
 
 
@@ -93,30 +111,128 @@ def lookup(d, keys):
     return d
 
 
-def load_exps_data(exp_folder_paths, disable_variant=False, ignore_missing_keys=False):
+CACHE_DIR = os.path.expanduser("~/.rllab/viskit_cache")
+
+# (exp_path, disable_variant) -> (signature, progress, params) of the experiments loaded by this process
+_exps_cache = dict()
+
+
+def _exp_files(exp_path, disable_variant):
+    """ Files an experiment is loaded from """
+    progress_csv_path = os.path.join(exp_path, "progress.csv")
+    files = [progress_csv_path, os.path.join(exp_path, "params.json")]
+    if not disable_variant:
+        files.append(os.path.join(exp_path, "variant.json"))
+    store_path = metrics_store.store_path(progress_csv_path)
+    if os.path.isdir(store_path):
+        files += [os.path.join(store_path, f) for f in sorted(os.listdir(store_path))]
+    return files
+
+
+def _exp_signature(exp_path, disable_variant):
+    """ (path, mtime, size) of the files an experiment is loaded from, with None for the missing ones """
+    signature = []
+    for file_name in _exp_files(exp_path, disable_variant):
+        try:
+            stat = os.stat(file_name)
+            signature.append((file_name, stat.st_mtime, stat.st_size))
+        except OSError:
+            signature.append((file_name, None, None))
+    return tuple(signature)
+
+
+def _cache_file(cache_dir, exp_path, disable_variant):
+    key = "%s:%s" % (os.path.abspath(exp_path), disable_variant)
+    return os.path.join(cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".pkl")
+
+
+def _load_exp(exp_path, disable_variant):
+    progress_csv_path = os.path.join(exp_path, "progress.csv")
+    progress = load_progress(progress_csv_path)
+    if disable_variant:
+        params = load_params(os.path.join(exp_path, "params.json"))
+    else:
+        try:
+            params = load_params(os.path.join(exp_path, "variant.json"))
+        except IOError:
+            params = load_params(os.path.join(exp_path, "params.json"))
+    return progress, params
+
+
+def _load_exp_cached(args):
+    """
+    Load an experiment, from its cache file in cache_dir if the signature of its files did not change
+    :return: (progress, params), or the IOError raised while loading it
+    """
+    exp_path, disable_variant, signature, cache_dir = args
+    cache_file = None if cache_dir is None else _cache_file(cache_dir, exp_path, disable_variant)
+    if cache_file is not None and os.path.exists(cache_file):
+        try:
+            with open(cache_file, "rb") as f:
+                cached_signature, progress, params = pickle.load(f)
+            if cached_signature == signature:
+                return progress, params
+        except Exception:
+            pass
+    try:
+        progress, params = _load_exp(exp_path, disable_variant)
+    except IOError as e:
+        return e
+    if cache_file is not None:
+        try:
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            tmp_file = "%s.%d.tmp" % (cache_file, os.getpid())
+            with open(tmp_file, "wb") as f:
+                pickle.dump((signature, progress, params), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, cache_file)
+        except (IOError, OSError) as e:
+            print("Could not cache %s: %s" % (exp_path, e))
+    return progress, params
+
+
+def load_exps_data(exp_folder_paths, disable_variant=False, ignore_missing_keys=False, cache_dir=CACHE_DIR,
+                   n_processes=None):
+    """
+    :param cache_dir: directory of the files caching the parsed experiments, which are reloaded only when the files
+    they were loaded from change. None to disable it.
+    :param n_processes: number of processes loading the experiments that are not in the cache of this process (from
+    the cache files or by parsing them), by default the number of cpus.
+    """
     exps = []
     for exp_folder_path in exp_folder_paths:
-        exps += [x[0] for x in os.walk(exp_folder_path, followlinks=True)]
+        exps += [x[0] for x in os.walk(exp_folder_path, followlinks=True)
+                 if not x[0].endswith(metrics_store.STORE_EXTENSION)]
     print("finished walking exp folders")
+    signatures = [_exp_signature(exp, disable_variant) for exp in exps]
+    # only the experiments that changed since this process last loaded them are read again
+    to_load = [(exp, disable_variant, signature, cache_dir) for exp, signature in zip(exps, signatures)
+               if _exps_cache.get((exp, disable_variant), (None,))[0] != signature]
+    if n_processes is None:
+        n_processes = multiprocessing.cpu_count()
+    n_processes = min(n_processes, len(to_load))
+    if n_processes > 1:
+        pool = multiprocessing.Pool(n_processes)
+        try:
+            loaded = pool.map(_load_exp_cached, to_load, chunksize=max(len(to_load) // (4 * n_processes), 1))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        loaded = [_load_exp_cached(exp_args) for exp_args in to_load]
+    for (exp, _, signature, _), result in zip(to_load, loaded):
+        if isinstance(result, IOError):
+            # also remembered, so that folders which are not experiments are not tried again until they change
+            print(result)
+            result = (None, None)
+        _exps_cache[(exp, disable_variant)] = (signature,) + tuple(result)
+
     exps_data = []
     for exp in exps:
-        try:
-            exp_path = exp
-            params_json_path = os.path.join(exp_path, "params.json")
-            variant_json_path = os.path.join(exp_path, "variant.json")
-            progress_csv_path = os.path.join(exp_path, "progress.csv")
-            progress = load_progress(progress_csv_path)
-            if disable_variant:
-                params = load_params(params_json_path)
-            else:
-                try:
-                    params = load_params(variant_json_path)
-                except IOError:
-                    params = load_params(params_json_path)
+        _, progress, params = _exps_cache[(exp, disable_variant)]
+        if progress is not None:
             exps_data.append(ext.AttrDict(
                 progress=progress, params=params, flat_params=flatten_dict(params)))
-        except IOError as e:
-            print(e)
 
     # a dictionary of all keys and types of values
     all_keys = dict()
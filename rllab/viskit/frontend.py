@@ -38,6 +38,7 @@ import itertools
 app = flask.Flask(__name__, static_url_path='/static')
 
 exps_data = None
+auto_reload = False
 plottable_keys = None
 distinct_params = None
 
@@ -612,7 +613,8 @@ def parse_float_arg(args, key):
 
 @app.route("/plot_div")
 def plot_div():
-    #     reload_data()
+    if auto_reload:
+        reload_data()
     args = flask.request.args
     plot_key = args.get("plot_key")
     split_key = args.get("split_key", "")
@@ -725,7 +727,8 @@ def reload_data():
     global exps_data
     global plottable_keys
     global distinct_params
-    exps_data = core.load_exps_data(args.data_paths, args.disable_variant)
+    exps_data = core.load_exps_data(args.data_paths, args.disable_variant,
+                                    cache_dir=None if args.no_cache else args.cache_dir, n_processes=args.n_processes)
     plottable_keys = sorted(list(
         set(flatten(list(exp.progress.keys()) for exp in exps_data))))
     distinct_params = sorted(core.extract_distinct_params(exps_data))
@@ -738,9 +741,17 @@ if __name__ == "__main__":
     parser.add_argument("--debug", action="store_true", default=False)
     parser.add_argument("--port", type=int, default=5000)
     parser.add_argument("--disable-variant", default=False, action='store_true')
+    parser.add_argument("--cache-dir", type=str, default=core.CACHE_DIR,
+        help='Directory of the cache of the parsed experiments')
+    parser.add_argument("--no-cache", default=False, action='store_true')
+    parser.add_argument("--n-processes", type=int, default=None,
+        help='Number of processes parsing the experiments, by default the number of cpus')
+    parser.add_argument("--auto-reload", default=False, action='store_true',
+        help='Reload the experiments that changed before each plot')
     parser.add_argument("-o", default=False, action='store_true',
         help='Open a brower tab automatically')
     args = parser.parse_args(sys.argv[1:])
+    auto_reload = args.auto_reload
 
     # load all folders following a prefix
     if args.prefix != "???":
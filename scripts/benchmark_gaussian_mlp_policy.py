@@ -0,0 +1,43 @@
+"""
+Time the numpy forward pass that GaussianMLPPolicy uses to sample actions against the compiled _f_dist, for a few
+batch sizes.
+"""
+import argparse
+import timeit
+
+import lasagne.nonlinearities as NL
+import numpy as np
+
+from rllab.envs.env_spec import EnvSpec
+from rllab.policies.gaussian_mlp_policy import GaussianMLPPolicy
+from rllab.spaces import Box
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--obs_dim', type=int, default=10,
+                        help='Dimension of the observations')
+    parser.add_argument('--action_dim', type=int, default=2,
+                        help='Dimension of the actions')
+    parser.add_argument('--hidden_sizes', type=int, nargs='+', default=[32, 32],
+                        help='Hidden layer sizes of the mean (and adaptive std) networks')
+    parser.add_argument('--adaptive_std', action='store_true', default=False,
+                        help='Whether the std is given by a network instead of learned parameters')
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 10, 100, 1000],
+                        help='Numbers of observations per call')
+    parser.add_argument('--n_calls', type=int, default=1000,
+                        help='Number of calls timed for each batch size')
+    args = parser.parse_args()
+
+    env_spec = EnvSpec(Box(-1, 1, (args.obs_dim,)), Box(-1, 1, (args.action_dim,)))
+    policy = GaussianMLPPolicy(env_spec, hidden_sizes=args.hidden_sizes, std_hidden_sizes=args.hidden_sizes,
+                               hidden_nonlinearity=NL.tanh, adaptive_std=args.adaptive_std)
+    print("numpy forward pass used: %s" % policy._use_numpy_forward)
+
+    print("%10s %16s %16s %10s" % ("batch", "_f_dist (us)", "numpy (us)", "speedup"))
+    for batch_size in args.batch_sizes:
+        flat_obs = np.random.randn(batch_size, args.obs_dim)
+        f_dist_time = min(timeit.repeat(lambda: policy._f_dist(flat_obs), number=args.n_calls, repeat=3))
+        numpy_time = min(timeit.repeat(lambda: policy._dist_info_n(flat_obs), number=args.n_calls, repeat=3))
+        print("%10d %16.1f %16.1f %10.1f" % (batch_size, f_dist_time / args.n_calls * 1e6,
+                                               numpy_time / args.n_calls * 1e6, f_dist_time / numpy_time))
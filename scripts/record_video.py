@@ -1,5 +1,5 @@
 import os.path as osp
-import joblib
+from rllab.misc.snapshot import load_snapshot
 from rllab import config
 import numpy as np
 import random
@@ -26,7 +26,7 @@ with tf.Session() as sess:
     console.mkdir_p(output_path)
 
     # import pdb; pdb.set_trace()
-    data = joblib.load(pkl_file)
+    data = load_snapshot(pkl_file)
 
     policy = data["policy"]
 
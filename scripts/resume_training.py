@@ -4,7 +4,7 @@
 from rllab.sampler.utils import rollout
 from rllab.algos.batch_polopt import BatchPolopt
 import argparse
-import joblib
+from rllab.misc.snapshot import load_snapshot
 import uuid
 import os
 import random
@@ -52,7 +52,7 @@ if __name__ == "__main__":
                 raise
     except IOError as e:
         logger.log("Failed to find json file. Continuing in non-stub mode...")
-        data = joblib.load(args.file)
+        data = load_snapshot(args.file)
         assert 'algo' in data
         algo = data['algo']
         assert isinstance(algo, BatchPolopt)
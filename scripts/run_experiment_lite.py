@@ -5,6 +5,8 @@ from rllab.misc.ext import is_iterable, set_seed
 from rllab.misc.instrument import concretize
 from rllab import config
 import rllab.misc.logger as logger
+from rllab.misc import metrics_store
+from rllab.misc import snapshot
 import argparse
 import os.path as osp
 import datetime
@@ -13,7 +15,6 @@ import ast
 import uuid
 import pickle as pickle
 import base64
-import joblib
 
 import logging
 
@@ -41,8 +42,18 @@ def run_experiment(argv):
                              '(do not save snapshots)')
     parser.add_argument('--snapshot_gap', type=int, default=1,
                         help='Gap between snapshot iterations.')
+    parser.add_argument('--snapshot_dedup', type=ast.literal_eval, default=False,
+                        help='Whether to store the objects that do not change between snapshots only once (see '
+                             'rllab.misc.snapshot)')
+    parser.add_argument('--snapshot_max_pending', type=int, default=2,
+                        help='Number of snapshots that can wait to be written on a background thread. 0 writes '
+                             'them synchronously.')
     parser.add_argument('--tabular_log_file', type=str, default='progress.csv',
                         help='Name of the tabular log file (in csv).')
+    parser.add_argument('--tabular_log_format', type=str, default='csv',
+                        help='Either "csv", to write the tabular log file during the run, or "store", to log to an '
+                             'append-only metrics store next to it (see rllab.misc.metrics_store), that is exported '
+                             'to the tabular log file at the end of the run')
     parser.add_argument('--text_log_file', type=str, default='debug.log',
                         help='Name of the text log file (in pure text).')
     parser.add_argument('--params_log_file', type=str, default='params.json',
@@ -83,6 +94,7 @@ def run_experiment(argv):
     else:
         log_dir = args.log_dir
     tabular_log_file = osp.join(log_dir, args.tabular_log_file)
+    metrics_store_dir = metrics_store.store_path(tabular_log_file)
     text_log_file = osp.join(log_dir, args.text_log_file)
     params_log_file = osp.join(log_dir, args.params_log_file)
 
@@ -97,18 +109,23 @@ def run_experiment(argv):
         logger.log_parameters_lite(params_log_file, args)
 
     logger.add_text_output(text_log_file)
-    logger.add_tabular_output(tabular_log_file)
+    if args.tabular_log_format == 'store':
+        logger.add_metrics_output(metrics_store_dir, csv_file=tabular_log_file)
+    else:
+        logger.add_tabular_output(tabular_log_file)
     prev_snapshot_dir = logger.get_snapshot_dir()
     prev_mode = logger.get_snapshot_mode()
     logger.set_snapshot_dir(log_dir)
     logger.set_tf_summary_dir(osp.join(log_dir, "tf_summary"))
     logger.set_snapshot_mode(args.snapshot_mode)
     logger.set_snapshot_gap(args.snapshot_gap)
+    logger.set_snapshot_dedup(args.snapshot_dedup)
+    logger.set_snapshot_max_pending(args.snapshot_max_pending)
     logger.set_log_tabular_only(args.log_tabular_only)
     logger.push_prefix("[%s] " % args.exp_name)
 
     if args.resume_from is not None:
-        data = joblib.load(args.resume_from)
+        data = snapshot.load_snapshot(args.resume_from)
         assert 'algo' in data
         algo = data['algo']
         maybe_iter = algo.train()
@@ -128,9 +145,11 @@ def run_experiment(argv):
                 for _ in maybe_iter:
                     pass
 
+    logger.wait_for_snapshots()
     logger.set_snapshot_mode(prev_mode)
     logger.set_snapshot_dir(prev_snapshot_dir)
     logger.remove_tabular_output(tabular_log_file)
+    logger.remove_metrics_output(metrics_store_dir)
     logger.remove_text_output(text_log_file)
     logger.pop_prefix()
 
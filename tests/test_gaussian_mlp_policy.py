@@ -0,0 +1,56 @@
+import lasagne.nonlinearities as NL
+import numpy as np
+import theano
+
+from rllab.envs.env_spec import EnvSpec
+from rllab.policies.gaussian_mlp_policy import GaussianMLPPolicy
+from rllab.spaces import Box
+
+OBS_DIM, ACTION_DIM = 6, 2
+
+POLICY_KWARGS = [
+    dict(),
+    dict(learn_std=False),
+    dict(hidden_sizes=(64, 64), hidden_nonlinearity=NL.rectify, output_nonlinearity=NL.tanh),
+    dict(hidden_nonlinearity=NL.sigmoid, min_std=None),
+    dict(adaptive_std=True),
+    dict(adaptive_std=True, min_std=0.5, std_hidden_sizes=(16,)),
+    # the std is clipped by min_std
+    dict(init_std=1e-8),
+]
+
+
+def _make_policy(**kwargs):
+    env_spec = EnvSpec(Box(-1, 1, (OBS_DIM,)), Box(-1, 1, (ACTION_DIM,)))
+    policy = GaussianMLPPolicy(env_spec, **kwargs)
+    # random weights, including the (learned or adaptive) log std
+    policy.set_param_values(np.random.randn(len(policy.get_param_values())))
+    return policy
+
+
+def _assert_same_dist_info(policy, flat_obs):
+    means, log_stds = policy._dist_info_n(flat_obs)
+    f_means, f_log_stds = policy._f_dist(flat_obs)
+    tolerance = 1e-5 if theano.config.floatX == 'float32' else 1e-10
+    for value, f_value in [(means, f_means), (log_stds, f_log_stds)]:
+        assert value.dtype == f_value.dtype, (value.dtype, f_value.dtype)
+        assert value.shape == f_value.shape, (value.shape, f_value.shape)
+        np.testing.assert_allclose(value, f_value, rtol=tolerance, atol=tolerance)
+
+
+def test_dist_info_n_matches_f_dist():
+    np.random.seed(0)
+    for kwargs in POLICY_KWARGS:
+        policy = _make_policy(**kwargs)
+        assert policy._use_numpy_forward, kwargs
+        for n_obs in (1, 50):
+            _assert_same_dist_info(policy, np.random.randn(n_obs, OBS_DIM))
+
+
+def test_dist_info_n_follows_param_updates():
+    np.random.seed(1)
+    policy = _make_policy(adaptive_std=True)
+    flat_obs = np.random.randn(10, OBS_DIM)
+    _assert_same_dist_info(policy, flat_obs)
+    policy.set_param_values(np.random.randn(len(policy.get_param_values())))
+    _assert_same_dist_info(policy, flat_obs)